@@ -0,0 +1,109 @@
+/*
+Migration for tournament databases created before tournaments could be archived.
+This script adds the archive tables and the functions that delete or archive a single tournament
+to a database created by an earlier tournament.sql. Run migrate_results.sql first if the
+database has no notifyresults() function.
+
+To run this file, start psql from the directory where this file is on your
+box and enter:
+"\c tournament"
+"\i migrate_archive.sql"
+from the psql console.
+*/
+
+BEGIN;
+
+/* Finished tournaments can be moved out of the live tables into the archive tables below, so that 
+the tables live events read and write hold only live events. An archived tournament keeps its name 
+and tiebreaks, each player's final record and its matches with their rounds. Its Opponents, 
+Standings, Rounds and Pairings rows are dropped. */
+
+CREATE TABLE ArchivedTournaments
+(id integer primary key,
+name text,
+tiebreaks text,
+archived timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE ArchivedRegistrants
+(tournament_id integer references ArchivedTournaments(id) ON DELETE CASCADE,
+player_id integer references Players(id) ON DELETE CASCADE,
+wins bigint NOT NULL DEFAULT 0,
+omw bigint NOT NULL DEFAULT 0,
+matches bigint NOT NULL DEFAULT 0,
+PRIMARY KEY (tournament_id, player_id)
+);
+
+CREATE TABLE ArchivedMatches
+(tournament_id integer,
+player_1 integer,
+player_2 integer,
+winner integer,
+round integer,
+FOREIGN KEY (tournament_id, player_1) REFERENCES ArchivedRegistrants(tournament_id, player_id) ON DELETE CASCADE,
+FOREIGN KEY (tournament_id, player_2) REFERENCES ArchivedRegistrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_1, player_2)
+);
+
+CREATE INDEX archivedmatches_player_2 ON ArchivedMatches(tournament_id, player_2);
+
+/* remove a live tournament with everything that refers to it: its registrants, matches, 
+opponents, standings, rounds and pairings. The standings triggers are skipped for the cascade, as 
+they would only undo its matches one by one. Returns false if there was no such tournament. */
+
+CREATE OR REPLACE FUNCTION droptournament(tournament integer)
+RETURNS boolean AS $$
+DECLARE
+	deferred text := current_setting('tournament.defer_standings');
+	live boolean;
+BEGIN
+	PERFORM lockstandings($1);
+	PERFORM set_config('tournament.defer_standings', 'on', true);
+	DELETE FROM Tournaments WHERE id = $1;
+	live := FOUND;
+	PERFORM set_config('tournament.defer_standings', deferred, true);
+	IF live THEN
+		PERFORM notifyresults($1);
+	END IF;
+	RETURN live;
+END
+$$ LANGUAGE plpgsql;
+
+--remove a tournament, live or archived. Returns false if there was no such tournament.
+
+CREATE OR REPLACE FUNCTION deletetournament(tournament integer)
+RETURNS boolean AS $$
+BEGIN
+	IF droptournament($1) THEN
+		RETURN true;
+	END IF;
+	DELETE FROM ArchivedTournaments WHERE id = $1;
+	RETURN FOUND;
+END
+$$ LANGUAGE plpgsql;
+
+/* move a live tournament to the archive tables, with one bulk INSERT for each, then remove it from 
+the live tables. Its players' records are archived as they are stored in Standings. Returns false 
+if there is no such live tournament. */
+
+CREATE OR REPLACE FUNCTION archivetournament(tournament integer)
+RETURNS boolean AS $$
+BEGIN
+	PERFORM lockstandings($1);
+	INSERT INTO ArchivedTournaments (id, name, tiebreaks)
+	SELECT id, name, tiebreaks FROM Tournaments WHERE id = $1;
+	IF NOT FOUND THEN
+		RETURN false;
+	END IF;
+	INSERT INTO ArchivedRegistrants (tournament_id, player_id, wins, omw, matches)
+	SELECT $1, Registrants.player_id, COALESCE(Standings.wins, 0), COALESCE(Standings.omw, 0), 
+	COALESCE(Standings.matches, 0)
+	FROM Registrants LEFT OUTER JOIN Standings USING (tournament_id, player_id)
+	WHERE Registrants.tournament_id = $1;
+	INSERT INTO ArchivedMatches (tournament_id, player_1, player_2, winner, round)
+	SELECT tournament_id, player_1, player_2, winner, round FROM Matches WHERE tournament_id = $1;
+	RETURN droptournament($1);
+END
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,77 @@
+/*
+Migration for tournament databases created before concurrent writers were supported.
+This script replaces the functions that maintain the Standings table of a database created by
+an earlier tournament.sql, so that the standings of a tournament are changed by one transaction
+at a time. It needs PostgreSQL 9.5 or higher, as does tournament.py.
+
+To run this file, start psql from the directory where this file is on your
+box and enter:
+"\c tournament"
+"\i migrate_concurrency.sql"
+from the psql console.
+*/
+
+BEGIN;
+
+/* the Standings rows of a tournament are changed by one transaction at a time. Applying a match 
+changes the rows of both players and of all their opponents, so two transactions applying matches 
+at once could lock the same rows in opposite orders and deadlock, and a rebuild could insert rows 
+another transaction is inserting too. The lock is a transaction-level advisory lock keyed 
+(1, tournament id), released at COMMIT or ROLLBACK. */
+
+CREATE OR REPLACE FUNCTION lockstandings(tournament integer)
+RETURNS void AS $$
+	SELECT pg_advisory_xact_lock(1, $1);
+$$ LANGUAGE SQL;
+
+--every registrant starts with an empty record
+
+CREATE OR REPLACE FUNCTION addstanding() RETURNS trigger AS $$
+BEGIN
+	PERFORM lockstandings(NEW.tournament_id);
+	INSERT INTO Standings (tournament_id, player_id) VALUES (NEW.tournament_id, NEW.player_id);
+	RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+--apply each match to the standings as it is recorded or removed
+
+CREATE OR REPLACE FUNCTION updatestandings() RETURNS trigger AS $$
+BEGIN
+	IF current_setting('tournament.defer_standings') = 'on' THEN
+		RETURN NULL;
+	END IF;
+	IF TG_OP = 'INSERT' THEN
+		PERFORM lockstandings(NEW.tournament_id);
+	ELSE
+		PERFORM lockstandings(OLD.tournament_id);
+	END IF;
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		PERFORM pairplayers(OLD.tournament_id, OLD.player_1, OLD.player_2, -1);
+		IF OLD.winner IS NOT NULL THEN
+			PERFORM creditwin(OLD.tournament_id, OLD.winner, 
+				OLD.player_1 + OLD.player_2 - OLD.winner, -1);
+		END IF;
+	END IF;
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		IF NEW.winner IS NOT NULL THEN
+			PERFORM creditwin(NEW.tournament_id, NEW.winner, 
+				NEW.player_1 + NEW.player_2 - NEW.winner, 1);
+		END IF;
+		PERFORM pairplayers(NEW.tournament_id, NEW.player_1, NEW.player_2, 1);
+	END IF;
+	RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+--recompute the Standings rows of a tournament from its matches
+
+CREATE OR REPLACE FUNCTION rebuildstandings(tournament integer)
+RETURNS void AS $$
+	SELECT lockstandings($1);
+	DELETE FROM Standings WHERE tournament_id = $1;
+	INSERT INTO Standings (tournament_id, player_id, wins, omw, matches)
+	SELECT $1, player_id, wins, omw, matches FROM computestandings($1);
+$$ LANGUAGE SQL;
+
+COMMIT;
@@ -0,0 +1,41 @@
+/*
+Migration for tournament databases created before rounds could be played as a whole.
+This script adds the Pairings table that startRound() stores the pairings of a round in to a
+database created by an earlier tournament.sql. Run migrate_standings.sql first if the database
+has no Standings table, and migrate_rounds.sql after this one.
+
+To run this file, start psql from the directory where this file is on your
+box and enter:
+"\c tournament"
+"\i migrate_pairings.sql"
+from the psql console.
+*/
+
+BEGIN;
+
+/* Create a table to store the pairings of each round while its results come in.
+startRound() stores the pairings of a round here as pending matches, one per board, best placed 
+players first. Results are recorded against them as they arrive (a tie is a reported pairing 
+without a winner), and the round is then committed into Matches all at once, with a single 
+standings update. Committed pairings are kept as the history of the rounds. */
+
+CREATE TABLE Pairings
+(tournament_id integer,
+round integer,
+board integer,
+player_1 integer,
+player_2 integer,
+winner integer CONSTRAINT pairing_player CHECK (winner IS NULL OR winner IN (player_1, player_2)),
+reported boolean NOT NULL DEFAULT false,
+committed boolean NOT NULL DEFAULT false,
+CONSTRAINT different_pairing_player CHECK (player_1 != player_2),
+FOREIGN KEY (tournament_id, player_1) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+FOREIGN KEY (tournament_id, player_2) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, round, board)
+);
+
+--results are looked up by the pair of players, whichever order they are given in
+
+CREATE UNIQUE INDEX pairings_matchup ON Pairings(tournament_id, round, LEAST(player_1, player_2), GREATEST(player_1, player_2));
+
+COMMIT;
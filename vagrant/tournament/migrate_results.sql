@@ -0,0 +1,71 @@
+/*
+Migration for tournament databases created before match results were announced.
+This script replaces the functions that maintain the Standings table of a database created by
+an earlier tournament.sql, so that every change to a tournament's matches is announced on the
+tournament_results channel. Run migrate_concurrency.sql first if the database has no
+lockstandings() function.
+
+To run this file, start psql from the directory where this file is on your
+box and enter:
+"\c tournament"
+"\i migrate_results.sql"
+from the psql console.
+*/
+
+BEGIN;
+
+/* tell listeners on the tournament_results channel that the matches of a tournament changed, with 
+its id as payload (see StandingsFeed in tournament.py). Notifications are delivered at COMMIT, and 
+identical ones from one transaction only once, so a transaction recording many results of a 
+tournament sends a single notification. Matches recorded with tournament.defer_standings on are 
+announced by rebuildstandings() instead. */
+
+CREATE OR REPLACE FUNCTION notifyresults(tournament integer)
+RETURNS void AS $$
+	SELECT pg_notify('tournament_results', $1::text);
+$$ LANGUAGE SQL;
+
+--apply each match to the standings as it is recorded or removed
+
+CREATE OR REPLACE FUNCTION updatestandings() RETURNS trigger AS $$
+BEGIN
+	IF current_setting('tournament.defer_standings') = 'on' THEN
+		RETURN NULL;
+	END IF;
+	IF TG_OP = 'INSERT' THEN
+		PERFORM lockstandings(NEW.tournament_id);
+		PERFORM notifyresults(NEW.tournament_id);
+	ELSE
+		PERFORM lockstandings(OLD.tournament_id);
+		PERFORM notifyresults(OLD.tournament_id);
+	END IF;
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		PERFORM pairplayers(OLD.tournament_id, OLD.player_1, OLD.player_2, -1);
+		IF OLD.winner IS NOT NULL THEN
+			PERFORM creditwin(OLD.tournament_id, OLD.winner, 
+				OLD.player_1 + OLD.player_2 - OLD.winner, -1);
+		END IF;
+	END IF;
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		IF NEW.winner IS NOT NULL THEN
+			PERFORM creditwin(NEW.tournament_id, NEW.winner, 
+				NEW.player_1 + NEW.player_2 - NEW.winner, 1);
+		END IF;
+		PERFORM pairplayers(NEW.tournament_id, NEW.player_1, NEW.player_2, 1);
+	END IF;
+	RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+--recompute the Standings rows of a tournament from its matches
+
+CREATE OR REPLACE FUNCTION rebuildstandings(tournament integer)
+RETURNS void AS $$
+	SELECT lockstandings($1);
+	DELETE FROM Standings WHERE tournament_id = $1;
+	INSERT INTO Standings (tournament_id, player_id, wins, omw, matches)
+	SELECT $1, player_id, wins, omw, matches FROM computestandings($1);
+	SELECT notifyresults($1);
+$$ LANGUAGE SQL;
+
+COMMIT;
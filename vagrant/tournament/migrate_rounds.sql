@@ -0,0 +1,101 @@
+/*
+Migration for tournament databases created before rounds were stored.
+This script adds the Rounds table, the round of each match and the Opponents table to a
+database created by an earlier tournament.sql, keeping every tournament, player, match and
+round in it. Run migrate_pairings.sql first if the database has no Pairings table.
+
+It runs in a single transaction, so it either migrates everything or nothing.
+To run this file, start psql from the directory where this file is on your
+box and enter:
+"\c tournament"
+"\i migrate_rounds.sql"
+from the psql console.
+*/
+
+BEGIN;
+
+-- the Standings table doesn't change, so its triggers can sit this out
+
+SET LOCAL tournament.defer_standings = 'on';
+
+-- rounds, from the pairings recorded so far
+
+CREATE TABLE Rounds
+(tournament_id integer references Tournaments(id) ON DELETE CASCADE,
+round integer,
+committed boolean NOT NULL DEFAULT false,
+PRIMARY KEY (tournament_id, round)
+);
+
+INSERT INTO Rounds (tournament_id, round, committed)
+SELECT tournament_id, round, bool_and(committed)
+FROM Pairings
+GROUP BY tournament_id, round;
+
+CREATE UNIQUE INDEX rounds_open ON Rounds(tournament_id) WHERE NOT committed;
+
+ALTER TABLE Pairings DROP COLUMN committed,
+ADD FOREIGN KEY (tournament_id, round) REFERENCES Rounds(tournament_id, round) ON DELETE CASCADE;
+
+-- the matches of committed rounds are the pairings they were committed from
+
+ALTER TABLE Matches ADD COLUMN round integer,
+ADD FOREIGN KEY (tournament_id, round) REFERENCES Rounds(tournament_id, round);
+
+UPDATE Matches SET round = Pairings.round
+FROM Pairings JOIN Rounds USING (tournament_id, round)
+WHERE Rounds.committed AND Pairings.tournament_id = Matches.tournament_id
+AND Pairings.player_1 = Matches.player_1 AND Pairings.player_2 = Matches.player_2;
+
+-- who has played whom, one row for each player of each match
+
+CREATE TABLE Opponents
+(tournament_id integer,
+player_id integer,
+opponent_id integer,
+FOREIGN KEY (tournament_id, player_id) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_id, opponent_id)
+);
+
+INSERT INTO Opponents (tournament_id, player_id, opponent_id)
+SELECT tournament_id, player_1, player_2 FROM Matches
+UNION ALL
+SELECT tournament_id, player_2, player_1 FROM Matches;
+
+CREATE OR REPLACE FUNCTION updateopponents() RETURNS trigger AS $$
+BEGIN
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		DELETE FROM Opponents WHERE tournament_id = OLD.tournament_id
+		AND (player_id, opponent_id) IN ((OLD.player_1, OLD.player_2), (OLD.player_2, OLD.player_1));
+	END IF;
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		INSERT INTO Opponents (tournament_id, player_id, opponent_id)
+		VALUES (NEW.tournament_id, NEW.player_1, NEW.player_2), (NEW.tournament_id, NEW.player_2, NEW.player_1);
+	END IF;
+	RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_opponents AFTER INSERT OR UPDATE OR DELETE ON Matches
+FOR EACH ROW EXECUTE PROCEDURE updateopponents();
+
+-- opponent lookups now read Opponents instead of both sides of Matches
+
+CREATE OR REPLACE VIEW v_registrant_matches AS
+SELECT Opponents.tournament_id, Opponents.player_id, count (*) AS matches
+FROM Opponents
+GROUP BY Opponents.tournament_id, Opponents.player_id;
+
+CREATE OR REPLACE FUNCTION creditwin(tournament integer, winner integer, loser integer, sign integer)
+RETURNS void AS $$
+	UPDATE Standings SET wins = wins + $4
+	WHERE tournament_id = $1 AND player_id = $2;
+	UPDATE Standings SET omw = omw + $4
+	WHERE tournament_id = $1 AND player_id IN (
+		SELECT opponent_id FROM Opponents WHERE tournament_id = $1 AND player_id = $2 AND opponent_id != $3);
+$$ LANGUAGE SQL;
+
+COMMIT;
+
+ANALYZE Rounds;
+ANALYZE Opponents;
@@ -0,0 +1,222 @@
+/*
+Migration for tournament databases created before standings were stored.
+This script adds the Standings table, the triggers that keep it up to date and the functions
+that compute, rebuild and check it to a database created by an earlier tournament.sql, along
+with the Matches indexes they use, and fills it from the matches already recorded. Every
+tournament, player and match in the database is kept. Run it before the other migrate_*.sql
+scripts, which expect the Standings table.
+
+It runs in a single transaction, so it either migrates everything or nothing.
+To run this file, start psql from the directory where this file is on your
+box and enter:
+"\c tournament"
+"\i migrate_standings.sql"
+from the psql console.
+*/
+
+BEGIN;
+
+/* when set to 'on' for a transaction, match triggers leave the Standings table alone (see below).
+New sessions get 'off' from the database; this one is set by hand. */
+
+DO $$
+BEGIN
+	EXECUTE format('ALTER DATABASE %I SET tournament.defer_standings = ''off''', current_database());
+END
+$$;
+
+SET tournament.defer_standings = 'off';
+
+/* Matches are always looked up within a single tournament. The primary key already serves 
+lookups by (tournament_id, player_1); these indexes serve lookups by the other player and by winner. */
+
+CREATE INDEX matches_player_2 ON Matches(tournament_id, player_2);
+CREATE INDEX matches_winner ON Matches(tournament_id, winner);
+
+-- OMW is now computed in one pass by computestandings(), not one player at a time
+
+DROP FUNCTION gettournamentomw(integer);
+DROP FUNCTION getplayeropponents(integer);
+
+-- the views are now grouped by tournament, so their columns change
+
+DROP VIEW v_wins;
+DROP VIEW v_registrant_matches;
+
+--view of the wins accumulated in each tournament
+
+CREATE VIEW v_wins AS
+SELECT Matches.tournament_id, Matches.winner AS player_id, count (*) as wins
+FROM Matches
+WHERE Matches.winner IS NOT NULL
+GROUP BY Matches.tournament_id, Matches.winner;
+
+--view of the matches for each registrant in each tournament
+
+CREATE VIEW v_registrant_matches AS
+SELECT Matches.tournament_id, sides.player_id, count (*) AS matches
+FROM Matches, LATERAL (VALUES (Matches.player_1), (Matches.player_2)) AS sides(player_id)
+GROUP BY Matches.tournament_id, sides.player_id;
+
+/* compute the standings of a tournament from scratch: id, wins, OMW, matches for every registrant.
+OMW (Opponent Match Wins) is the total number of wins, in this tournament, of every opponent a player has faced.
+The standings are computed in one pass over the tournament's matches: each match is read once and 
+turned into a result row for each of its players, which are then aggregated into records, and 
+the records of each player's opponents are summed into OMW. 
+This is used to build and check the Standings table below. */
+
+CREATE OR REPLACE FUNCTION computestandings(tournament integer)
+RETURNS TABLE(player_id int, wins bigint, omw bigint, matches bigint) AS $$
+	WITH results AS (
+		SELECT sides.player_id, sides.opponent_id, Matches.winner
+		FROM Matches, LATERAL (VALUES (Matches.player_1, Matches.player_2),
+			(Matches.player_2, Matches.player_1)) AS sides(player_id, opponent_id)
+		WHERE Matches.tournament_id = $1),
+	records AS (
+		SELECT results.player_id, count (*) AS matches,
+		sum (CASE WHEN results.winner = results.player_id THEN 1 ELSE 0 END) AS wins
+		FROM results
+		GROUP BY results.player_id),
+	omw AS (
+		SELECT results.player_id, sum (records.wins) AS omw
+		FROM results JOIN records ON (records.player_id = results.opponent_id)
+		GROUP BY results.player_id)
+	SELECT Registrants.player_id, 
+	COALESCE (records.wins, 0)::bigint AS wins,
+	COALESCE (omw.omw, 0)::bigint AS omw,
+	COALESCE (records.matches, 0) AS matches
+	FROM Registrants
+	LEFT OUTER JOIN records ON (Registrants.player_id = records.player_id)
+	LEFT OUTER JOIN omw ON (Registrants.player_id = omw.player_id)
+	WHERE Registrants.tournament_id = $1;
+$$ LANGUAGE SQL STABLE;
+
+/* Create a table to store the current standings of every registrant: wins, OMW and matches.
+The table is kept up to date by triggers on Registrants and Matches, in the same transaction as 
+the change, so reading the standings of a tournament is an index scan rather than a computation. */
+
+CREATE TABLE Standings
+(tournament_id integer,
+player_id integer,
+wins bigint NOT NULL DEFAULT 0,
+omw bigint NOT NULL DEFAULT 0,
+matches bigint NOT NULL DEFAULT 0,
+FOREIGN KEY (tournament_id, player_id) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_id)
+);
+
+CREATE INDEX standings_rank ON Standings(tournament_id, wins DESC, omw DESC, player_id);
+
+--every registrant starts with an empty record
+
+CREATE OR REPLACE FUNCTION addstanding() RETURNS trigger AS $$
+BEGIN
+	INSERT INTO Standings (tournament_id, player_id) VALUES (NEW.tournament_id, NEW.player_id);
+	RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER registrants_standings AFTER INSERT ON Registrants
+FOR EACH ROW EXECUTE PROCEDURE addstanding();
+
+/* credit (sign 1) or take back (sign -1) a win: the winner's wins change and so does the OMW of 
+every opponent they have played, apart from the opponent of the match being applied */
+
+CREATE OR REPLACE FUNCTION creditwin(tournament integer, winner integer, loser integer, sign integer)
+RETURNS void AS $$
+	UPDATE Standings SET wins = wins + $4
+	WHERE tournament_id = $1 AND player_id = $2;
+	UPDATE Standings SET omw = omw + $4
+	WHERE tournament_id = $1 AND player_id IN (
+		SELECT player_2 FROM Matches WHERE tournament_id = $1 AND player_1 = $2 AND player_2 != $3
+		UNION ALL
+		SELECT player_1 FROM Matches WHERE tournament_id = $1 AND player_2 = $2 AND player_1 != $3);
+$$ LANGUAGE SQL;
+
+/* add (sign 1) or remove (sign -1) a match between two players: each has one more or one fewer 
+match and gains or loses the other's wins from their OMW */
+
+CREATE OR REPLACE FUNCTION pairplayers(tournament integer, player_1 integer, player_2 integer, sign integer)
+RETURNS void AS $$
+	UPDATE Standings SET matches = Standings.matches + $4,
+	omw = Standings.omw + $4 * opponent.wins
+	FROM Standings opponent
+	WHERE Standings.tournament_id = $1 AND opponent.tournament_id = $1
+	AND ((Standings.player_id = $2 AND opponent.player_id = $3) 
+	OR (Standings.player_id = $3 AND opponent.player_id = $2));
+$$ LANGUAGE SQL;
+
+/* apply each match to the standings as it is recorded or removed.
+Bulk operations set tournament.defer_standings to 'on' for their transaction and call 
+rebuildstandings() once instead, which is cheaper than applying thousands of matches one by one. */
+
+CREATE OR REPLACE FUNCTION updatestandings() RETURNS trigger AS $$
+BEGIN
+	IF current_setting('tournament.defer_standings') = 'on' THEN
+		RETURN NULL;
+	END IF;
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		PERFORM pairplayers(OLD.tournament_id, OLD.player_1, OLD.player_2, -1);
+		IF OLD.winner IS NOT NULL THEN
+			PERFORM creditwin(OLD.tournament_id, OLD.winner, 
+				OLD.player_1 + OLD.player_2 - OLD.winner, -1);
+		END IF;
+	END IF;
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		IF NEW.winner IS NOT NULL THEN
+			PERFORM creditwin(NEW.tournament_id, NEW.winner, 
+				NEW.player_1 + NEW.player_2 - NEW.winner, 1);
+		END IF;
+		PERFORM pairplayers(NEW.tournament_id, NEW.player_1, NEW.player_2, 1);
+	END IF;
+	RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_standings AFTER INSERT OR UPDATE OR DELETE ON Matches
+FOR EACH ROW EXECUTE PROCEDURE updatestandings();
+
+--recompute the Standings rows of a tournament from its matches, to recover from any inconsistency
+
+CREATE OR REPLACE FUNCTION rebuildstandings(tournament integer)
+RETURNS void AS $$
+	DELETE FROM Standings WHERE tournament_id = $1;
+	INSERT INTO Standings (tournament_id, player_id, wins, omw, matches)
+	SELECT $1, player_id, wins, omw, matches FROM computestandings($1);
+$$ LANGUAGE SQL;
+
+--list the Standings rows of a tournament that don't match its matches, with stored and computed values
+
+CREATE OR REPLACE FUNCTION checkstandings(tournament integer)
+RETURNS TABLE(player_id int, wins bigint, computed_wins bigint, omw bigint, computed_omw bigint, 
+	matches bigint, computed_matches bigint) AS $$
+	SELECT COALESCE (stored.player_id, computed.player_id), 
+	stored.wins, computed.wins, stored.omw, computed.omw, stored.matches, computed.matches
+	FROM (SELECT * FROM Standings WHERE tournament_id = $1) stored
+	FULL OUTER JOIN computestandings($1) computed ON (stored.player_id = computed.player_id)
+	WHERE (stored.wins, stored.omw, stored.matches) 
+	IS DISTINCT FROM (computed.wins, computed.omw, computed.matches)
+	ORDER BY 1;
+$$ LANGUAGE SQL STABLE;
+
+/* compile the overall standings: id, name, wins, matches
+This function returns more data than is strictly needed to pass the test cases.
+It is limited in the python portion but could easily deliver all this information with minor modification. */
+
+CREATE OR REPLACE FUNCTION getstandings(tournament integer)
+RETURNS TABLE(tournament_id int, player_id int, name text, wins bigint, omw numeric, matches bigint) AS $$
+	SELECT Standings.tournament_id, Standings.player_id, Players.name, 
+	Standings.wins, Standings.omw::numeric, Standings.matches
+	FROM Standings JOIN Players ON (Standings.player_id = Players.id)
+	WHERE Standings.tournament_id = $1 AND Standings.player_id != 0
+	ORDER BY Standings.wins desc, Standings.omw desc, Standings.player_id;
+$$ LANGUAGE SQL STABLE;
+
+-- every registrant of every tournament starts from the matches recorded so far
+
+SELECT rebuildstandings(id) FROM Tournaments;
+
+COMMIT;
+
+ANALYZE Matches;
+ANALYZE Standings;
@@ -0,0 +1,14 @@
+/*
+Migration for tournament databases created before tournaments had tiebreaks.
+This script adds the tiebreaks column to the Tournaments table of a database created by an
+earlier tournament.sql; every existing tournament keeps ordering its standings by OMW.
+Run migrate_rounds.sql first if the database has no Rounds table.
+
+To run this file, start psql from the directory where this file is on your
+box and enter:
+"\c tournament"
+"\i migrate_tiebreaks.sql"
+from the psql console.
+*/
+
+ALTER TABLE Tournaments ADD COLUMN tiebreaks text;
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#
+# swiss.py -- Swiss-system pairing without rematches
+#
+# The pairing engine works on plain standings rows and a set of the pairs of
+# players who have already met, so it is shared by tournament.py and
+# tournament_state.py and never touches the database itself.
+
+from itertools import groupby
+
+# the bye round is played against this player id
+
+BYE = 0
+
+# how many times the pairing search may back out of a pair before giving up
+
+BACKTRACK_LIMIT = 100000
+
+
+class SearchExhausted(ValueError):
+    """The pairing search gave up after BACKTRACK_LIMIT backtracks.
+
+    Unlike a plain ValueError from pairings(), it doesn't mean that no
+    pairing without a rematch exists, only that none was found in time.
+    """
+
+
+def pairKey(player_1, player_2):
+    """Returns the key of a pair of players in a set of played pairs."""
+    if player_1 < player_2:
+        return (player_1, player_2)
+    return (player_2, player_1)
+
+
+def playedPairs(matches):
+    """Returns the set of played pairs for (player_1, player_2) tuples."""
+    return set(pairKey(player_1, player_2) for player_1, player_2 in matches)
+
+
+def byePlayers(played):
+    """Returns the ids of players who have already had a bye."""
+    return set(player_1 + player_2 - BYE
+               for player_1, player_2 in played if BYE in (player_1, player_2))
+
+
+def matchPlayers(players, played):
+    """Pairs every player in a list without repeating a played pair.
+
+    Each player, from the top of the list down, is paired with the highest
+    placed player left that they haven't met, backing out of earlier pairs
+    when the players further down can't all be paired.
+
+    Args:
+      players: standings rows, best placed first, with the id first.
+      played: a set of pairKey()s of players who have already met.
+
+    Returns:
+      A list of (row, row) pairs, or None if there is no such pairing.
+
+    Raises:
+      SearchExhausted: if the search backs out of BACKTRACK_LIMIT pairs
+        without settling whether there is one.
+    """
+    if len(players) % 2:
+        return None
+    # the best placed player is kept at the end, where popping is cheap
+    remaining = list(reversed(players))
+    pairs = []
+    start = None
+    backtracks = 0
+    while remaining:
+        top = remaining.pop()
+        k = len(remaining) - 1 if start is None else start
+        while k >= 0 and pairKey(top[0], remaining[k][0]) in played:
+            k -= 1
+        if k >= 0:
+            pairs.append((top, remaining.pop(k), k))
+            start = None
+            continue
+        remaining.append(top)
+        if not pairs:
+            return None
+        backtracks += 1
+        if backtracks > BACKTRACK_LIMIT:
+            raise SearchExhausted(
+                "Gave up pairing %d players at the limit of %d backtracks; a "
+                "pairing without a rematch may still exist." %
+                (len(players), BACKTRACK_LIMIT))
+        top, partner, k = pairs.pop()
+        remaining.insert(k, partner)
+        remaining.append(top)
+        start = k - 1
+    return [(player_1, player_2) for player_1, player_2, k in pairs]
+
+
+def pairBracket(players, played):
+    """Pairs a score bracket, floating players down if it can't be paired.
+
+    An odd bracket floats the lowest placed player it can; a bracket that
+    can't be paired at all, or that the search gives up on, floats every
+    player into the next bracket.
+
+    Returns:
+      A tuple of (pairs, floaters).
+    """
+    pairs = _tryPlayers(players, played)
+    if pairs is not None:
+        return pairs, []
+    if len(players) % 2:
+        for i in reversed(range(len(players))):
+            pairs = _tryPlayers(players[:i] + players[i + 1:], played)
+            if pairs is not None:
+                return pairs, [players[i]]
+    return [], list(players)
+
+
+def _tryPlayers(players, played):
+    """Returns matchPlayers(), or None if the search gives up, since
+    floating the players on is always safe."""
+    try:
+        return matchPlayers(players, played)
+    except SearchExhausted:
+        return None
+
+
+def brackets(standings):
+    """Splits standings rows into score brackets of players with equal wins."""
+    return [list(group)
+            for wins, group in groupby(standings, lambda row: row[2])]
+
+
+def pairRounds(standings, played):
+    """Pairs standings bracket by bracket, best placed brackets first.
+
+    Falls back to pairing the standings as a whole, across brackets, when
+    the floaters from the last bracket can't be paired.
+
+    Returns:
+      A list of (row, row) pairs, or None if there is no such pairing.
+
+    Raises:
+      SearchExhausted: if the search gives up on the fallback.
+    """
+    result = []
+    floaters = []
+    for bracket in brackets(standings):
+        pairs, floaters = pairBracket(floaters + bracket, played)
+        result.extend(pairs)
+    if floaters:
+        return matchPlayers(standings, played)
+    return result
+
+
+def pairings(standings, played, bye=False):
+    """Returns a list of pairs of players for the next round.
+
+    No pair of players is ever paired twice.  When bye is set, the highest
+    placed player who hasn't had a bye yet, and whose absence leaves the
+    others pairable, gets the bye round.  Only when everyone has had one
+    does a player get a second bye.
+
+    Args:
+      standings: (id, name, wins, ...) rows, best placed first.
+      played: a set of pairKey()s of players who have already met.
+      bye: whether one player sits out against the bye round.
+
+    Returns:
+      A list of (id1, name1, id2, name2) tuples, starting with the bye round
+      match-up if there is one.
+
+    Raises:
+      ValueError: if the players can't be paired without a rematch.
+      SearchExhausted: a ValueError, if the search gave up before finding
+        out whether they can.
+    """
+    if not bye:
+        pairs = pairRounds(standings, played)
+        if pairs is None:
+            raise ValueError(
+                "These players can't be paired without a rematch.")
+        return [row_1[:2] + row_2[:2] for row_1, row_2 in pairs]
+    # players who have had a bye only get another if nobody else can
+    byes = byePlayers(played)
+    candidates = sorted(range(len(standings)),
+                        key=lambda i: standings[i][0] in byes)
+    exhausted = None
+    for i in candidates:
+        row = standings[i]
+        try:
+            pairs = pairRounds(standings[:i] + standings[i + 1:], played)
+        except SearchExhausted as error:
+            exhausted = error
+            continue
+        if pairs is not None:
+            return ([row[:2] + (BYE, 'bye round')] +
+                    [row_1[:2] + row_2[:2] for row_1, row_2 in pairs])
+    if exhausted is not None:
+        raise exhausted
+    raise ValueError("These players can't be paired without a rematch.")
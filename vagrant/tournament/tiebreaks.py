@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#
+# tiebreaks.py -- tiebreak scores for Swiss-system standings
+#
+# Every tiebreak of every player in a tournament is computed in one pass
+# over the tournament's matches, with NumPy arrays indexed by player.
+# NumPy is only needed by tournaments that use these tiebreaks; the
+# standings stored in the database are ordered by wins and OMW without it.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the bye round is played against this player id, see swiss.py
+
+BYE = 0
+
+# match points for a win and a draw; a loss scores nothing
+
+WIN_POINTS = 3
+DRAW_POINTS = 1
+
+# the lowest match-win percentage an opponent counts for in omw_percent
+
+MATCH_WIN_FLOOR = 1.0 / 3
+
+# the tiebreaks a tournament can be ordered by:
+#   wins: matches won.
+#   points: match points, WIN_POINTS a win and DRAW_POINTS a draw.
+#   omw: the wins of every opponent, as stored in the Standings table.
+#   omw_percent: the mean match-win percentage of a player's opponents,
+#     each counted as at least MATCH_WIN_FLOOR.
+#   buchholz: the match points of every opponent.
+#   median_buchholz: buchholz without the best and worst opponent, for
+#     players with more than two opponents.
+#   sonneborn_berger: the match points of every opponent beaten, and half
+#     those of every opponent drawn with.
+# Byes count towards a player's own wins and points, but the bye round is
+# never counted as an opponent.
+
+TIEBREAKS = ("wins", "points", "omw", "omw_percent", "buchholz",
+             "median_buchholz", "sonneborn_berger")
+
+# the most memory computeTiebreaks() and rankPlayers() use, in bytes, for
+# each match and each player of a tournament: the packed matches, both
+# sides of each match with their results, and a score array per tiebreak,
+# plus the fixed cost of the small arrays and indexes every call makes
+
+MEMORY_FIXED = 64 * 1024
+MEMORY_PER_MATCH = 160
+MEMORY_PER_PLAYER = 400
+
+
+def checkTiebreaks(names):
+    """Raises ValueError unless names are known tiebreaks and NumPy is
+    available to compute them."""
+    unknown = [name for name in names if name not in TIEBREAKS]
+    if unknown:
+        raise ValueError(
+            "Unknown tiebreaks %s, use some of %s." %
+            (", ".join(unknown), ", ".join(TIEBREAKS)))
+    if numpy is None:
+        raise ValueError("Tiebreaks need NumPy, which isn't installed.")
+
+
+def memoryEstimate(players, matches):
+    """Returns the most bytes ranking a tournament of this size takes."""
+    return (MEMORY_FIXED + MEMORY_PER_PLAYER * players +
+            MEMORY_PER_MATCH * matches)
+
+
+def packMatches(matches):
+    """Packs (player_1, player_2, winner) rows into a matches array.
+
+    Returns:
+      An int32 array of one (player_1, player_2, winner) row per match, with
+      a winner of -1 for a tie.
+    """
+    checkTiebreaks(())
+    values = (-1 if value is None else value
+              for row in matches for value in row)
+    return numpy.fromiter(values, numpy.int32,
+                          3 * len(matches)).reshape(-1, 3)
+
+
+def parseMatches(text):
+    """Reads a matches array, as packMatches() returns, from the text of
+    COPY (SELECT player_1, player_2, COALESCE(winner, -1) ...) TO STDOUT.
+    """
+    checkTiebreaks(())
+    return numpy.fromstring(text, numpy.int32, sep=" ").reshape(-1, 3)
+
+
+def computeTiebreaks(players, matches):
+    """Computes every tiebreak for every player of a tournament.
+
+    Args:
+      players: player ids.
+      matches: (player_1, player_2, winner) rows, winner None for a tie,
+        or a matches array from packMatches() or parseMatches().  Every
+        player in them, the bye round apart, must be in players.
+
+    Returns:
+      A dict of a NumPy array for each of TIEBREAKS, and of the "matches"
+      and "draws" of each player, indexed like players.
+    """
+    checkTiebreaks(())
+    if not isinstance(matches, numpy.ndarray):
+        matches = packMatches(matches)
+    ids = numpy.append(numpy.asarray(players, dtype=numpy.int32), BYE)
+    order = numpy.argsort(ids, kind="mergesort")
+    n = len(ids)
+    # both sides of every match: a player, their opponent and the result
+    sorted_ids = ids[order]
+    one = order[numpy.searchsorted(sorted_ids, matches[:, 0])]
+    two = order[numpy.searchsorted(sorted_ids, matches[:, 1])]
+    player = numpy.concatenate([one, two])
+    opponent = numpy.concatenate([two, one])
+    tied = matches[:, 2] == -1
+    drew = numpy.concatenate([tied, tied])
+    won = numpy.concatenate([matches[:, 0] == matches[:, 2],
+                             matches[:, 1] == matches[:, 2]])
+    del one, two, tied
+    real = ids[opponent] != BYE
+
+    def total(weights, mask=None):
+        if mask is not None:
+            return numpy.bincount(player[mask], weights[mask], minlength=n)
+        return numpy.bincount(player, weights, minlength=n)
+
+    wins = total(won.astype(float))
+    points = total(WIN_POINTS * won + DRAW_POINTS * drew.astype(float))
+    played = total(numpy.ones(len(player)))
+    opponents = total(numpy.ones(len(player)), real)
+    percent = numpy.maximum(
+        points / numpy.maximum(WIN_POINTS * played, 1), MATCH_WIN_FLOOR)
+    buchholz = total(points[opponent], real)
+    # the best and worst opponent of each player
+    best = numpy.full(n, -numpy.inf)
+    worst = numpy.full(n, numpy.inf)
+    numpy.maximum.at(best, player[real], points[opponent][real])
+    numpy.minimum.at(worst, player[real], points[opponent][real])
+    median = buchholz.astype(float)
+    trimmed = opponents > 2
+    median[trimmed] -= best[trimmed] + worst[trimmed]
+    result = {
+        "matches": played,
+        "draws": total(drew.astype(float)),
+        "wins": wins,
+        "points": points,
+        "omw": total(wins[opponent]),
+        "omw_percent": total(percent[opponent], real) /
+        numpy.maximum(opponents, 1),
+        "buchholz": buchholz,
+        "median_buchholz": median,
+        "sonneborn_berger": total(
+            points[opponent] * (won + 0.5 * drew), real),
+    }
+    # drop the bye round, which was only there to index its matches
+    return dict((name, values[:-1]) for name, values in result.items())
+
+
+def rankPlayers(players, matches):
+    """Computes a tournament's standings from its matches, in memory.
+
+    Args:
+      players: (id, name) rows of every player to rank, but the bye round.
+      matches: (player_1, player_2, winner) rows or a matches array.
+
+    Returns:
+      (id, name, wins, matches) tuples ordered by wins, then OMW, then id,
+      as tournament.playerStandings() returns them.
+    """
+    if not len(players):
+        return []
+    ids = [row[0] for row in players]
+    scores = computeTiebreaks(ids, matches)
+    wins = scores["wins"].astype(numpy.int64)
+    played = scores["matches"].astype(numpy.int64)
+    order = numpy.lexsort((numpy.asarray(ids), -scores["omw"], -wins))
+    return [(ids[i], players[i][1], int(wins[i]), int(played[i]))
+            for i in order.tolist()]
+
+
+def sortStandings(standings, matches, names):
+    """Orders standings rows by tiebreaks, best placed first.
+
+    Args:
+      standings: (id, ...) rows of every player to order.
+      matches: (player_1, player_2, winner) rows of the tournament.
+      names: the tiebreaks to order by, most important first.  Players
+        still tied after all of them are ordered by id.
+
+    Returns:
+      The rows, reordered.
+    """
+    if not standings:
+        return list(standings)
+    scores = computeTiebreaks([row[0] for row in standings], matches)
+    # lexsort sorts by its last key first, and ascending
+    keys = [numpy.asarray([row[0] for row in standings])]
+    keys.extend(-scores[name] for name in reversed(names))
+    return [standings[i] for i in numpy.lexsort(keys)]
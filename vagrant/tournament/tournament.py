@@ -4,18 +4,609 @@
 # by Daniel McVicker, begun 2015-04-30
 # Completed 2015-06-15
 
-import psycopg2
+import argparse
+from collections import OrderedDict
+import io
+import itertools
+import multiprocessing
+import os
+import re
+import select
+import threading
+import time
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.pool
+    _connection = psycopg2.extensions.connection
+except ImportError:
+    # only the sqlite backend works without it, see configureBackend()
+    psycopg2 = None
+    _connection = object
+
+import swiss
+import tiebreaks
+from tournament_core import (
+    COUNT_PLAYERS_QUERY, CREATE_PLAYER_QUERY, CREATE_TOURNAMENT_QUERY,
+    ENSURE_TOURNAMENT_QUERY, ENTER_BYE_QUERY, ENTER_TOURNAMENT_QUERY,
+    IS_REGISTERED_QUERY, PLAYED_PAIRS_QUERY, REPORT_MATCH_QUERY,
+    SET_TIEBREAKS_QUERY, TIEBREAK_MATCHES_QUERY, TOURNAMENT_EXISTS_QUERY,
+    QueryStats, instrumented, log, matchRow, orderStandings, stats)
+
+# the database this module's functions use, see configureBackend(); the
+# TOURNAMENT_BACKEND environment variable chooses it when the module loads
+
+BACKENDS = ("postgres", "sqlite")
+BACKEND = os.environ.get("TOURNAMENT_BACKEND", "postgres")
+
+# connection settings, see configurePool()
+
+DSN = "dbname=tournament"
+POOL_MIN = 1
+POOL_MAX = 10
+POOL_TIMEOUT = 30
+POOL_PING_AFTER = 60
+
+# rows sent per multi-row INSERT by the bulk functions
+
+BATCH_SIZE = 1000
+
+# rows fetched per round trip by iterStandings(), and returned per page by
+# standingsPage()
+
+STREAM_SIZE = 1000
+PAGE_SIZE = 100
+
+# standings cached by configureCache() by default, and the channel other
+# processes are told about changed standings on
+
+CACHE_SIZE = 100
+NOTIFY_CHANNEL = "tournament_standings"
+
+# the channel the database announces changed match results on, with the
+# tournament id as payload (see notifyresults() in tournament.sql)
+
+RESULTS_CHANNEL = "tournament_results"
+
+# advisory locks on a tournament are keyed (kind, tournament id): kind 1 is
+# held while a transaction changes the tournament's standings (see
+# lockstandings() in tournament.sql) and PAIRING_LOCK while it pairs a round
+
+PAIRING_LOCK = 2
+
+# pairAll() only pairs tournaments on a pool of processes when they have at
+# least this many players in all: swiss.pairings() takes about a tenth of a
+# millisecond for 256 players, so fewer are paired faster than a pool starts
+
+PAIRING_POOL_PLAYERS = 100000
 
 # utility functions to deal with the database
 
 
-def connect():
+class TournamentConnection(_connection):
+    """A database connection that remembers its prepared statements."""
+
+    def __init__(self, *args, **kwargs):
+        super(TournamentConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def connect(dsn=None):
     """Connect to the PostgreSQL database.  Returns a database connection."""
-    pg = psycopg2.connect("dbname=tournament")
+    if psycopg2 is None:
+        raise ValueError("PostgreSQL needs psycopg2, which isn't installed.")
+    pg = psycopg2.connect(dsn or DSN, connection_factory=TournamentConnection)
     return pg
 
 
-def sql(type, query, params=()):
+class ConnectionPool(object):
+    """A thread-safe pool of reusable connections to the tournament database.
+
+    Pooled connections run in autocommit mode, so a single statement costs a
+    single round trip.  Connections are health checked when they are borrowed
+    and replaced when they turn out to be broken.
+
+    Args:
+      minconn: the number of connections opened up front.
+      maxconn: the most connections the pool will ever hold open.
+      dsn: the database to connect to, defaults to DSN.
+      timeout: seconds to wait for a free connection before giving up.
+      ping_after: connections idle for longer than this many seconds are
+        pinged before they are handed out.
+    """
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, dsn=None,
+                 timeout=POOL_TIMEOUT, ping_after=POOL_PING_AFTER):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(
+                "Pool sizes must satisfy 0 <= minconn <= maxconn, maxconn > 0")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.dsn = dsn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._lock = threading.Condition()
+        # idle connections paired with the time they were last returned
+        self._idle = []
+        self._open = 0
+        for i in range(minconn):
+            self._idle.append((self._connect(), time.time()))
+            self._open += 1
+
+    def _connect(self):
+        pg = connect(self.dsn)
+        pg.autocommit = True
+        return pg
+
+    def _healthy(self, pg, last_used):
+        """Determines if an idle connection is still usable."""
+        if pg.closed:
+            return False
+        if time.time() - last_used < self.ping_after:
+            return True
+        try:
+            c = pg.cursor()
+            c.execute("SELECT 1")
+            c.close()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def getconn(self):
+        """Borrows a healthy connection, opening a new one if needed."""
+        deadline = time.time() + self.timeout
+        with self._lock:
+            while not self._idle and self._open >= self.maxconn:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(
+                        "No connection available after %s seconds." %
+                        self.timeout)
+                self._lock.wait(remaining)
+            if self._idle:
+                pg, last_used = self._idle.pop()
+            else:
+                pg, last_used = None, None
+                self._open += 1
+        if pg is not None:
+            if self._healthy(pg, last_used):
+                return pg
+            # replace the broken connection, keeping its slot in the pool
+            self._close(pg)
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+
+    def putconn(self, pg, broken=False):
+        """Returns a borrowed connection to the pool.
+
+        Connections that are broken, or that were left inside a transaction
+        that can't be rolled back, are closed instead of being reused.
+        """
+        if not broken and not pg.closed:
+            status = pg.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                broken = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    pg.rollback()
+                except psycopg2.Error:
+                    broken = True
+        with self._lock:
+            if broken or pg.closed:
+                self._close(pg)
+                self._open -= 1
+            else:
+                self._idle.append((pg, time.time()))
+            self._lock.notify()
+
+    def closeall(self):
+        """Closes every idle connection in the pool."""
+        with self._lock:
+            for pg, last_used in self._idle:
+                self._close(pg)
+            self._open -= len(self._idle)
+            self._idle = []
+            self._lock.notify_all()
+
+    def _close(self, pg):
+        try:
+            pg.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool = None
+_pool_settings = {"minconn": POOL_MIN, "maxconn": POOL_MAX}
+_pool_lock = threading.Lock()
+
+
+def configureBackend(backend="postgres", database=None):
+    """Chooses the database behind this module's functions.
+
+    "postgres" is the server in DSN.  "sqlite" runs the functions
+    tournament_sqlite.py has on its embedded database, in the file database
+    if one is given, and adds its configureDatabase() and closeDatabase();
+    the functions that need PostgreSQL, such as startRound(), raise
+    ValueError instead.  Names imported from this module before the switch
+    keep the functions they had.
+
+    Raises:
+      ValueError: if the backend is unknown.
+    """
+    global BACKEND
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend %s, use one of %s." %
+                         (backend, ", ".join(BACKENDS)))
+    functions = dict(_postgres)
+    if backend == "sqlite":
+        import tournament_sqlite
+        for name in functions:
+            functions[name] = getattr(tournament_sqlite, name, None) or \
+                _needsPostgres(name)
+        functions["configureDatabase"] = tournament_sqlite.configureDatabase
+        functions["closeDatabase"] = tournament_sqlite.closeDatabase
+        if database is not None:
+            tournament_sqlite.configureDatabase(database)
+    else:
+        globals().pop("configureDatabase", None)
+        globals().pop("closeDatabase", None)
+    globals().update(functions)
+    BACKEND = backend
+
+
+def _needsPostgres(name):
+    def needsPostgres(*args, **kwargs):
+        raise ValueError("%s() needs PostgreSQL, the backend is %s." %
+                         (name, BACKEND))
+    needsPostgres.__name__ = name
+    return needsPostgres
+
+
+def configurePool(minconn=POOL_MIN, maxconn=POOL_MAX, dsn=None,
+                  timeout=POOL_TIMEOUT, ping_after=POOL_PING_AFTER):
+    """Configures the connection pool used by sql().
+
+    The pool itself is created on first use.  A maxconn of 0 turns pooling
+    off, so that every statement opens and closes its own connection.
+    """
+    global _pool_settings
+    closePool()
+    _pool_settings = {"minconn": minconn, "maxconn": maxconn, "dsn": dsn,
+                      "timeout": timeout, "ping_after": ping_after}
+
+
+def closePool():
+    """Closes the connection pool.  It is recreated on the next query."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+
+
+def getPool():
+    """Returns the module connection pool, or None if pooling is off."""
+    global _pool
+    if _pool_settings["maxconn"] == 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(**_pool_settings)
+        return _pool
+
+
+class StandingsCache(object):
+    """A least recently used cache of playerStandings() results.
+
+    Each tournament has a version that is bumped whenever its standings
+    change, once the change has been committed.  A cached result is only
+    returned while its tournament is still at the version it was read at,
+    so a read racing with a write can never be cached as current.
+
+    Attributes:
+      size: the most tournaments cached at once; 0 turns the cache off.
+      hits, misses: the lookups answered from the cache, and not.
+      evictions: the results dropped to make room for others.
+      invalidations: the version bumps, per tournament or for all of them.
+    """
+
+    def __init__(self, size=0):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._epoch = 0
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        """Clears every count."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.invalidations = 0
+
+    def resize(self, size):
+        """Changes the size of the cache, dropping every cached result."""
+        with self._lock:
+            self.size = size
+            self._entries.clear()
+
+    def version(self, tournament):
+        """Returns the current version of a tournament's standings."""
+        with self._lock:
+            return (self._epoch, self._versions.get(tournament, 0))
+
+    def get(self, tournament):
+        """Returns the cached standings of a tournament, or None."""
+        with self._lock:
+            entry = self._entries.get(tournament)
+            if entry is None or entry[0] != (
+                    self._epoch, self._versions.get(tournament, 0)):
+                self.misses += 1
+                return None
+            # move the tournament to the most recently used end
+            del self._entries[tournament]
+            self._entries[tournament] = entry
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, tournament, version, rows):
+        """Caches standings read at version, unless they have changed."""
+        with self._lock:
+            if self.size <= 0 or version != (
+                    self._epoch, self._versions.get(tournament, 0)):
+                return
+            self._entries.pop(tournament, None)
+            self._entries[tournament] = (version, tuple(rows))
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tournament=None):
+        """Bumps the version of a tournament, or of every tournament."""
+        with self._lock:
+            self.invalidations += 1
+            if tournament is None:
+                self._epoch += 1
+                self._versions.clear()
+                self._entries.clear()
+            else:
+                self._versions[tournament] = \
+                    self._versions.get(tournament, 0) + 1
+                self._entries.pop(tournament, None)
+
+    def asDict(self):
+        """Returns the counts as a dict, like QueryStats.asDict()."""
+        with self._lock:
+            return {"size": self.size, "cached": len(self._entries),
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "invalidations": self.invalidations}
+
+
+cache = StandingsCache()
+
+
+class StandingsListener(threading.Thread):
+    """Invalidates cached standings when another process changes them.
+
+    The listener waits for notifications on NOTIFY_CHANNEL on a connection
+    of its own, outside the pool.  If that connection is lost, every cached
+    result is dropped, since notifications may have been missed, and the
+    listener reconnects.
+    """
+
+    def __init__(self, dsn=None, poll=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.dsn = dsn
+        self.poll = poll
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """Stops listening and waits for the thread to finish."""
+        self._stopping.set()
+        self.join()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+            except psycopg2.Error as error:
+                log.warning("Standings listener lost its connection: %s",
+                            error)
+            cache.invalidate()
+            self._stopping.wait(self.poll)
+
+    def _listen(self):
+        pg = connect(self.dsn)
+        try:
+            pg.autocommit = True
+            c = pg.cursor()
+            c.execute("LISTEN " + NOTIFY_CHANNEL)
+            c.close()
+            # anything may have changed before the listener started
+            cache.invalidate()
+            while not self._stopping.is_set():
+                if not select.select([pg], [], [], self.poll)[0]:
+                    continue
+                pg.poll()
+                while pg.notifies:
+                    payload = pg.notifies.pop(0).payload
+                    cache.invalidate(int(payload) if payload else None)
+        finally:
+            pg.close()
+
+
+_listener = None
+_cache_settings = {"notify": False}
+
+
+def configureCache(size=CACHE_SIZE, notify=False, dsn=None):
+    """Configures the standings cache used by playerStandings().
+
+    The cache is off until this is called.  A size of 0 turns it off again.
+    Either way, the cache is emptied and its counts are reset.
+
+    Writes made through this module invalidate the cache as they commit.
+    When other processes also write to the database, every one of them
+    should pass notify=True: changes are then announced with NOTIFY, and
+    a background thread listens for the other processes' announcements.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    cache.resize(size)
+    cache.invalidate()
+    cache.reset()
+    _cache_settings["notify"] = notify
+    if notify and size > 0:
+        _listener = StandingsListener(dsn or _pool_settings.get("dsn"))
+        _listener.start()
+
+
+class StandingsFeed(object):
+    """Follows the standings of tournaments as results are recorded.
+
+    The feed listens on RESULTS_CHANNEL on a connection of its own, so it
+    sees results recorded by any process, however they were reported.
+    Whenever a tournament's matches change, its standings are read once,
+    compared with the last ones the feed saw, and only the differences are
+    handed on:
+
+        feed = StandingsFeed([1])
+        for tournament, changed, removed in feed:
+            update(changed, removed)
+
+    Args:
+      tournaments: the tournaments to follow, or None for every tournament.
+        The standings of a tournament the feed wasn't given are first read
+        when its results change, so all of its players show as changed.
+      dsn: the database to listen to, by default that of the pool.
+    """
+
+    def __init__(self, tournaments=None, dsn=None):
+        self.tournaments = None if tournaments is None else set(tournaments)
+        self.dsn = dsn or _pool_settings.get("dsn")
+        self._standings = {}
+        self._pg = None
+        self._connect()
+        # read after listening, so no result can slip in between
+        for tournament in self.tournaments or ():
+            self._standings[tournament] = self._read(tournament)
+
+    def _connect(self):
+        self._pg = connect(self.dsn)
+        self._pg.autocommit = True
+        c = self._pg.cursor()
+        c.execute("LISTEN " + RESULTS_CHANNEL)
+        c.close()
+
+    def _read(self, tournament):
+        query = ("SELECT player_id, name, wins, matches, omw "
+                 "FROM getstandings(%s)")
+        fetch = _run(self._pg, "fetchall", query, (tournament,))
+        return dict((row[0], tuple(row)) for row in fetch)
+
+    def close(self):
+        """Stops listening."""
+        if self._pg is not None:
+            self._pg.close()
+            self._pg = None
+
+    def poll(self, timeout=None):
+        """Waits up to timeout seconds, or for ever if it's None, for
+        results to be recorded.
+
+        Returns:
+          A list of (tournament, changed, removed) tuples, one for each
+          tournament whose standings changed:
+            changed: (id, name, wins, matches, omw) rows of every player
+              whose wins, matches or OMW changed, or who is new, ordered
+              like playerStandings().
+            removed: the ids of players no longer in the tournament.
+          The list is empty if nothing was recorded in time.
+        """
+        try:
+            if not select.select([self._pg], [], [], timeout)[0]:
+                return []
+            self._pg.poll()
+            notified = set()
+            while self._pg.notifies:
+                notified.add(int(self._pg.notifies.pop(0).payload))
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as error:
+            log.warning("Standings feed lost its connection: %s", error)
+            self.close()
+            self._connect()
+            # results may have been missed, so check every tournament
+            notified = set(self._standings)
+        if self.tournaments is not None:
+            notified &= self.tournaments
+        deltas = []
+        for tournament in sorted(notified):
+            before = self._standings.get(tournament, {})
+            after = self._read(tournament)
+            self._standings[tournament] = after
+            changed = [row for player_id, row in after.items()
+                       if before.get(player_id) != row]
+            changed.sort(key=lambda row: (-row[2], -row[4], row[0]))
+            removed = sorted(set(before) - set(after))
+            if changed or removed:
+                deltas.append((tournament, changed, removed))
+        return deltas
+
+    def __iter__(self):
+        while True:
+            for delta in self.poll():
+                yield delta
+
+
+def _numbered(query):
+    """Rewrites %s placeholders as $1, $2, ... for PREPARE."""
+    count = [0]
+
+    def number(match):
+        count[0] += 1
+        return "$%d" % count[0]
+    return re.sub("%s", number, query)
+
+
+def _run(pg, type, query, params, prepare=None):
+    """Executes a query on a connection and fetches its result.
+
+    If prepare names the query, it runs as a server-side prepared
+    statement, which is prepared the first time the connection sees it.
+    """
+    c = pg.cursor()
+    start = time.time()
+    if prepare is not None and hasattr(pg, "prepared"):
+        if prepare not in pg.prepared:
+            c.execute("PREPARE %s AS %s" % (prepare, _numbered(query)))
+            pg.prepared.add(prepare)
+        c.execute("EXECUTE %s (%s)" %
+                  (prepare, ", ".join(["%s"] * len(params))), params)
+    else:
+        c.execute(query, params)
+    if type == "fetchone":
+        result = c.fetchone()
+    elif type == "fetchall":
+        result = c.fetchall()
+    else:
+        result = None
+    stats.recordQuery(query, time.time() - start, max(c.rowcount, 0))
+    c.close()
+    return result
+
+
+def sql(type, query, params=(), session=None, prepare=None):
     """Runs SQL commands in the tournament database.
 
     Args:
@@ -29,99 +620,349 @@ def sql(type, query, params=()):
 
     params are the parameters you use for parameter replacement in the query.
 
+    session is an open Transaction to run the query in.  Without one, the
+    query runs and commits on its own.
+
+    prepare is a name for the query, for hot queries that are worth running
+    as server-side prepared statements on pooled connections.
+
+    Connections are borrowed from the module pool (see configurePool).  A read
+    that fails because its connection was broken is retried once on a fresh
+    connection; writes are never retried, since they may have been applied.
+
     """
     if type not in ["commit", "fetchone", "fetchall"]:
         raise ValueError(
             "Type unknown, use \"commit\", \"fetchone\", or \"fetchall.\"")
-    pg = connect()
-    c = pg.cursor()
-    c.execute(query, params)
-    if type == "commit":
-        pg.commit()
-        result = None
-    elif type == "fetchone":
-        result = c.fetchone()
-    elif type == "fetchall":
-        result = c.fetchall()
-    pg.close()
-    return result
+    if session is not None:
+        return session.execute(type, query, params, prepare)
+    pool = getPool()
+    if pool is None:
+        pg = connect(_pool_settings.get("dsn"))
+        try:
+            result = _run(pg, type, query, params)
+            if type == "commit":
+                pg.commit()
+        finally:
+            pg.close()
+        return result
+    attempts = 1 if type == "commit" else 2
+    while True:
+        attempts -= 1
+        pg = pool.getconn()
+        try:
+            result = _run(pg, type, query, params, prepare)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = bool(pg.closed)
+            pool.putconn(pg, broken)
+            if broken and attempts > 0:
+                continue
+            raise
+        except Exception:
+            pool.putconn(pg)
+            raise
+        pool.putconn(pg)
+        return result
+
+
+class Transaction(object):
+    """A unit of work: tournament operations sharing one connection and commit.
+
+    Every public function takes an optional session argument.  Passing the
+    same Transaction to several calls runs them all on one connection, and
+    commits them together when the outermost with block exits (or rolls them
+    all back if it raises).  Transactions nest, so functions that open their
+    own transaction can be composed inside a caller's:
+
+        with transaction() as t:
+            createTournament(2, "Club Night", session=t)
+            for name in roster:
+                registerPlayer(name, 2, session=t)
+    """
+
+    def __init__(self):
+        self._pg = None
+        self._pool = None
+        self._depth = 0
+        self._on_commit = []
+
+    def __enter__(self):
+        if self._depth == 0:
+            self._begin()
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth == 0:
+            self._end(exc_type is None)
+        return False
+
+    def _begin(self):
+        self._pool = getPool()
+        if self._pool is None:
+            self._pg = connect(_pool_settings.get("dsn"))
+        else:
+            self._pg = self._pool.getconn()
+            self._pg.autocommit = False
+
+    def _end(self, commit):
+        pg, pool = self._pg, self._pool
+        self._pg = self._pool = None
+        callbacks, self._on_commit = self._on_commit, []
+        broken = False
+        try:
+            if commit:
+                pg.commit()
+            else:
+                pg.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = bool(pg.closed)
+            raise
+        finally:
+            if pool is None:
+                pg.close()
+            else:
+                if not broken and not pg.closed:
+                    if pg.get_transaction_status() != \
+                            psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        pg.rollback()
+                    pg.autocommit = True
+                pool.putconn(pg, broken)
+        if commit:
+            for callback in callbacks:
+                callback()
+
+    def onCommit(self, callback):
+        """Calls callback once the transaction has committed."""
+        if self._pg is None:
+            raise ValueError(
+                "Transaction is not open, use it in a with block.")
+        self._on_commit.append(callback)
+
+    def execute(self, type, query, params=(), prepare=None):
+        """Runs a query inside the transaction, see sql()."""
+        if self._pg is None:
+            raise ValueError(
+                "Transaction is not open, use it in a with block.")
+        if self._pool is None:
+            # statements aren't worth preparing on a throwaway connection
+            prepare = None
+        return _run(self._pg, type, query, params, prepare)
+
+
+def transaction(session=None):
+    """Returns session if one was given, otherwise a new Transaction."""
+    if session is None:
+        return Transaction()
+    return session
+
+
+def copyOut(query, params=(), session=None):
+    """Runs a query through COPY ... TO STDOUT and returns its result as
+    text: a line for each row, with tabs between columns and \\N for NULL.
+
+    Large results arrive much faster, and far smaller, this way than as a
+    list of tuples.
+    """
+    out = io.BytesIO()
+    with transaction(session) as t:
+        c = t._pg.cursor()
+        inner = c.mogrify(query, params)
+        if not isinstance(inner, str):
+            inner = inner.decode()
+        start = time.time()
+        c.copy_expert("COPY (%s) TO STDOUT" % inner, out)
+        stats.recordQuery(query, time.time() - start, max(c.rowcount, 0))
+        c.close()
+    return out.getvalue()
+
+
+def insertStatements(table, columns, rows):
+    """Yields (query, params) multi-row INSERTs of BATCH_SIZE rows each."""
+    row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    prefix = "INSERT INTO %s (%s) VALUES " % (table, ", ".join(columns))
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        query = prefix + ", ".join([row] * len(batch))
+        params = tuple(value for values in batch for value in values)
+        yield query, params
+
+
+def insertMany(table, columns, rows, session):
+    """Inserts rows into a table using multi-row INSERT statements.
+
+    Rows are sent BATCH_SIZE at a time, all inside the given transaction.
+    """
+    for query, params in insertStatements(table, columns, rows):
+        sql("commit", query, params, session)
+
+
+def deferStandings(session):
+    """Stops match triggers from updating Standings for this transaction.
+
+    Bulk operations call this before changing many matches, and then bring
+    the Standings table up to date once with rebuildStandings().
+    """
+    query = "SET LOCAL tournament.defer_standings = 'on'"
+    sql("commit", query, session=session)
+
+
+def standingsChanged(tournament=None, session=None):
+    """Invalidates the cached standings of a tournament, or of every
+    tournament if it is None, once session commits.
+
+    Without a session the change is taken to be committed already.  Every
+    function that changes standings calls this.
+    """
+    if _cache_settings["notify"]:
+        payload = "" if tournament is None else str(tournament)
+        query = "SELECT pg_notify(%s, %s)"
+        sql("fetchone", query, (NOTIFY_CHANNEL, payload), session)
+    if session is None:
+        cache.invalidate(tournament)
+    else:
+        session.onCommit(lambda: cache.invalidate(tournament))
+
+
+def reservePlayerIds(count, session=None):
+    """Reserves count new player ids from the Players id sequence.
+
+    Returns the ids in ascending order.
+    """
+    if count == 0:
+        return []
+    query = ("SELECT nextval('players_id_seq') "
+             "FROM generate_series(1, %s)")
+    params = (count,)
+    fetch = sql("fetchall", query, params, session)
+    return sorted(row[0] for row in fetch)
+
+
+def ensureTournament(tournament=1, name="Tournament 1", session=None):
+    """Creates a tournament unless it already exists."""
+    sql("commit", ENSURE_TOURNAMENT_QUERY, (tournament, name), session,
+        "ensure_tournament")
+
+
+def lockTournament(tournament, session):
+    """Takes the pairing lock of a tournament, waiting for any other
+    transaction holding it.  The lock is released when session ends."""
+    query = "SELECT pg_advisory_xact_lock(%s, %s)"
+    sql("fetchone", query, (PAIRING_LOCK, tournament), session)
 
 # "create" functions
 
 
-def createTournament(id=1, name="Tournament 1"):
+@instrumented
+def createTournament(id=1, name="Tournament 1", session=None):
     """Create a new tournament."""
     # insert the values provided into the Tournaments table if it doesn't
     # already exist.
-    if tournamentExists() == False:
-        query = ("INSERT INTO Tournaments (id, name)SELECT %s, %s "
-                 "WHERE NOT EXISTS (SELECT id FROM Tournaments WHERE id = %s)")
-        params = (id, name, id)
-        sql("commit", query, params)
-    else:
+    params = (id, name)
+    if sql("fetchone", CREATE_TOURNAMENT_QUERY, params, session) is None:
         raise ValueError(
             "Tournament %d already exists." % id)
 
 
-def createPlayer(name):
-    """Create a new player."""
+@instrumented
+def createPlayer(name, session=None):
+    """Create a new player.  Returns the id the database assigned to them."""
     # inserting new player
-    query = "INSERT INTO Players (name) VALUES (%s)"
     params = (name,)
-    sql("commit", query, params)
+    with transaction(session) as t:
+        return sql("fetchone", CREATE_PLAYER_QUERY, params, t)[0]
 
 
-def reportMatch(winner, loser, tournament=1, tied="n"):
+@instrumented
+def registerPlayers(names, tournament=1, tournament_name="Tournament 1",
+                    session=None):
+    """Adds many players to a tournament in a single transaction.
+
+    Args:
+      names: the players' full names.
+
+    Returns:
+      The new players' ids, in the same order as names.
+    """
+    names = list(names)
+    with transaction(session) as t:
+        ensureTournament(tournament, tournament_name, t)
+        ids = reservePlayerIds(len(names), t)
+        insertMany("Players", ("id", "name"), list(zip(ids, names)), t)
+        insertMany("Registrants", ("tournament_id", "player_id"),
+                   [(tournament, player_id) for player_id in ids], t)
+        standingsChanged(tournament, t)
+    return ids
+
+
+@instrumented
+def reportMatch(winner, loser, tournament=1, tied="n", session=None):
     """Records the outcome of a single match between two players.
 
     Args:
       winner:  the id number of the player who won
       loser:  the id number of the player who lost
     """
-    if tournamentExists(tournament) == False:
-        createTournament(tournament)
-    if tied == "n":
-        query = ("INSERT INTO Matches"
-                 "(tournament_id, player_1, player_2, winner)"
-                 "VALUES (%s, %s, %s, %s)")
-        params = (tournament, winner, loser, winner)
-    elif tied == "y":
-        query = ("INSERT INTO Matches(tournament_id, player_1, player_2) "
-                 "VALUES (%s, %s, %s)")
-        params = (tournament, winner, loser)
-    else:
-        raise ValueError(
-            "Matches must either be tied or not tied. Please use y or n.")
-    sql("commit", query, params)
+    params = matchRow(winner, loser, tournament, tied)
+    with transaction(session) as t:
+        ensureTournament(tournament, session=t)
+        sql("commit", REPORT_MATCH_QUERY, params, t)
+        standingsChanged(tournament, t)
+
+
+@instrumented
+def reportMatches(results, tournament=1, session=None):
+    """Records the outcomes of many matches in a single transaction.
+
+    Args:
+      results: (winner, loser) or (winner, loser, tied) tuples, taken the
+        same way as reportMatch()'s arguments.  Every result is checked
+        before any of them is recorded.
+
+    The standings are rebuilt once for the whole batch rather than updated
+    match by match.
+    """
+    rows = [matchRow(result[0], result[1], tournament, *result[2:])
+            for result in results]
+    with transaction(session) as t:
+        ensureTournament(tournament, session=t)
+        deferStandings(t)
+        insertMany("Matches",
+                   ("tournament_id", "player_1", "player_2", "winner"),
+                   rows, t)
+        rebuildStandings(tournament, t)
 
 # "read" functions
 
 
-def countPlayers(tournament=1):
+@instrumented
+def countPlayers(tournament=1, session=None):
     """Returns the number of players registered for the given tournament."""
-    query = "SELECT COUNT (*) FROM Registrants WHERE tournament_id=(%s)"
     params = (tournament,)
-    fetch = sql("fetchone", query, params)[0]
+    fetch = sql("fetchone", COUNT_PLAYERS_QUERY, params, session,
+                "count_players")[0]
     return int(fetch)
 
 
-def isRegistered(player_id=0, tournament_id=1):
+@instrumented
+def isRegistered(player_id=0, tournament_id=1, session=None):
     """Determines if a specific player is registered for a tournament."""
-    query = ("SELECT COUNT (*) FROM Registrants "
-             "WHERE tournament_id = %s AND player_id = %s")
     params = (tournament_id, player_id)
-    isRegistered = sql("fetchone", query, params)
+    isRegistered = sql("fetchone", IS_REGISTERED_QUERY, params, session,
+                       "is_registered")
     if isRegistered[0] == 1:
         return True
     else:
         return False
 
 
-def tournamentExists(tournament=1):
+@instrumented
+def tournamentExists(tournament=1, session=None):
     """Determines if a specific tournament already exists or not."""
-    query = "SELECT COUNT(*) FROM Tournaments WHERE id = %s"
     params = (tournament,)
-    fetch = sql("fetchone", query, params)
+    fetch = sql("fetchone", TOURNAMENT_EXISTS_QUERY, params, session,
+                "tournament_exists")
     if fetch[0] == 0:
         return False
     elif fetch[0] == 1:
@@ -131,7 +972,23 @@ def tournamentExists(tournament=1):
             "Check database for consistency in Tournaments table.")
 
 
-def playerStandings(tournament=1):
+@instrumented
+def checkStandings(tournament=1, session=None):
+    """Compares the stored standings of a tournament with its matches.
+
+    Returns:
+      A list of tuples, one for each player whose stored record is wrong:
+        (id, wins, computed wins, omw, computed omw, matches,
+        computed matches)
+      An empty list means the Standings table is consistent.
+    """
+    query = "SELECT * FROM checkstandings(%s)"
+    params = (tournament,)
+    return sql("fetchall", query, params, session)
+
+
+@instrumented
+def playerStandings(tournament=1, session=None):
     """Returns a list of the players and their win records, sorted by wins.
 
     The first entry in the list should be the player in first place,
@@ -143,20 +1000,187 @@ def playerStandings(tournament=1):
         name: the player's full name (as registered)
         wins: the number of matches the player has won
         matches: the number of matches the player has played
+
+    Players tied on wins are ordered by OMW, or by the tournament's own
+    tiebreaks if it has any (see setTiebreaks).  Outside a session,
+    standings are read through the standings cache when it is on (see
+    configureCache).
+    """
+    if session is not None or cache.size <= 0:
+        return _standings(tournament, session)
+    version = cache.version(tournament)
+    fetch = cache.get(tournament)
+    if fetch is None:
+        fetch = _standings(tournament, session)
+        cache.put(tournament, version, fetch)
+    return fetch
+
+
+# the standings of a tournament with its tiebreaks, if it has any, on every
+# row
+
+STANDINGS_QUERY = ("SELECT player_id, name, wins, matches, "
+                   "(SELECT tiebreaks FROM Tournaments WHERE id = %s) "
+                   "FROM getstandings(%s)")
+
+
+def _standings(tournament, session):
+    params = (tournament, tournament)
+    fetch = sql("fetchall", STANDINGS_QUERY, params, session, "standings")
+    return orderStandings(fetch, lambda: sql(
+        "fetchall", TIEBREAK_MATCHES_QUERY, (tournament,), session))
+
+
+# the page of standings after a player, read from the standings_rank index
+# without counting through the players ahead.  Players whose wins, OMW and
+# id all compare at once can't be found with one index range, since wins
+# and OMW are ordered descending and ids ascending, so the page is merged
+# from three ranges: the same wins and OMW with higher ids, the same wins
+# with lower OMW, and lower wins.
+
+FIRST_PAGE_QUERY = ("SELECT player_id, name, wins, matches "
+                    "FROM getstandings(%s) LIMIT %s")
+
+PAGE_QUERY = (
+    "WITH after AS (SELECT wins, omw, player_id FROM Standings "
+    "WHERE tournament_id = %s AND player_id = %s) "
+    "SELECT page.player_id, Players.name, page.wins, page.matches FROM ("
+    "(SELECT Standings.* FROM Standings, after "
+    "WHERE Standings.tournament_id = %s AND Standings.wins = after.wins "
+    "AND Standings.omw = after.omw AND Standings.player_id > after.player_id "
+    "ORDER BY Standings.player_id LIMIT %s) "
+    "UNION ALL (SELECT Standings.* FROM Standings, after "
+    "WHERE Standings.tournament_id = %s AND Standings.wins = after.wins "
+    "AND Standings.omw < after.omw AND Standings.player_id != 0 "
+    "ORDER BY Standings.omw DESC, Standings.player_id LIMIT %s) "
+    "UNION ALL (SELECT Standings.* FROM Standings, after "
+    "WHERE Standings.tournament_id = %s AND Standings.wins < after.wins "
+    "AND Standings.player_id != 0 ORDER BY Standings.wins DESC, "
+    "Standings.omw DESC, Standings.player_id LIMIT %s)) page "
+    "JOIN Players ON (page.player_id = Players.id) "
+    "ORDER BY page.wins DESC, page.omw DESC, page.player_id LIMIT %s")
+
+# the players ahead of a player, counted over the same three ranges
+
+RANK_QUERY = (
+    "SELECT 1 + (SELECT COUNT(*) FROM Standings "
+    "WHERE tournament_id = me.tournament_id AND wins = me.wins "
+    "AND omw = me.omw AND player_id < me.player_id AND player_id != 0) "
+    "+ (SELECT COUNT(*) FROM Standings "
+    "WHERE tournament_id = me.tournament_id AND wins = me.wins "
+    "AND omw > me.omw AND player_id != 0) "
+    "+ (SELECT COUNT(*) FROM Standings "
+    "WHERE tournament_id = me.tournament_id AND wins > me.wins "
+    "AND player_id != 0) "
+    "FROM Standings me WHERE me.tournament_id = %s AND me.player_id = %s "
+    "AND me.player_id != 0")
+
+_cursor_ids = itertools.count(1)
+
+
+def iterStandings(tournament=1, size=STREAM_SIZE, session=None):
+    """Yields the rows of playerStandings() one at a time.
+
+    The rows are read through a server-side cursor, size rows a round
+    trip, so only that many are ever held in memory.  They are in the order
+    of the Standings table, by wins and then OMW, whatever tiebreaks the
+    tournament has.  The transaction the cursor reads in stays open until
+    the last row is read or the iterator is closed.
     """
     query = "SELECT player_id, name, wins, matches FROM getstandings(%s)"
+    with transaction(session) as t:
+        c = t._pg.cursor("standings_%d" % next(_cursor_ids))
+        c.itersize = size
+        start = time.time()
+        c.execute(query, (tournament,))
+        rows = 0
+        try:
+            for row in c:
+                rows += 1
+                yield row
+        finally:
+            c.close()
+            stats.recordQuery(query, time.time() - start, rows)
+
+
+@instrumented
+def standingsPage(tournament=1, after=None, limit=PAGE_SIZE, session=None):
+    """Returns one page of a tournament's standings.
+
+    Args:
+      tournament: the tournament.
+      after: the id of the last player on the previous page, or None for
+        the first page.
+      limit: the most rows to return.
+
+    Returns:
+      Up to limit (id, name, wins, matches) tuples, ordered like
+      iterStandings().  The page is empty after the last player, or if
+      after isn't registered for the tournament.
+    """
+    if after is None:
+        return sql("fetchall", FIRST_PAGE_QUERY, (tournament, limit), session,
+                   "standings_first_page")
+    params = (tournament, after, tournament, limit, tournament, limit,
+              tournament, limit, limit)
+    return sql("fetchall", PAGE_QUERY, params, session, "standings_page")
+
+
+@instrumented
+def playerRank(player_id, tournament=1, session=None):
+    """Returns a player's place in the standings, 1 for first, as it would
+    be in iterStandings(); or None if the player isn't registered."""
+    fetch = sql("fetchone", RANK_QUERY, (tournament, player_id), session,
+                "player_rank")
+    if fetch is None:
+        return None
+    return int(fetch[0])
+
+
+@instrumented
+def arrayStandings(tournament=1, session=None):
+    """Computes the standings of a tournament from its matches, in memory.
+
+    The matches are copied out of the database once into compact NumPy
+    arrays (see tiebreaks.rankPlayers), within tiebreaks.memoryEstimate()
+    bytes.  It reads the matches rather than the trigger-maintained
+    Standings table, and is slower than playerStandings(): about 1.1s
+    against 0.15s for 50,000 players after 9 rounds.  The rows are the
+    same as those playerStandings() returns when ordering by OMW.
+    """
+    query = ("SELECT Players.id, Players.name FROM Registrants "
+             "JOIN Players ON (Registrants.player_id = Players.id) "
+             "WHERE Registrants.tournament_id = %s "
+             "AND Registrants.player_id != 0")
+    matches = ("SELECT player_1, player_2, COALESCE(winner, -1) "
+               "FROM Matches WHERE tournament_id = %s")
+    with transaction(session) as t:
+        players = sql("fetchall", query, (tournament,), t)
+        text = copyOut(matches, (tournament,), t)
+    return tiebreaks.rankPlayers(players, tiebreaks.parseMatches(text))
+
+
+@instrumented
+def playedPairs(tournament=1, session=None):
+    """Returns the set of pairs of players who have met in a tournament.
+
+    Each pair is a swiss.pairKey(), and byes appear as pairs with player 0.
+    """
     params = (tournament,)
-    fetch = sql("fetchall", query, params)
-    return fetch
+    return swiss.playedPairs(
+        sql("fetchall", PLAYED_PAIRS_QUERY, params, session))
 
 
-def swissPairings(tournament=1):
+@instrumented
+def swissPairings(tournament=1, session=None):
     """Returns a list of pairs of players for the next round of a match.
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Each player appears exactly once in the pairings, and no two players are
+    paired if they have already played each other.  Players are paired
+    within their score bracket, best placed first, with a player adjacent to
+    them in the standings whenever possible; players who can't be paired in
+    their bracket float down to the next one.  With an odd number of
+    players, one of them is paired with the bye round.
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -164,49 +1188,61 @@ def swissPairings(tournament=1):
         name1: the first player's name
         id2: the second player's unique id
         name2: the second player's name
-    """
-    i = 0
-    result = []
-    # get the standings
-    standings = playerStandings(tournament)
-    # if there are an odd number of players for your tournament, register a
-    # bye round
-    if countPlayers(tournament) % 2 == 1 and not isRegistered(0, tournament):
-        enterTournament(0, tournament)
-    # if player 0 (bye round) is registered, determine the bye round match-up
-    if isRegistered(0, tournament):
-        bye = byeMatch()
-        # add the bye to our results
-        result.append(bye)
-        # update the standings to ignore the player selected to have a bye
-        query = ("SELECT player_id, name, wins, matches "
-                 "FROM getstandings(%s) WHERE player_id != %s")
-        params = (tournament, bye[0])
-        standings = sql("fetchall", query, params)
-
-    # now create the standings - using the length of the updated standings if
-    # needed
-
-    while i < len(standings):
-        extender = (standings[i])[:2] + (standings[i + 1])[:2]
-        result.append(extender)
-        i += 2
 
-    return result
+    Raises:
+      ValueError: if the players can't be paired without a rematch.
+      swiss.SearchExhausted: a ValueError, if the pairing search gave up
+        before finding out whether they can.
+    """
+    with transaction(session) as t:
+        # get the standings
+        standings = playerStandings(tournament, t)
+        # if there are an odd number of players for your tournament, register
+        # a bye round
+        bye = len(standings) % 2 == 1
+        if bye and sql("fetchone", ENTER_BYE_QUERY, (tournament,), t):
+            standingsChanged(tournament, t)
+        played = playedPairs(tournament, t)
+    return swiss.pairings(standings, played, bye)
 
 # "update" functions
 
 
-def enterTournament(player_id, tournament_id=1):
+@instrumented
+def setTiebreaks(names, tournament=1, session=None):
+    """Chooses how players tied on wins are ordered in a tournament.
+
+    Args:
+      names: tiebreaks from tiebreaks.TIEBREAKS, most important first, or
+        an empty list to order by OMW again.  If the first is "points",
+        players are ordered by match points before wins instead.
+
+    Raises:
+      ValueError: if a tiebreak is unknown, NumPy isn't installed, or the
+        tournament doesn't exist.
+    """
+    names = list(names)
+    if names:
+        tiebreaks.checkTiebreaks(names)
+    params = (",".join(names) or None, tournament)
+    with transaction(session) as t:
+        if sql("fetchone", SET_TIEBREAKS_QUERY, params, t) is None:
+            raise ValueError("Tournament %d does not exist." % tournament)
+        standingsChanged(tournament, t)
+
+
+@instrumented
+def enterTournament(player_id, tournament_id=1, session=None):
     """Insert an existing player into a tournament."""
     # Inserts player into the Registrants table
-    query = ("INSERT INTO Registrants "
-             "(tournament_id, player_id) VALUES (%s, %s)")
     params = (tournament_id, player_id)
-    sql("commit", query, params)
+    sql("commit", ENTER_TOURNAMENT_QUERY, params, session)
+    standingsChanged(tournament_id, session)
 
 
-def registerPlayer(name, tournament=1, tournament_name="Tournament 1"):
+@instrumented
+def registerPlayer(name, tournament=1, tournament_name="Tournament 1",
+                   session=None):
     """Adds a player to the tournament database.
 
     The database assigns a unique serial id number for the player.  (This
@@ -214,66 +1250,495 @@ def registerPlayer(name, tournament=1, tournament_name="Tournament 1"):
 
     Args:
       name: the player's full name (need not be unique).
+
+    Returns:
+      The new player's id.
     """
-    # checks for the existence of the Tournament and creates it if needed
-    if tournamentExists(tournament) == False:
-        createTournament(tournament, tournament_name)
-    createPlayer(name)
-    # gets the most recent player
-    query = "SELECT id FROM Players ORDER BY id DESC LIMIT 1"
-    player_id = sql("fetchone", query)
-    enterTournament(player_id[0], tournament)
+    with transaction(session) as t:
+        # checks for the existence of the Tournament and creates it if needed
+        ensureTournament(tournament, tournament_name, t)
+        player_id = createPlayer(name, t)
+        enterTournament(player_id, tournament, t)
+    return player_id
 
 
-def byeMatch(tournament=1):
+def _byeQuery():
+    candidates = ("SELECT Standings.player_id, Players.name "
+                  "FROM Standings JOIN Players "
+                  "ON (Standings.player_id = Players.id) "
+                  "WHERE Standings.tournament_id = %(tournament)s "
+                  "AND Standings.player_id != 0 "
+                  "AND EXISTS (SELECT 1 FROM Registrants "
+                  "WHERE tournament_id = %(tournament)s AND player_id = 0) ")
+    had_bye = ("EXISTS (SELECT 1 FROM Opponents "
+               "WHERE tournament_id = %(tournament)s "
+               "AND player_id = Standings.player_id AND opponent_id = 0) ")
+    order = ("ORDER BY Standings.wins DESC, Standings.omw DESC, "
+             "Standings.player_id LIMIT 1")
+    # the second branch only runs if everyone has had a bye
+    return ("(" + candidates + "AND NOT " + had_bye + order + ") "
+            "UNION ALL (" + candidates + order + ") LIMIT 1")
+
+
+# the single query byeMatch() picks the bye round with
+
+BYE_QUERY = _byeQuery()
+
+
+@instrumented
+def byeMatch(tournament=1, session=None):
     """Returns the bye round match-up.
     The bye round must already be registered.
+
+    The bye goes to the highest placed player who hasn't had one yet, found
+    with a single query (BYE_QUERY) that walks the standings index and stops
+    at the first such player.  Only when everyone has had a bye does the
+    highest placed player get another.
     """
-    standings = playerStandings(tournament)
-    i = 0
-    result = []
-    # checks to see if the bye round is registered.
-    if isRegistered(0, tournament):
-        # set fetch to the first result
-        fetch = (1,)
-        extender = ()
-    # iterate through the standings to find the first player who hasn't played
-    # the bye round yet
-        while i < countPlayers(tournament) and fetch[0] > 0:
-            result = standings[i]
-            query = ("SELECT COUNT (*) FROM Matches "
-                     "WHERE tournament_id = %s AND player_1 = %s"
-                     "AND player_2 = 0")
-            params = tournament, (standings[i])[0]
-            # set fetch to the ith player
-            fetch = sql("fetchone", query, params)
-            # if the ith player hasn't played the bye round set the result to
-            # that player
-            if fetch[0] == 0:
-                result = (standings)[i][:2] + (0, 'bye round')
-            # otherwise, continue
-            i += 1
+    params = {"tournament": tournament}
+    fetch = sql("fetchone", BYE_QUERY, params, session)
+    if fetch is None:
+        return []
     # return the first player that hasn't played the bye round yet.
-    return result
+    return fetch + (0, 'bye round')
+
+# "round" functions
+
+# the queries of a Round: reporting a pending match's result, listing and
+# counting the unreported ones, and committing them all as matches
+
+REPORT_PAIRING_QUERY = (
+    "UPDATE Pairings SET winner = %s, reported = true "
+    "FROM Rounds WHERE Pairings.tournament_id = %s "
+    "AND Pairings.round = %s "
+    "AND LEAST(player_1, player_2) = LEAST(%s, %s) "
+    "AND GREATEST(player_1, player_2) = GREATEST(%s, %s) "
+    "AND Rounds.tournament_id = Pairings.tournament_id "
+    "AND Rounds.round = Pairings.round AND NOT Rounds.committed "
+    "RETURNING board")
+
+PENDING_PAIRINGS_QUERY = (
+    "SELECT player_1, player_2 FROM Pairings "
+    "WHERE tournament_id = %s AND round = %s AND NOT reported")
+
+COUNT_PENDING_QUERY = (
+    "SELECT COUNT(*) FROM Pairings "
+    "WHERE tournament_id = %s AND round = %s AND NOT reported")
+
+COMMIT_ROUND_QUERY = (
+    "WITH done AS (UPDATE Rounds SET committed = true "
+    "WHERE tournament_id = %s AND round = %s "
+    "AND NOT committed RETURNING tournament_id, round) "
+    "INSERT INTO Matches (tournament_id, player_1, player_2, winner, round) "
+    "SELECT tournament_id, player_1, player_2, winner, round "
+    "FROM Pairings JOIN done USING (tournament_id, round)")
+
+
+class Round(object):
+    """A round of a tournament, from its pairings to its results.
+
+    A round is started by startRound(), which pairs the players once and
+    stores the pairings as pending matches.  Results are then reported
+    against the round as they come in, each as a single UPDATE of its
+    pending match, and commit() records them all as matches in one
+    transaction, with one standings update for the whole round.
+
+    Attributes:
+      tournament: the tournament id.
+      number: the round number, counted from 1.
+      pairings: (id1, name1, id2, name2) tuples, as swissPairings()
+        returns them.  A bye round is reported as won when it starts.
+    """
+
+    def __init__(self, tournament, number, pairings):
+        self.tournament = tournament
+        self.number = number
+        self.pairings = pairings
+
+    def reportMatch(self, winner, loser, tied="n", session=None):
+        """Records the result of one of the round's matches.
+
+        A result can be reported again, to correct it, until the round is
+        committed.
+
+        Raises:
+          ValueError: if the players aren't paired in this round, or the
+            round has been committed.
+        """
+        row = matchRow(winner, loser, self.tournament, tied)
+        params = (row[3], self.tournament, self.number,
+                  winner, loser, winner, loser)
+        if sql("fetchone", REPORT_PAIRING_QUERY, params, session) is None:
+            raise ValueError(
+                "Players %d and %d aren't paired in round %d, or it has "
+                "already been committed." % (winner, loser, self.number))
+
+    def pendingMatches(self, session=None):
+        """Returns the pairings whose results haven't been reported yet."""
+        params = (self.tournament, self.number)
+        fetch = sql("fetchall", PENDING_PAIRINGS_QUERY, params, session)
+        pending = set(swiss.pairKey(player_1, player_2)
+                      for player_1, player_2 in fetch)
+        return [row for row in self.pairings
+                if swiss.pairKey(row[0], row[2]) in pending]
+
+    def commit(self, session=None):
+        """Records every result of the round as a match, all at once.
+
+        Raises:
+          ValueError: if some of the round's results haven't been reported.
+        """
+        params = (self.tournament, self.number)
+        with transaction(session) as t:
+            pending = sql("fetchone", COUNT_PENDING_QUERY, params, t)[0]
+            if pending:
+                raise ValueError(
+                    "%d matches of round %d haven't been reported yet." %
+                    (pending, self.number))
+            deferStandings(t)
+            sql("commit", COMMIT_ROUND_QUERY, params, t)
+            rebuildStandings(self.tournament, t)
+
+
+PAIRING_COLUMNS = ("tournament_id", "round", "board", "player_1",
+                   "player_2", "winner", "reported")
+
+
+def pairingRows(tournament, number, pairings):
+    """Returns the Pairings rows of a round's pairings, board by board."""
+    rows = []
+    for board, (id1, name1, id2, name2) in enumerate(pairings):
+        # the bye round is won as soon as it is paired
+        bye = id2 == swiss.BYE
+        rows.append((tournament, number, board + 1, id1, id2,
+                     id1 if bye else None, bye))
+    return rows
+
+
+NEXT_ROUND_QUERY = ("INSERT INTO Rounds (tournament_id, round) "
+                    "SELECT %s, COALESCE(MAX(round), 0) + 1 FROM Rounds "
+                    "WHERE tournament_id = %s RETURNING round")
+
+
+@instrumented
+def startRound(tournament=1, session=None):
+    """Pairs the next round of a tournament and stores it as pending.
+
+    Returns:
+      The new Round.
+
+    Raises:
+      ValueError: if the last round hasn't been committed yet, or the
+        players can't be paired without a rematch.
+
+    Only one transaction starts a round of a tournament at a time; any
+    other waits for it, then finds its round open.
+    """
+    with transaction(session) as t:
+        lockTournament(tournament, t)
+        current = currentRound(tournament, t)
+        if current is not None:
+            raise ValueError(
+                "Round %d of tournament %d hasn't been committed yet." %
+                (current.number, tournament))
+        number = sql("fetchone", NEXT_ROUND_QUERY,
+                     (tournament, tournament), t)[0]
+        pairings = swissPairings(tournament, t)
+        insertMany("Pairings", PAIRING_COLUMNS,
+                   pairingRows(tournament, number, pairings), t)
+    return Round(tournament, number, pairings)
+
+
+# the standings of many tournaments, each ordered and with its tiebreaks
+# as in STANDINGS_QUERY
+
+ALL_STANDINGS_QUERY = (
+    "SELECT Standings.tournament_id, Standings.player_id, Players.name, "
+    "Standings.wins, Standings.matches, Tournaments.tiebreaks "
+    "FROM Standings JOIN Players ON (Standings.player_id = Players.id) "
+    "JOIN Tournaments ON (Standings.tournament_id = Tournaments.id) "
+    "WHERE Standings.tournament_id = ANY(%s) AND Standings.player_id != 0 "
+    "ORDER BY Standings.tournament_id, Standings.wins DESC, "
+    "Standings.omw DESC, Standings.player_id")
+
+
+def _pairTournament(work):
+    standings, played, bye = work
+    return swiss.pairings(standings, played, bye)
+
+
+def pairTournaments(work, processes=None):
+    """Runs swiss.pairings() on (standings, played, bye) tuples, on a pool
+    of processes.  Returns the pairings in order.
+
+    By default the pool has one process per CPU, but is only started for
+    PAIRING_POOL_PLAYERS players or more.
+    """
+    if processes is None:
+        players = sum(len(item[0]) for item in work)
+        if players >= PAIRING_POOL_PLAYERS:
+            processes = multiprocessing.cpu_count()
+        else:
+            processes = 1
+    processes = min(processes, len(work))
+    if processes <= 1:
+        return [_pairTournament(item) for item in work]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_pairTournament, work)
+    finally:
+        pool.close()
+        pool.join()
+
+
+@instrumented
+def pairAll(tournament_ids, processes=None, session=None):
+    """Starts the next round of many tournaments at once.
+
+    Does what startRound() does for each tournament, but loads and stores
+    every tournament with the same few queries, and pairs them in parallel
+    (see pairTournaments).
+
+    Args:
+      tournament_ids: the tournaments to pair.
+      processes: the processes to pair them on, see pairTournaments().
+        With 1, they are paired in this process.
+
+    Returns:
+      A dict of the new Round of each tournament.
+
+    Raises:
+      ValueError: if a tournament's last round hasn't been committed yet,
+        or its players can't be paired without a rematch.  No round is
+        started then.
+    """
+    ids = sorted(set(tournament_ids))
+    if not ids:
+        return {}
+    with transaction(session) as t:
+        # locked in order, so that two calls can't each wait for the other
+        query = ("SELECT pg_advisory_xact_lock(%s, id) "
+                 "FROM (SELECT unnest(%s) AS id ORDER BY id) ids")
+        sql("fetchall", query, (PAIRING_LOCK, ids), t)
+        query = ("SELECT tournament_id, round FROM Rounds "
+                 "WHERE tournament_id = ANY(%s) AND NOT committed")
+        fetch = sql("fetchone", query, (ids,), t)
+        if fetch is not None:
+            raise ValueError(
+                "Round %d of tournament %d hasn't been committed yet." %
+                (fetch[1], fetch[0]))
+        standings = dict((tournament, []) for tournament in ids)
+        for row in sql("fetchall", ALL_STANDINGS_QUERY, (ids,), t):
+            standings[row[0]].append(row[1:])
+        for tournament in ids:
+            standings[tournament] = orderStandings(
+                standings[tournament], lambda: sql(
+                    "fetchall", TIEBREAK_MATCHES_QUERY, (tournament,), t))
+        odd = [tournament for tournament in ids
+               if len(standings[tournament]) % 2 == 1]
+        if odd:
+            query = ("INSERT INTO Registrants (tournament_id, player_id) "
+                     "SELECT unnest(%s), 0 ON CONFLICT DO NOTHING "
+                     "RETURNING tournament_id")
+            for row in sql("fetchall", query, (odd,), t):
+                standingsChanged(row[0], t)
+        played = dict((tournament, set()) for tournament in ids)
+        query = ("SELECT tournament_id, player_id, opponent_id FROM Opponents "
+                 "WHERE tournament_id = ANY(%s) AND player_id < opponent_id")
+        fetch = sql("fetchall", query, (ids,), t)
+        for tournament, player_1, player_2 in fetch:
+            played[tournament].add((player_1, player_2))
+        odd = set(odd)
+        pairings = pairTournaments(
+            [(standings[tournament], played[tournament], tournament in odd)
+             for tournament in ids], processes)
+        query = ("INSERT INTO Rounds (tournament_id, round) "
+                 "SELECT ids.id, COALESCE((SELECT MAX(round) FROM Rounds "
+                 "WHERE tournament_id = ids.id), 0) + 1 "
+                 "FROM unnest(%s) AS ids(id) RETURNING tournament_id, round")
+        numbers = dict(sql("fetchall", query, (ids,), t))
+        rows = []
+        for tournament, pairs in zip(ids, pairings):
+            rows.extend(pairingRows(tournament, numbers[tournament], pairs))
+        insertMany("Pairings", PAIRING_COLUMNS, rows, t)
+    return dict((tournament, Round(tournament, numbers[tournament], pairs))
+                for tournament, pairs in zip(ids, pairings))
+
+
+CURRENT_ROUND_QUERY = (
+    "SELECT Pairings.round, Pairings.player_1, one.name, "
+    "Pairings.player_2, two.name "
+    "FROM Rounds JOIN Pairings USING (tournament_id, round) "
+    "JOIN Players one ON (Pairings.player_1 = one.id) "
+    "JOIN Players two ON (Pairings.player_2 = two.id) "
+    "WHERE Rounds.tournament_id = %s AND NOT Rounds.committed "
+    "ORDER BY Pairings.board")
+
+
+@instrumented
+def currentRound(tournament=1, session=None):
+    """Returns the Round of a tournament that hasn't been committed yet,
+    or None if there isn't one.
+    """
+    fetch = sql("fetchall", CURRENT_ROUND_QUERY, (tournament,), session)
+    if not fetch:
+        return None
+    return Round(tournament, fetch[0][0], [row[1:] for row in fetch])
 
 # "delete" functions
 
 
-def deleteMatches():
-    """Remove all the match records from the database."""
-    query = "DELETE FROM Matches"
-    sql("commit", query)
+@instrumented
+def rebuildStandings(tournament=1, session=None):
+    """Recomputes the stored standings of a tournament from its matches."""
+    query = "SELECT rebuildstandings(%s)"
+    params = (tournament,)
+    sql("fetchone", query, params, session)
+    standingsChanged(tournament, session)
+
 
+@instrumented
+def deleteMatches(session=None):
+    """Remove all the match records from the database, archived or not."""
+    with transaction(session) as t:
+        deferStandings(t)
+        query = ("DELETE FROM Matches; DELETE FROM Rounds; "
+                 "UPDATE Standings SET wins = 0, omw = 0, matches = 0; "
+                 "DELETE FROM ArchivedMatches; "
+                 "UPDATE ArchivedRegistrants "
+                 "SET wins = 0, omw = 0, matches = 0")
+        sql("commit", query, session=t)
+        standingsChanged(session=t)
 
-def deletePlayers():
+
+@instrumented
+def deletePlayers(session=None):
     """Remove all the player records from the database."""
     # We want to remove all registrants, but don't want to delete our bye
     # player
-    query = "DELETE FROM Registrants; DELETE FROM Players where id !=0"
-    sql("commit", query)
+    query = ("DELETE FROM Registrants; DELETE FROM Rounds; "
+             "DELETE FROM Players where id !=0")
+    sql("commit", query, session=session)
+    standingsChanged(session=session)
 
 
-def deleteTournaments():
+@instrumented
+def deleteTournaments(session=None):
     """remove all the tournament records from the database."""
-    query = "DELETE FROM Tournaments"
-    sql("commit", query)
+    query = "DELETE FROM Tournaments; DELETE FROM ArchivedTournaments"
+    sql("commit", query, session=session)
+    standingsChanged(session=session)
+
+
+@instrumented
+def deleteTournament(tournament, session=None):
+    """Removes one tournament, live or archived, with its registrations,
+    matches and rounds.  Other tournaments, and the players, are kept.
+
+    Returns:
+      False if there was no such tournament.
+    """
+    with transaction(session) as t:
+        lockTournament(tournament, t)
+        query = "SELECT deletetournament(%s)"
+        deleted = sql("fetchone", query, (tournament,), t)[0]
+        standingsChanged(tournament, t)
+    return deleted
+
+# "archive" functions
+
+
+@instrumented
+def archiveTournament(tournament, session=None):
+    """Moves a finished tournament from the live tables to the archive.
+
+    Its name, tiebreaks, players' final records and matches are copied to
+    the Archived tables with one bulk INSERT each, then its rows are
+    removed from the live tables, so that live events' queries and indexes
+    don't carry it.  Read it back with archivedStandings().
+
+    Raises:
+      ValueError: if the tournament isn't live or has a round open.
+    """
+    with transaction(session) as t:
+        lockTournament(tournament, t)
+        if currentRound(tournament, t) is not None:
+            raise ValueError(
+                "Tournament %d has a round open, commit it first." %
+                tournament)
+        query = "SELECT archivetournament(%s)"
+        if not sql("fetchone", query, (tournament,), t)[0]:
+            raise ValueError("Tournament %d is not live." % tournament)
+        standingsChanged(tournament, t)
+
+
+# the final standings of an archived tournament, as STANDINGS_QUERY reads
+# those of a live one; and the matches its tiebreaks are computed from
+
+ARCHIVED_STANDINGS_QUERY = (
+    "SELECT ArchivedRegistrants.player_id, Players.name, "
+    "ArchivedRegistrants.wins, ArchivedRegistrants.matches, "
+    "(SELECT tiebreaks FROM ArchivedTournaments WHERE id = %s) "
+    "FROM ArchivedRegistrants "
+    "JOIN Players ON (ArchivedRegistrants.player_id = Players.id) "
+    "WHERE ArchivedRegistrants.tournament_id = %s "
+    "AND ArchivedRegistrants.player_id != 0 "
+    "ORDER BY ArchivedRegistrants.wins DESC, ArchivedRegistrants.omw DESC, "
+    "ArchivedRegistrants.player_id")
+ARCHIVED_MATCHES_QUERY = ("SELECT player_1, player_2, winner "
+                          "FROM ArchivedMatches WHERE tournament_id = %s")
+
+
+@instrumented
+def archivedStandings(tournament, session=None):
+    """Returns the final standings of an archived tournament.
+
+    Returns:
+      (id, name, wins, matches) tuples, ordered as playerStandings()
+      ordered them when the tournament was archived.  An empty list if
+      there is no such archived tournament.
+    """
+    params = (tournament, tournament)
+    fetch = sql("fetchall", ARCHIVED_STANDINGS_QUERY, params, session)
+    return orderStandings(fetch, lambda: sql(
+        "fetchall", ARCHIVED_MATCHES_QUERY, (tournament,), session))
+
+
+def main():
+    """Checks or rebuilds the stored standings from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Check or rebuild stored tournament standings.")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    parser.add_argument("tournaments", type=int, nargs="*",
+                        help="tournament ids, all tournaments by default")
+    args = parser.parse_args()
+    tournaments = args.tournaments or [
+        row[0] for row in sql("fetchall", "SELECT id FROM Tournaments")]
+    for tournament in tournaments:
+        if args.command == "rebuild":
+            rebuildStandings(tournament)
+            print("Tournament %d: standings rebuilt." % tournament)
+        else:
+            errors = checkStandings(tournament)
+            for row in errors:
+                print("Tournament %d, player %d: stored wins/omw/matches "
+                      "%s/%s/%s, computed %s/%s/%s" %
+                      ((tournament, row[0]) + row[1::2] + row[2::2]))
+            print("Tournament %d: %d inconsistent standings." %
+                  (tournament, len(errors)))
+
+
+# the functions and classes configureBackend() swaps, as defined above for
+# PostgreSQL
+
+_postgres = dict(
+    (name, value) for name, value in globals().items()
+    if callable(value) and getattr(value, "__module__", None) == __name__ and
+    not name.startswith("_") and
+    name not in ("configureBackend", "main"))
+if BACKEND != "postgres":
+    configureBackend(BACKEND)
+
+
+if __name__ == '__main__':
+    main()
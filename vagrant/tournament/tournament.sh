@@ -8,9 +8,11 @@ psql -X -d vagrant -f tournament.sql
 echo " "
 echo "Tournament database created or recreated."
 echo " "
+python tournament_fixtures.py template
+echo " "
 echo "Running tournament_test.py..."
 echo " "
-python tournament_test.py
+python tournament_test.py --workers 4
 echo "Tournament_test.py completed."
 echo " "
 echo "Tests complete."
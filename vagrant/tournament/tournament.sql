@@ -28,6 +28,10 @@ WHERE pg_stat_activity.datname = 'tournament'
 \c vagrant
 DROP DATABASE IF EXISTS tournament;
 CREATE DATABASE tournament;
+
+-- when set to 'on' for a transaction, match triggers leave the Standings table alone (see below)
+
+ALTER DATABASE tournament SET tournament.defer_standings = 'off';
 \c tournament
 
 -- Create a table to store player values player_id and name
@@ -39,10 +43,12 @@ name text
 
 -- Create a table to store tournament data
 -- This is implemented to allow multiple tournaments
+-- tiebreaks lists the tiebreaks.py tiebreaks that order the tournament's standings, if not OMW
 
 CREATE TABLE Tournaments
 (id serial primary key,
-name text
+name text,
+tiebreaks text
 );
 
 CREATE TABLE Registrants
@@ -53,6 +59,19 @@ PRIMARY KEY (tournament_id, player_id)
 );
 
 
+/* Create a table to store the rounds of each tournament, counted from 1. A round is open from 
+the moment it is paired (see Pairings below) until its results are committed into Matches, 
+and a tournament can have only one open round at a time. */
+
+CREATE TABLE Rounds
+(tournament_id integer references Tournaments(id) ON DELETE CASCADE,
+round integer,
+committed boolean NOT NULL DEFAULT false,
+PRIMARY KEY (tournament_id, round)
+);
+
+CREATE UNIQUE INDEX rounds_open ON Rounds(tournament_id) WHERE NOT committed;
+
 /*Create a table to store match information: tournament, player_1, player_2, and winner
 Winner must be nullable to support tie games. Matches are constrained so that only registered players
 can have a match and they must be registered for the same tournament. 
@@ -67,6 +86,8 @@ CONSTRAINT different_player CHECK (player_1 != player_2),
 FOREIGN KEY (tournament_id, player_1) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
 FOREIGN KEY (tournament_id, player_2) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE, 
 winner integer CONSTRAINT match_player CHECK (winner IS NULL OR winner IN (player_1, player_2)),
+round integer,
+FOREIGN KEY (tournament_id, round) REFERENCES Rounds(tournament_id, round),
 PRIMARY KEY (tournament_id, player_1, player_2)
 );
 
@@ -78,76 +99,369 @@ but again, only once. */
 
 CREATE UNIQUE INDEX isinglematchup on Matches(tournament_id,GREATEST(player_1,player_2), LEAST(player_1,player_2));
 
+/* Matches are always looked up within a single tournament. The primary key already serves 
+lookups by (tournament_id, player_1); these indexes serve lookups by the other player and by winner. */
+
+CREATE INDEX matches_player_2 ON Matches(tournament_id, player_2);
+CREATE INDEX matches_winner ON Matches(tournament_id, winner);
+
+/* Create a table to store who has played whom: one row for each player of each match, with their 
+opponent. Looking up a player's opponents, or whether two players have met, is then a single range 
+scan of the primary key, whichever side of the match the player was on. The table is kept up to 
+date by a trigger on Matches, even while standings updates are deferred. */
+
+CREATE TABLE Opponents
+(tournament_id integer,
+player_id integer,
+opponent_id integer,
+FOREIGN KEY (tournament_id, player_id) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_id, opponent_id)
+);
+
+CREATE OR REPLACE FUNCTION updateopponents() RETURNS trigger AS $$
+BEGIN
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		DELETE FROM Opponents WHERE tournament_id = OLD.tournament_id 
+		AND (player_id, opponent_id) IN ((OLD.player_1, OLD.player_2), (OLD.player_2, OLD.player_1));
+	END IF;
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		INSERT INTO Opponents (tournament_id, player_id, opponent_id) 
+		VALUES (NEW.tournament_id, NEW.player_1, NEW.player_2), (NEW.tournament_id, NEW.player_2, NEW.player_1);
+	END IF;
+	RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_opponents AFTER INSERT OR UPDATE OR DELETE ON Matches
+FOR EACH ROW EXECUTE PROCEDURE updateopponents();
+
+/* Create a table to store the pairings of each round while its results come in.
+startRound() stores the pairings of a round here as pending matches, one per board, best placed 
+players first. Results are recorded against them as they arrive (a tie is a reported pairing 
+without a winner), and the round is then committed into Matches all at once, with a single 
+standings update. The pairings of committed rounds are kept as the history of the rounds. */
+
+CREATE TABLE Pairings
+(tournament_id integer,
+round integer,
+board integer,
+player_1 integer,
+player_2 integer,
+winner integer CONSTRAINT pairing_player CHECK (winner IS NULL OR winner IN (player_1, player_2)),
+reported boolean NOT NULL DEFAULT false,
+CONSTRAINT different_pairing_player CHECK (player_1 != player_2),
+FOREIGN KEY (tournament_id, round) REFERENCES Rounds(tournament_id, round) ON DELETE CASCADE,
+FOREIGN KEY (tournament_id, player_1) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+FOREIGN KEY (tournament_id, player_2) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, round, board)
+);
+
+--results are looked up by the pair of players, whichever order they are given in
+
+CREATE UNIQUE INDEX pairings_matchup ON Pairings(tournament_id, round, LEAST(player_1, player_2), GREATEST(player_1, player_2));
+
 --view of registered players
 
 CREATE VIEW v_registrant_names AS
 SELECT Registrants.tournament_id, Registrants.player_id, name 
 FROM Registrants, Players WHERE registrants.player_id=Players.id AND registrants.player_id!=0;
 
---view of the wins accumulated
+/* The views below cover every tournament, but they group by tournament_id, so a query that 
+filters them by tournament_id has the condition pushed below the GROUP BY. Only that 
+tournament's matches are then read, through the indexes above. None of the standings, OMW 
+or pairing functions use them. */
+
+--view of the wins accumulated in each tournament
 
 CREATE VIEW v_wins AS
-SELECT Tournaments.id AS tournament_id, Matches.winner AS player_id, count (*) as wins
-FROM Players, Tournaments, Matches
-WHERE Matches.winner = Players.id AND
-Tournaments.id = Matches.tournament_id
-GROUP BY Tournaments.id, Matches.winner
-ORDER BY player_id;
+SELECT Matches.tournament_id, Matches.winner AS player_id, count (*) as wins
+FROM Matches
+WHERE Matches.winner IS NOT NULL
+GROUP BY Matches.tournament_id, Matches.winner;
 
---view of the matches for each registrant
+--view of the matches for each registrant in each tournament
 
 CREATE VIEW v_registrant_matches AS
-SELECT Registrants.player_id, count (*) AS matches FROM  Matches , Registrants
-WHERE Matches.player_1=Registrants.player_id OR Matches.player_2=Registrants.player_id
-GROUP BY Registrants.player_id;
-
---create functions to create Opponent Match Wins Functionality
-
---gets OMW for a single player
-
-CREATE OR REPLACE FUNCTION getplayeropponents(player integer)
-RETURNS TABLE(player_id int, omw numeric) AS $$
-	SELECT $1 as omw_Player, SUM (wins) as omw from (SELECT DISTINCT PLAYER_2 AS player_id FROM
-	Matches WHERE player_1=$1
-	UNION
-	SELECT DISTINCT PLAYER_1 AS player_id FROM Matches WHERE player_2=$1
-	order by player_id) j 
-	join v_wins on j.player_id = v_wins.player_id;
+SELECT Opponents.tournament_id, Opponents.player_id, count (*) AS matches
+FROM Opponents
+GROUP BY Opponents.tournament_id, Opponents.player_id;
+
+/* compute the standings of a tournament from scratch: id, wins, OMW, matches for every registrant.
+OMW (Opponent Match Wins) is the total number of wins, in this tournament, of every opponent a player has faced.
+The standings are computed in one pass over the tournament's matches: each match is read once and 
+turned into a result row for each of its players, which are then aggregated into records, and 
+the records of each player's opponents are summed into OMW. 
+This is used to build and check the Standings table below. */
+
+CREATE OR REPLACE FUNCTION computestandings(tournament integer)
+RETURNS TABLE(player_id int, wins bigint, omw bigint, matches bigint) AS $$
+	WITH results AS (
+		SELECT sides.player_id, sides.opponent_id, Matches.winner
+		FROM Matches, LATERAL (VALUES (Matches.player_1, Matches.player_2),
+			(Matches.player_2, Matches.player_1)) AS sides(player_id, opponent_id)
+		WHERE Matches.tournament_id = $1),
+	records AS (
+		SELECT results.player_id, count (*) AS matches,
+		sum (CASE WHEN results.winner = results.player_id THEN 1 ELSE 0 END) AS wins
+		FROM results
+		GROUP BY results.player_id),
+	omw AS (
+		SELECT results.player_id, sum (records.wins) AS omw
+		FROM results JOIN records ON (records.player_id = results.opponent_id)
+		GROUP BY results.player_id)
+	SELECT Registrants.player_id, 
+	COALESCE (records.wins, 0)::bigint AS wins,
+	COALESCE (omw.omw, 0)::bigint AS omw,
+	COALESCE (records.matches, 0) AS matches
+	FROM Registrants
+	LEFT OUTER JOIN records ON (Registrants.player_id = records.player_id)
+	LEFT OUTER JOIN omw ON (Registrants.player_id = omw.player_id)
+	WHERE Registrants.tournament_id = $1;
+$$ LANGUAGE SQL STABLE;
+
+/* Create a table to store the current standings of every registrant: wins, OMW and matches.
+The table is kept up to date by triggers on Registrants and Matches, in the same transaction as 
+the change, so reading the standings of a tournament is an index scan rather than a computation. */
+
+CREATE TABLE Standings
+(tournament_id integer,
+player_id integer,
+wins bigint NOT NULL DEFAULT 0,
+omw bigint NOT NULL DEFAULT 0,
+matches bigint NOT NULL DEFAULT 0,
+FOREIGN KEY (tournament_id, player_id) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_id)
+);
+
+CREATE INDEX standings_rank ON Standings(tournament_id, wins DESC, omw DESC, player_id);
+
+/* the Standings rows of a tournament are changed by one transaction at a time. Applying a match 
+changes the rows of both players and of all their opponents, so two transactions applying matches 
+at once could lock the same rows in opposite orders and deadlock, and a rebuild could insert rows 
+another transaction is inserting too. The lock is a transaction-level advisory lock keyed 
+(1, tournament id), released at COMMIT or ROLLBACK. */
+
+CREATE OR REPLACE FUNCTION lockstandings(tournament integer)
+RETURNS void AS $$
+	SELECT pg_advisory_xact_lock(1, $1);
 $$ LANGUAGE SQL;
 
---loops through all registered players for a given tournament, getting OMW for each
+/* tell listeners on the tournament_results channel that the matches of a tournament changed, with 
+its id as payload (see StandingsFeed in tournament.py). Notifications are delivered at COMMIT, and 
+identical ones from one transaction only once, so a transaction recording many results of a 
+tournament sends a single notification. Matches recorded with tournament.defer_standings on are 
+announced by rebuildstandings() instead. */
 
-CREATE OR REPLACE FUNCTION gettournamentomw(tournament integer)
-RETURNS TABLE(player_id int, omw numeric) AS $BODY$
-DECLARE
-	r Registrants%rowtype;
+CREATE OR REPLACE FUNCTION notifyresults(tournament integer)
+RETURNS void AS $$
+	SELECT pg_notify('tournament_results', $1::text);
+$$ LANGUAGE SQL;
+
+--every registrant starts with an empty record
+
+CREATE OR REPLACE FUNCTION addstanding() RETURNS trigger AS $$
 BEGIN
-	FOR r IN SELECT * FROM registrants WHERE Registrants.player_id != 0 and tournament_id = $1 ORDER BY player_id LOOP 
-	RETURN QUERY SELECT * from getplayeropponents(r.player_id);	 	
-	END LOOP;
-	RETURN;
+	PERFORM lockstandings(NEW.tournament_id);
+	INSERT INTO Standings (tournament_id, player_id) VALUES (NEW.tournament_id, NEW.player_id);
+	RETURN NULL;
 END
-$BODY$
-LANGUAGE 'plpgsql' ;
+$$ LANGUAGE plpgsql;
 
--- compile the overall standings: id, name, wins, matches
--- This function returns more data than is strictly needed to pass the test cases.
--- It is limited in the python portion but could easily deliver all this information with minor modification.
+CREATE TRIGGER registrants_standings AFTER INSERT ON Registrants
+FOR EACH ROW EXECUTE PROCEDURE addstanding();
+
+/* credit (sign 1) or take back (sign -1) a win: the winner's wins change and so does the OMW of 
+every opponent they have played, apart from the opponent of the match being applied */
+
+CREATE OR REPLACE FUNCTION creditwin(tournament integer, winner integer, loser integer, sign integer)
+RETURNS void AS $$
+	UPDATE Standings SET wins = wins + $4
+	WHERE tournament_id = $1 AND player_id = $2;
+	UPDATE Standings SET omw = omw + $4
+	WHERE tournament_id = $1 AND player_id IN (
+		SELECT opponent_id FROM Opponents WHERE tournament_id = $1 AND player_id = $2 AND opponent_id != $3);
+$$ LANGUAGE SQL;
+
+/* add (sign 1) or remove (sign -1) a match between two players: each has one more or one fewer 
+match and gains or loses the other's wins from their OMW */
+
+CREATE OR REPLACE FUNCTION pairplayers(tournament integer, player_1 integer, player_2 integer, sign integer)
+RETURNS void AS $$
+	UPDATE Standings SET matches = Standings.matches + $4,
+	omw = Standings.omw + $4 * opponent.wins
+	FROM Standings opponent
+	WHERE Standings.tournament_id = $1 AND opponent.tournament_id = $1
+	AND ((Standings.player_id = $2 AND opponent.player_id = $3) 
+	OR (Standings.player_id = $3 AND opponent.player_id = $2));
+$$ LANGUAGE SQL;
+
+/* apply each match to the standings as it is recorded or removed.
+Bulk operations set tournament.defer_standings to 'on' for their transaction and call 
+rebuildstandings() once instead, which is cheaper than applying thousands of matches one by one. */
+
+CREATE OR REPLACE FUNCTION updatestandings() RETURNS trigger AS $$
+BEGIN
+	IF current_setting('tournament.defer_standings') = 'on' THEN
+		RETURN NULL;
+	END IF;
+	IF TG_OP = 'INSERT' THEN
+		PERFORM lockstandings(NEW.tournament_id);
+		PERFORM notifyresults(NEW.tournament_id);
+	ELSE
+		PERFORM lockstandings(OLD.tournament_id);
+		PERFORM notifyresults(OLD.tournament_id);
+	END IF;
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		PERFORM pairplayers(OLD.tournament_id, OLD.player_1, OLD.player_2, -1);
+		IF OLD.winner IS NOT NULL THEN
+			PERFORM creditwin(OLD.tournament_id, OLD.winner, 
+				OLD.player_1 + OLD.player_2 - OLD.winner, -1);
+		END IF;
+	END IF;
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		IF NEW.winner IS NOT NULL THEN
+			PERFORM creditwin(NEW.tournament_id, NEW.winner, 
+				NEW.player_1 + NEW.player_2 - NEW.winner, 1);
+		END IF;
+		PERFORM pairplayers(NEW.tournament_id, NEW.player_1, NEW.player_2, 1);
+	END IF;
+	RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_standings AFTER INSERT OR UPDATE OR DELETE ON Matches
+FOR EACH ROW EXECUTE PROCEDURE updatestandings();
+
+--recompute the Standings rows of a tournament from its matches, to recover from any inconsistency
+
+CREATE OR REPLACE FUNCTION rebuildstandings(tournament integer)
+RETURNS void AS $$
+	SELECT lockstandings($1);
+	DELETE FROM Standings WHERE tournament_id = $1;
+	INSERT INTO Standings (tournament_id, player_id, wins, omw, matches)
+	SELECT $1, player_id, wins, omw, matches FROM computestandings($1);
+	SELECT notifyresults($1);
+$$ LANGUAGE SQL;
+
+--list the Standings rows of a tournament that don't match its matches, with stored and computed values
+
+CREATE OR REPLACE FUNCTION checkstandings(tournament integer)
+RETURNS TABLE(player_id int, wins bigint, computed_wins bigint, omw bigint, computed_omw bigint, 
+	matches bigint, computed_matches bigint) AS $$
+	SELECT COALESCE (stored.player_id, computed.player_id), 
+	stored.wins, computed.wins, stored.omw, computed.omw, stored.matches, computed.matches
+	FROM (SELECT * FROM Standings WHERE tournament_id = $1) stored
+	FULL OUTER JOIN computestandings($1) computed ON (stored.player_id = computed.player_id)
+	WHERE (stored.wins, stored.omw, stored.matches) 
+	IS DISTINCT FROM (computed.wins, computed.omw, computed.matches)
+	ORDER BY 1;
+$$ LANGUAGE SQL STABLE;
+
+/* compile the overall standings: id, name, wins, matches
+This function returns more data than is strictly needed to pass the test cases.
+It is limited in the python portion but could easily deliver all this information with minor modification. */
 
 CREATE OR REPLACE FUNCTION getstandings(tournament integer)
 RETURNS TABLE(tournament_id int, player_id int, name text, wins bigint, omw numeric, matches bigint) AS $$
-	WITH omw AS (SELECT * FROM gettournamentomw($1))
-	SELECT v_registrant_names.tournament_id, v_registrant_names.player_id, v_registrant_names.name, 
-	COALESCE (v_wins.wins, 0) AS wins,
-	COALESCE (omw.omw, 0) AS omw,
-	COALESCE (v_registrant_matches.matches, 0) AS matches
-	FROM v_registrant_names
-	LEFT OUTER JOIN v_wins ON (v_registrant_names.player_id = v_wins.player_id)
-	LEFT OUTER JOIN v_registrant_matches ON (v_registrant_matches.player_id=v_registrant_names.player_id)
-	LEFT OUTER JOIN omw ON (v_registrant_names.player_id = omw.player_id)
-    WHERE v_registrant_names.tournament_id = $1
-	ORDER BY wins desc, omw desc, player_id;
-$$ LANGUAGE SQL;
+	SELECT Standings.tournament_id, Standings.player_id, Players.name, 
+	Standings.wins, Standings.omw::numeric, Standings.matches
+	FROM Standings JOIN Players ON (Standings.player_id = Players.id)
+	WHERE Standings.tournament_id = $1 AND Standings.player_id != 0
+	ORDER BY Standings.wins desc, Standings.omw desc, Standings.player_id;
+$$ LANGUAGE SQL STABLE;
+
+/* Finished tournaments can be moved out of the live tables into the archive tables below, so that 
+the tables live events read and write hold only live events. An archived tournament keeps its name 
+and tiebreaks, each player's final record and its matches with their rounds. Its Opponents, 
+Standings, Rounds and Pairings rows are dropped. */
+
+CREATE TABLE ArchivedTournaments
+(id integer primary key,
+name text,
+tiebreaks text,
+archived timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE ArchivedRegistrants
+(tournament_id integer references ArchivedTournaments(id) ON DELETE CASCADE,
+player_id integer references Players(id) ON DELETE CASCADE,
+wins bigint NOT NULL DEFAULT 0,
+omw bigint NOT NULL DEFAULT 0,
+matches bigint NOT NULL DEFAULT 0,
+PRIMARY KEY (tournament_id, player_id)
+);
+
+CREATE TABLE ArchivedMatches
+(tournament_id integer,
+player_1 integer,
+player_2 integer,
+winner integer,
+round integer,
+FOREIGN KEY (tournament_id, player_1) REFERENCES ArchivedRegistrants(tournament_id, player_id) ON DELETE CASCADE,
+FOREIGN KEY (tournament_id, player_2) REFERENCES ArchivedRegistrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_1, player_2)
+);
+
+CREATE INDEX archivedmatches_player_2 ON ArchivedMatches(tournament_id, player_2);
+
+/* remove a live tournament with everything that refers to it: its registrants, matches, 
+opponents, standings, rounds and pairings. The standings triggers are skipped for the cascade, as 
+they would only undo its matches one by one. Returns false if there was no such tournament. */
+
+CREATE OR REPLACE FUNCTION droptournament(tournament integer)
+RETURNS boolean AS $$
+DECLARE
+	deferred text := current_setting('tournament.defer_standings');
+	live boolean;
+BEGIN
+	PERFORM lockstandings($1);
+	PERFORM set_config('tournament.defer_standings', 'on', true);
+	DELETE FROM Tournaments WHERE id = $1;
+	live := FOUND;
+	PERFORM set_config('tournament.defer_standings', deferred, true);
+	IF live THEN
+		PERFORM notifyresults($1);
+	END IF;
+	RETURN live;
+END
+$$ LANGUAGE plpgsql;
+
+--remove a tournament, live or archived. Returns false if there was no such tournament.
+
+CREATE OR REPLACE FUNCTION deletetournament(tournament integer)
+RETURNS boolean AS $$
+BEGIN
+	IF droptournament($1) THEN
+		RETURN true;
+	END IF;
+	DELETE FROM ArchivedTournaments WHERE id = $1;
+	RETURN FOUND;
+END
+$$ LANGUAGE plpgsql;
+
+/* move a live tournament to the archive tables, with one bulk INSERT for each, then remove it from 
+the live tables. Its players' records are archived as they are stored in Standings. Returns false 
+if there is no such live tournament. */
+
+CREATE OR REPLACE FUNCTION archivetournament(tournament integer)
+RETURNS boolean AS $$
+BEGIN
+	PERFORM lockstandings($1);
+	INSERT INTO ArchivedTournaments (id, name, tiebreaks)
+	SELECT id, name, tiebreaks FROM Tournaments WHERE id = $1;
+	IF NOT FOUND THEN
+		RETURN false;
+	END IF;
+	INSERT INTO ArchivedRegistrants (tournament_id, player_id, wins, omw, matches)
+	SELECT $1, Registrants.player_id, COALESCE(Standings.wins, 0), COALESCE(Standings.omw, 0), 
+	COALESCE(Standings.matches, 0)
+	FROM Registrants LEFT OUTER JOIN Standings USING (tournament_id, player_id)
+	WHERE Registrants.tournament_id = $1;
+	INSERT INTO ArchivedMatches (tournament_id, player_1, player_2, winner, round)
+	SELECT tournament_id, player_1, player_2, winner, round FROM Matches WHERE tournament_id = $1;
+	RETURN droptournament($1);
+END
+$$ LANGUAGE plpgsql;
 
 --insert an artificial player to act as the bye round. 
 
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio version of the tournament.py API
+#
+# The core functions of tournament.py have coroutines here with the same
+# names, arguments and results, running on an aiopg connection pool so that
+# one event loop can serve many tournaments at once: creating tournaments
+# and players, registration, reporting matches, the counts and checks,
+# standings and pages of them, pairings, byes, tiebreaks, rounds from
+# startRound() to Round.commit(), rebuilding standings and the deletes.
+# pairAll(), streamed standings, arrayStandings(), StandingsFeed and
+# archiving are only offered by tournament.py.  This module needs Python
+# 3.5 or later and aiopg.
+
+import asyncio
+import time
+
+import aiopg
+
+import swiss
+import tiebreaks
+import tournament as sync
+from tournament_core import (
+    COUNT_PLAYERS_QUERY, CREATE_PLAYER_QUERY, CREATE_TOURNAMENT_QUERY,
+    ENSURE_TOURNAMENT_QUERY, ENTER_BYE_QUERY, ENTER_TOURNAMENT_QUERY,
+    IS_REGISTERED_QUERY, PLAYED_PAIRS_QUERY, REPORT_MATCH_QUERY,
+    SET_TIEBREAKS_QUERY, TIEBREAK_MATCHES_QUERY, TOURNAMENT_EXISTS_QUERY,
+    matchRow, orderStandings, stats)
+
+# connection settings, see configurePool()
+
+POOL_MIN = 1
+POOL_MAX = 10
+
+_pool = None
+_pool_settings = {"minsize": POOL_MIN, "maxsize": POOL_MAX}
+
+
+async def configurePool(minsize=POOL_MIN, maxsize=POOL_MAX, dsn=None):
+    """Configures the connection pool.  It is created on first use."""
+    global _pool_settings
+    await closePool()
+    _pool_settings = {"minsize": minsize, "maxsize": maxsize, "dsn": dsn}
+
+
+async def closePool():
+    """Closes the connection pool.  It is recreated on the next query."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+
+
+async def getPool():
+    """Returns the module connection pool, creating it if needed."""
+    global _pool
+    if _pool is None:
+        settings = dict(_pool_settings)
+        dsn = settings.pop("dsn", None) or sync.DSN
+        pool = await aiopg.create_pool(dsn, **settings)
+        if _pool is None:
+            _pool = pool
+        else:
+            # another task created the pool while this one was connecting
+            pool.close()
+            await pool.wait_closed()
+    return _pool
+
+
+async def _run(pg, type, query, params):
+    """Executes a query on a connection and fetches its result."""
+    start = time.time()
+    async with pg.cursor() as c:
+        await c.execute(query, params)
+        if type == "fetchone":
+            result = await c.fetchone()
+        elif type == "fetchall":
+            result = await c.fetchall()
+        else:
+            result = None
+        stats.recordQuery(
+            query, time.time() - start, max(c.rowcount, 0))
+    return result
+
+
+async def sql(type, query, params=(), session=None):
+    """Runs SQL commands in the tournament database, see tournament.sql()."""
+    if type not in ["commit", "fetchone", "fetchall"]:
+        raise ValueError(
+            "Type unknown, use \"commit\", \"fetchone\", or \"fetchall.\"")
+    if session is not None:
+        return await session.execute(type, query, params)
+    pool = await getPool()
+    async with pool.acquire() as pg:
+        return await _run(pg, type, query, params)
+
+
+class Transaction(object):
+    """A unit of work sharing one connection and commit, used with
+    "async with".  Transactions nest, see tournament.Transaction.
+    """
+
+    def __init__(self):
+        self._pg = None
+        self._pool = None
+        self._depth = 0
+        self._on_commit = []
+
+    async def __aenter__(self):
+        if self._depth == 0:
+            self._pool = await getPool()
+            self._pg = await self._pool.acquire()
+            try:
+                await _run(self._pg, "commit", "BEGIN", ())
+            except Exception:
+                self._release()
+                raise
+        self._depth += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth == 0:
+            callbacks, self._on_commit = self._on_commit, []
+            try:
+                await _run(self._pg, "commit",
+                           "COMMIT" if exc_type is None else "ROLLBACK", ())
+            finally:
+                self._release()
+            if exc_type is None:
+                for callback in callbacks:
+                    callback()
+        return False
+
+    def _release(self):
+        pg, pool = self._pg, self._pool
+        self._pg = self._pool = None
+        pool.release(pg)
+
+    def onCommit(self, callback):
+        """Calls callback once the transaction has committed."""
+        if self._pg is None:
+            raise ValueError(
+                "Transaction is not open, use it in an async with block.")
+        self._on_commit.append(callback)
+
+    async def execute(self, type, query, params=()):
+        """Runs a query inside the transaction, see sql()."""
+        if self._pg is None:
+            raise ValueError(
+                "Transaction is not open, use it in an async with block.")
+        return await _run(self._pg, type, query, params)
+
+
+def transaction(session=None):
+    """Returns session if one was given, otherwise a new Transaction."""
+    if session is None:
+        return Transaction()
+    return session
+
+
+async def insertMany(table, columns, rows, session):
+    """Inserts rows with multi-row INSERTs, see tournament.insertMany()."""
+    for query, params in sync.insertStatements(table, columns, rows):
+        await sql("commit", query, params, session)
+
+
+async def deferStandings(session):
+    """Stops match triggers updating Standings for this transaction."""
+    query = "SET LOCAL tournament.defer_standings = 'on'"
+    await sql("commit", query, session=session)
+
+
+async def standingsChanged(tournament=None, session=None):
+    """Invalidates cached standings, see tournament.standingsChanged()."""
+    if sync._cache_settings["notify"]:
+        payload = "" if tournament is None else str(tournament)
+        query = "SELECT pg_notify(%s, %s)"
+        await sql("fetchone", query, (sync.NOTIFY_CHANNEL, payload), session)
+    if session is None:
+        sync.cache.invalidate(tournament)
+    else:
+        session.onCommit(lambda: sync.cache.invalidate(tournament))
+
+
+async def reservePlayerIds(count, session=None):
+    """Reserves count new player ids, in ascending order."""
+    if count == 0:
+        return []
+    query = ("SELECT nextval('players_id_seq') "
+             "FROM generate_series(1, %s)")
+    fetch = await sql("fetchall", query, (count,), session)
+    return sorted(row[0] for row in fetch)
+
+
+async def ensureTournament(tournament=1, name="Tournament 1", session=None):
+    """Creates a tournament unless it already exists."""
+    await sql("commit", ENSURE_TOURNAMENT_QUERY, (tournament, name), session)
+
+
+async def lockTournament(tournament, session):
+    """Takes the pairing lock of a tournament, see
+    tournament.lockTournament()."""
+    query = "SELECT pg_advisory_xact_lock(%s, %s)"
+    await sql("fetchone", query, (sync.PAIRING_LOCK, tournament), session)
+
+# "create" functions
+
+
+async def createTournament(id=1, name="Tournament 1", session=None):
+    """Create a new tournament."""
+    params = (id, name)
+    if await sql("fetchone", CREATE_TOURNAMENT_QUERY, params, session) is None:
+        raise ValueError(
+            "Tournament %d already exists." % id)
+
+
+async def createPlayer(name, session=None):
+    """Create a new player.  Returns the id the database assigned to them."""
+    async with transaction(session) as t:
+        return (await sql("fetchone", CREATE_PLAYER_QUERY, (name,), t))[0]
+
+
+async def registerPlayers(names, tournament=1,
+                          tournament_name="Tournament 1", session=None):
+    """Adds many players to a tournament.  Returns their ids in order."""
+    names = list(names)
+    async with transaction(session) as t:
+        await ensureTournament(tournament, tournament_name, t)
+        ids = await reservePlayerIds(len(names), t)
+        await insertMany("Players", ("id", "name"), list(zip(ids, names)), t)
+        await insertMany("Registrants", ("tournament_id", "player_id"),
+                         [(tournament, player_id) for player_id in ids], t)
+        await standingsChanged(tournament, t)
+    return ids
+
+
+async def reportMatch(winner, loser, tournament=1, tied="n",
+                      session=None):
+    """Records the outcome of a single match between two players."""
+    params = matchRow(winner, loser, tournament, tied)
+    async with transaction(session) as t:
+        await ensureTournament(tournament, session=t)
+        await sql("commit", REPORT_MATCH_QUERY, params, t)
+        await standingsChanged(tournament, t)
+
+
+async def reportMatches(results, tournament=1, session=None):
+    """Records the outcomes of many matches in a single transaction."""
+    rows = [matchRow(result[0], result[1], tournament, *result[2:])
+            for result in results]
+    async with transaction(session) as t:
+        await ensureTournament(tournament, session=t)
+        await deferStandings(t)
+        await insertMany("Matches",
+                         ("tournament_id", "player_1", "player_2", "winner"),
+                         rows, t)
+        await rebuildStandings(tournament, t)
+
+# "read" functions
+
+
+async def countPlayers(tournament=1, session=None):
+    """Returns the number of players registered for the given tournament."""
+    fetch = await sql("fetchone", COUNT_PLAYERS_QUERY, (tournament,), session)
+    return int(fetch[0])
+
+
+async def isRegistered(player_id=0, tournament_id=1, session=None):
+    """Determines if a specific player is registered for a tournament."""
+    params = (tournament_id, player_id)
+    fetch = await sql("fetchone", IS_REGISTERED_QUERY, params, session)
+    return fetch[0] == 1
+
+
+async def tournamentExists(tournament=1, session=None):
+    """Determines if a specific tournament already exists or not."""
+    params = (tournament,)
+    fetch = await sql("fetchone", TOURNAMENT_EXISTS_QUERY, params, session)
+    if fetch[0] > 1:
+        raise ValueError(
+            "Check database for consistency in Tournaments table.")
+    return fetch[0] == 1
+
+
+async def checkStandings(tournament=1, session=None):
+    """Compares the stored standings of a tournament with its matches."""
+    query = "SELECT * FROM checkstandings(%s)"
+    return await sql("fetchall", query, (tournament,), session)
+
+
+async def playerStandings(tournament=1, session=None):
+    """Returns (id, name, wins, matches) tuples, best placed first.  They
+    are read through tournament.cache outside a session, when it is on.
+    """
+    if session is not None or sync.cache.size <= 0:
+        return await _standings(tournament, session)
+    version = sync.cache.version(tournament)
+    fetch = sync.cache.get(tournament)
+    if fetch is None:
+        fetch = await _standings(tournament, session)
+        sync.cache.put(tournament, version, fetch)
+    return fetch
+
+
+async def _standings(tournament, session):
+    params = (tournament, tournament)
+    fetch = await sql("fetchall", sync.STANDINGS_QUERY, params, session)
+    matches = []
+    if fetch and fetch[0][4]:
+        matches = await sql("fetchall", TIEBREAK_MATCHES_QUERY,
+                            (tournament,), session)
+    return orderStandings(fetch, lambda: matches)
+
+
+async def standingsPage(tournament=1, after=None, limit=sync.PAGE_SIZE,
+                        session=None):
+    """Returns one page of a tournament's standings, see
+    tournament.standingsPage().
+    """
+    if after is None:
+        return await sql("fetchall", sync.FIRST_PAGE_QUERY,
+                         (tournament, limit), session)
+    params = (tournament, after, tournament, limit, tournament, limit,
+              tournament, limit, limit)
+    return await sql("fetchall", sync.PAGE_QUERY, params, session)
+
+
+async def playedPairs(tournament=1, session=None):
+    """Returns the set of pairs of players who have met in a tournament."""
+    fetch = await sql("fetchall", PLAYED_PAIRS_QUERY, (tournament,), session)
+    return swiss.playedPairs(fetch)
+
+
+async def swissPairings(tournament=1, session=None):
+    """Returns (id1, name1, id2, name2) pairs for the next round, see
+    tournament.swissPairings().  The pairing search runs in the event
+    loop's default executor, so other tasks go on while it backtracks.
+    """
+    async with transaction(session) as t:
+        standings = await playerStandings(tournament, t)
+        bye = len(standings) % 2 == 1
+        if bye and await sql("fetchone", ENTER_BYE_QUERY, (tournament,), t):
+            await standingsChanged(tournament, t)
+        played = await playedPairs(tournament, t)
+    return await asyncio.get_event_loop().run_in_executor(
+        None, swiss.pairings, standings, played, bye)
+
+# "update" functions
+
+
+async def setTiebreaks(names, tournament=1, session=None):
+    """Chooses how players tied on wins are ordered, see
+    tournament.setTiebreaks().
+    """
+    names = list(names)
+    if names:
+        tiebreaks.checkTiebreaks(names)
+    params = (",".join(names) or None, tournament)
+    async with transaction(session) as t:
+        if await sql("fetchone", SET_TIEBREAKS_QUERY, params, t) is None:
+            raise ValueError("Tournament %d does not exist." % tournament)
+        await standingsChanged(tournament, t)
+
+
+async def enterTournament(player_id, tournament_id=1, session=None):
+    """Insert an existing player into a tournament."""
+    params = (tournament_id, player_id)
+    await sql("commit", ENTER_TOURNAMENT_QUERY, params, session)
+    await standingsChanged(tournament_id, session)
+
+
+async def registerPlayer(name, tournament=1,
+                         tournament_name="Tournament 1", session=None):
+    """Adds a player to a tournament.  Returns the new player's id."""
+    async with transaction(session) as t:
+        await ensureTournament(tournament, tournament_name, t)
+        player_id = await createPlayer(name, t)
+        await enterTournament(player_id, tournament, t)
+    return player_id
+
+
+async def byeMatch(tournament=1, session=None):
+    """Returns the bye round match-up, see tournament.byeMatch()."""
+    params = {"tournament": tournament}
+    fetch = await sql("fetchone", sync.BYE_QUERY, params, session)
+    if fetch is None:
+        return []
+    return tuple(fetch) + (0, 'bye round')
+
+# "round" functions
+
+
+class Round(object):
+    """A round of a tournament whose results are reported with coroutines,
+    see tournament.Round.
+    """
+
+    def __init__(self, tournament, number, pairings):
+        self.tournament = tournament
+        self.number = number
+        self.pairings = pairings
+
+    async def reportMatch(self, winner, loser, tied="n", session=None):
+        """Records the result of one of the round's matches, see
+        tournament.Round.reportMatch()."""
+        row = matchRow(winner, loser, self.tournament, tied)
+        params = (row[3], self.tournament, self.number,
+                  winner, loser, winner, loser)
+        fetch = await sql("fetchone", sync.REPORT_PAIRING_QUERY, params,
+                          session)
+        if fetch is None:
+            raise ValueError(
+                "Players %d and %d aren't paired in round %d, or it has "
+                "already been committed." % (winner, loser, self.number))
+
+    async def pendingMatches(self, session=None):
+        """Returns the pairings whose results haven't been reported yet."""
+        params = (self.tournament, self.number)
+        fetch = await sql("fetchall", sync.PENDING_PAIRINGS_QUERY, params,
+                          session)
+        pending = set(swiss.pairKey(player_1, player_2)
+                      for player_1, player_2 in fetch)
+        return [row for row in self.pairings
+                if swiss.pairKey(row[0], row[2]) in pending]
+
+    async def commit(self, session=None):
+        """Records every result of the round as a match, all at once, see
+        tournament.Round.commit()."""
+        params = (self.tournament, self.number)
+        async with transaction(session) as t:
+            fetch = await sql("fetchone", sync.COUNT_PENDING_QUERY, params, t)
+            if fetch[0]:
+                raise ValueError(
+                    "%d matches of round %d haven't been reported yet." %
+                    (fetch[0], self.number))
+            await deferStandings(t)
+            await sql("commit", sync.COMMIT_ROUND_QUERY, params, t)
+            await rebuildStandings(self.tournament, t)
+
+
+async def startRound(tournament=1, session=None):
+    """Pairs the next round of a tournament and stores it as pending, see
+    tournament.startRound().  Returns the new Round.
+    """
+    async with transaction(session) as t:
+        await lockTournament(tournament, t)
+        current = await currentRound(tournament, t)
+        if current is not None:
+            raise ValueError(
+                "Round %d of tournament %d hasn't been committed yet." %
+                (current.number, tournament))
+        fetch = await sql("fetchone", sync.NEXT_ROUND_QUERY,
+                          (tournament, tournament), t)
+        pairings = await swissPairings(tournament, t)
+        await insertMany("Pairings", sync.PAIRING_COLUMNS,
+                         sync.pairingRows(tournament, fetch[0], pairings), t)
+    return Round(tournament, fetch[0], pairings)
+
+
+async def currentRound(tournament=1, session=None):
+    """Returns the Round of a tournament that hasn't been committed yet,
+    or None if there isn't one.
+    """
+    fetch = await sql("fetchall", sync.CURRENT_ROUND_QUERY, (tournament,),
+                      session)
+    if not fetch:
+        return None
+    return Round(tournament, fetch[0][0], [tuple(row[1:]) for row in fetch])
+
+# "delete" functions
+
+
+async def rebuildStandings(tournament=1, session=None):
+    """Recomputes the stored standings of a tournament from its matches."""
+    query = "SELECT rebuildstandings(%s)"
+    await sql("fetchone", query, (tournament,), session)
+    await standingsChanged(tournament, session)
+
+
+async def deleteMatches(session=None):
+    """Remove all the match records from the database, archived or not."""
+    async with transaction(session) as t:
+        await deferStandings(t)
+        query = ("DELETE FROM Matches; DELETE FROM Rounds; "
+                 "UPDATE Standings SET wins = 0, omw = 0, matches = 0; "
+                 "DELETE FROM ArchivedMatches; "
+                 "UPDATE ArchivedRegistrants "
+                 "SET wins = 0, omw = 0, matches = 0")
+        await sql("commit", query, session=t)
+        await standingsChanged(session=t)
+
+
+async def deletePlayers(session=None):
+    """Remove all the player records from the database, but the bye."""
+    query = ("DELETE FROM Registrants; DELETE FROM Rounds; "
+             "DELETE FROM Players where id !=0")
+    await sql("commit", query, session=session)
+    await standingsChanged(session=session)
+
+
+async def deleteTournaments(session=None):
+    """Remove all the tournament records from the database."""
+    query = "DELETE FROM Tournaments; DELETE FROM ArchivedTournaments"
+    await sql("commit", query, session=session)
+    await standingsChanged(session=session)
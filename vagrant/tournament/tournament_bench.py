@@ -0,0 +1,775 @@
+#!/usr/bin/env python
+#
+# tournament_bench.py -- benchmarks for tournament.py
+#
+# These benchmarks write to the tournament database, so recreate it with
+# tournament.sql before and after running them, or give --clone to run them
+# against a clone of the template database instead (see
+# tournament_fixtures.py).  For example:
+#
+#     python tournament_bench.py register --players 10000
+#     python tournament_bench.py --clone bulk --players 100000
+
+import argparse
+import json
+import random
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import swiss
+import tiebreaks
+import tournament
+import tournament_fixtures
+import tournament_sqlite
+from tournament_state import TournamentState
+
+
+class RoundTripCounter(object):
+    """Counts the connections and statements tournament.py sends.
+
+    A round trip is counted for every connection handshake, every statement,
+    every separate COMMIT (only needed outside a transaction when pooling is
+    off, since pooled connections run in autocommit mode) and for the BEGIN
+    and COMMIT of every Transaction.
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.statements = 0
+        self.commits = 0
+        self.transactions = 0
+
+    def __enter__(self):
+        self._connect = tournament.connect
+        self._sql = tournament.sql
+        self._begin = vars(tournament.Transaction)["_begin"]
+
+        def connect(*args, **kwargs):
+            self.connections += 1
+            return self._connect(*args, **kwargs)
+
+        def sql(type, query, params=(), session=None, prepare=None):
+            self.statements += 1
+            if type == "commit" and session is None and \
+                    tournament.getPool() is None:
+                self.commits += 1
+            return self._sql(type, query, params, session, prepare)
+
+        def begin(transaction):
+            self.transactions += 1
+            return self._begin(transaction)
+
+        tournament.connect = connect
+        tournament.sql = sql
+        tournament.Transaction._begin = begin
+        return self
+
+    def __exit__(self, *exc):
+        tournament.connect = self._connect
+        tournament.sql = self._sql
+        tournament.Transaction._begin = self._begin
+
+    @property
+    def round_trips(self):
+        return (self.connections + self.statements + self.commits +
+                2 * self.transactions)
+
+
+def benchRegister(players, pooled):
+    """Registers players one at a time and reports the cost."""
+    if pooled:
+        tournament.configurePool()
+    else:
+        tournament.configurePool(maxconn=0)
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    with RoundTripCounter() as counter:
+        start = time.time()
+        for i in range(players):
+            tournament.registerPlayer("Player %d" % i)
+        elapsed = time.time() - start
+    tournament.closePool()
+    return {"players": players, "pooled": pooled, "seconds": elapsed,
+            "connections": counter.connections,
+            "statements": counter.statements,
+            "round_trips": counter.round_trips}
+
+
+def benchBulk(players):
+    """Registers players and reports a round of matches in bulk."""
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    start = time.time()
+    ids = tournament.registerPlayers(
+        ["Player %d" % i for i in range(players)])
+    registered = time.time() - start
+    results = list(zip(ids[0::2], ids[1::2]))
+    start = time.time()
+    tournament.reportMatches(results)
+    reported = time.time() - start
+    return {"players": players, "register_seconds": registered,
+            "players_per_second": players / registered,
+            "matches": len(results), "report_seconds": reported,
+            "matches_per_second": len(results) / reported}
+
+
+def playRounds(ids, rounds, seed=0):
+    """Returns results for rounds of matches between players, no rematches.
+
+    In round r each player meets the player whose index differs from theirs
+    only in bit r, and the winner of each match is picked at random.
+    """
+    rng = random.Random(seed)
+    results = []
+    for r in range(rounds):
+        for i in range(len(ids)):
+            j = i ^ (1 << r)
+            if i < j < len(ids):
+                pair = [ids[i], ids[j]]
+                rng.shuffle(pair)
+                results.append(tuple(pair))
+    return results
+
+
+def benchRound(players, seed=0):
+    """Plays one round match by match, then as a Round, and times both."""
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    tournament.deleteTournaments()
+    result = {"players": players}
+    for name, tournament_id in (("matches", 1), ("round", 2)):
+        rng = random.Random(seed)
+        tournament.registerPlayers(
+            ["Player %d" % i for i in range(players)], tournament_id)
+        tournament.stats.reset()
+        start = time.time()
+        if name == "matches":
+            pairings = tournament.swissPairings(tournament_id)
+            report = lambda winner, loser: tournament.reportMatch(
+                winner, loser, tournament_id)
+        else:
+            current = tournament.startRound(tournament_id)
+            pairings = current.pairings
+            report = current.reportMatch
+        for id1, name1, id2, name2 in pairings:
+            if id2 != swiss.BYE:
+                if rng.random() < 0.5:
+                    report(id1, id2)
+                else:
+                    report(id2, id1)
+        if name == "round":
+            current.commit()
+        tournament.playerStandings(tournament_id)
+        result[name + "_seconds"] = time.time() - start
+        result[name + "_queries"] = tournament.stats.queries
+    return result
+
+
+def benchPairAll(tournaments, players, rounds, processes):
+    """Starts the next round of many tournaments one by one with
+    startRound(), then all at once with pairAll() on each number of
+    processes, from the same standings each time."""
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    tournament.deleteTournaments()
+    ids = range(1, tournaments + 1)
+    for tournament_id in ids:
+        registered = tournament.registerPlayers(
+            ["Player %d" % i for i in range(players)], tournament_id)
+        tournament.reportMatches(playRounds(registered, rounds, tournament_id),
+                                 tournament_id)
+    tournament.sql("commit", "ANALYZE")
+    result = {"tournaments": tournaments, "players": players,
+              "rounds": rounds, "runs": []}
+    for count in [None] + list(processes):
+        tournament.stats.reset()
+        start = time.time()
+        if count is None:
+            for tournament_id in ids:
+                tournament.startRound(tournament_id)
+        else:
+            tournament.pairAll(ids, count)
+        elapsed = time.time() - start
+        result["runs"].append({"processes": count, "seconds": elapsed,
+                               "queries": tournament.stats.queries})
+        # the next run pairs the same round again
+        tournament.sql("commit", "DELETE FROM Rounds WHERE NOT committed")
+    return result
+
+
+def explainPlan(query, params):
+    """Runs EXPLAIN (ANALYZE, BUFFERS) on a query and returns the plan."""
+    plan = tournament.sql(
+        "fetchone", "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query,
+        params)[0]
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    return plan[0]
+
+
+def explain(query, params):
+    """Runs EXPLAIN ANALYZE on a query and returns its execution time in ms."""
+    plan = explainPlan(query, params)
+    # PostgreSQL 9.3 calls the execution time "Total Runtime"
+    return plan.get("Execution Time", plan.get("Total Runtime"))
+
+
+def explainBlocks(query, params):
+    """Returns the buffer blocks a query touches, cached or read."""
+    plan = explainPlan(query, params)["Plan"]
+    return plan["Shared Hit Blocks"] + plan["Shared Read Blocks"]
+
+
+def benchStandings(players, rounds):
+    """Times getstandings() for a tournament after some rounds of play,
+    and the reads that avoid fetching all of it: a page from the middle,
+    the rank of the last player, and streaming every row."""
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    ids = tournament.registerPlayers(
+        ["Player %d" % i for i in range(players)])
+    tournament.reportMatches(playRounds(ids, rounds))
+    tournament.sql("commit", "ANALYZE")
+    explained = explain("SELECT * FROM getstandings(%s)", (1,))
+    start = time.time()
+    standings = tournament.playerStandings()
+    elapsed = time.time() - start
+    middle = standings[len(standings) // 2][0]
+    start = time.time()
+    tournament.standingsPage(after=middle)
+    page = time.time() - start
+    start = time.time()
+    tournament.playerRank(standings[-1][0])
+    rank = time.time() - start
+    start = time.time()
+    for row in tournament.iterStandings():
+        pass
+    streamed = time.time() - start
+    return {"players": players, "rounds": rounds,
+            "explain_ms": explained, "seconds": elapsed,
+            "page_seconds": page, "rank_seconds": rank,
+            "stream_seconds": streamed}
+
+
+def benchArrays(players, rounds):
+    """Times playerStandings() against arrayStandings() for a big event,
+    and measures the memory arrayStandings() takes where Python can."""
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    ids = tournament.registerPlayers(
+        ["Player %d" % i for i in range(players)])
+    results = playRounds(ids, rounds)
+    tournament.reportMatches(results)
+    tournament.sql("commit", "ANALYZE")
+    start = time.time()
+    stored = tournament.playerStandings()
+    stored_seconds = time.time() - start
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    computed = tournament.arrayStandings()
+    array_seconds = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"players": players, "rounds": rounds, "matches": len(results),
+            "stored_seconds": stored_seconds, "array_seconds": array_seconds,
+            "same": [tuple(row) for row in stored] == computed,
+            "peak_bytes": peak,
+            "budget_bytes": tiebreaks.memoryEstimate(players, len(results))}
+
+
+def archiveTournaments(first, count, players, rounds):
+    """Fills the database with finished tournaments, with ids from first."""
+    for tournament_id in range(first, first + count):
+        ids = tournament.registerPlayers(
+            ["Player %d" % i for i in range(players)], tournament_id,
+            "Archived %d" % tournament_id)
+        tournament.reportMatches(playRounds(ids, rounds, tournament_id),
+                                 tournament_id)
+
+
+# calls timed, and the first id of the events played, at each archive size
+
+ARCHIVE_REPEAT = 21
+ARCHIVE_EVENT = 1000000
+
+
+def medianTime(function, *args):
+    """Returns the median seconds of ARCHIVE_REPEAT calls to function."""
+    seconds = []
+    for i in range(ARCHIVE_REPEAT):
+        start = time.time()
+        function(*args)
+        seconds.append(time.time() - start)
+    return sorted(seconds)[len(seconds) // 2]
+
+
+def benchArchive(archived, players, rounds, move=False):
+    """Times one event's queries with more and more archived tournaments.
+
+    Args:
+      archived: ascending numbers of archived tournaments to measure at.
+      players: the players in each tournament, archived or not.
+      rounds: the rounds each tournament has played.
+      move: move the finished tournaments to the archive tables with
+        archiveTournament(), rather than leave them in the live tables.
+
+    Returns:
+      A list of dicts, one for each archive size, of the event's per call
+      times in ms and the buffer blocks its queries touch.  If queries are
+      scoped to the event, neither grows with the archive.
+    """
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    tournament.deleteTournaments()
+    results = []
+    done = 0
+    for count in archived:
+        archiveTournaments(done + 1, count - done, players, rounds)
+        start = time.time()
+        if move:
+            for tournament_id in range(done + 1, count + 1):
+                tournament.archiveTournament(tournament_id)
+        # the mean time archiveTournament() took a tournament
+        archive_seconds = (time.time() - start) / max(count - done, 1)
+        done = count
+        event = ARCHIVE_EVENT + len(results)
+        ids = tournament.registerPlayers(
+            ["Player %d" % i for i in range(players)], event)
+        tournament.reportMatches(playRounds(ids, rounds), event)
+        tournament.enterTournament(0, event)
+        tournament.sql("commit", "ANALYZE")
+        params = (event,)
+        result = {"archived": count, "players": players, "rounds": rounds,
+                  "moved": move,
+                  "archiveTournament_ms": 1000 * archive_seconds}
+        for name, query in [
+                ("getstandings", "SELECT * FROM getstandings(%s)"),
+                ("computestandings", "SELECT * FROM computestandings(%s)"),
+                ("pairs", "SELECT player_id, opponent_id FROM Opponents "
+                          "WHERE tournament_id = %s "
+                          "AND player_id < opponent_id")]:
+            result[name + "_blocks"] = explainBlocks(query, params)
+        result["bye_blocks"] = explainBlocks(tournament.BYE_QUERY,
+                                             {"tournament": event})
+        for function in (tournament.playerStandings,
+                         tournament.swissPairings, tournament.byeMatch,
+                         tournament.rebuildStandings):
+            result[function.__name__ + "_ms"] = \
+                1000 * medianTime(function, event)
+        results.append(result)
+    return results
+
+
+def adjacentPairings(standings):
+    """Pairs standings rows the way swissPairings() used to: row 1 with row
+    2, row 3 with row 4 and so on, whether or not they have met before."""
+    return [standings[i][:2] + standings[i + 1][:2]
+            for i in range(0, len(standings) - 1, 2)]
+
+
+def benchPairing(players, rounds, seed=0):
+    """Times the pairing engine against adjacent pairing, in memory."""
+    rng = random.Random(seed)
+    state = TournamentState()
+    state.registerPlayers(["Player %d" % i for i in range(players)])
+    if players % 2 == 1:
+        state.enterTournament(0)
+    engine = adjacent = 0.0
+    rematches = 0
+    for r in range(rounds):
+        standings = state.playerStandings()
+        played = state.playedPairs()
+        start = time.time()
+        adjacentPairings(standings)
+        adjacent += time.time() - start
+        rematches += sum(
+            1 for row in adjacentPairings(standings)
+            if swiss.pairKey(row[0], row[2]) in played)
+        start = time.time()
+        pairings = swiss.pairings(standings, played, players % 2 == 1)
+        engine += time.time() - start
+        for row in pairings:
+            if row[2] == swiss.BYE or rng.random() < 0.5:
+                state.reportMatch(row[0], row[2])
+            else:
+                state.reportMatch(row[2], row[0])
+    return {"players": players, "rounds": rounds,
+            "engine_seconds": engine / rounds,
+            "adjacent_seconds": adjacent / rounds,
+            "rematches": rematches}
+
+
+class DatabaseTournament(object):
+    """One tournament in the database, with TournamentState's methods."""
+
+    # the module whose database the tournament is kept in
+    backend = tournament
+
+    def __init__(self, tournament_id):
+        self.tournament = tournament_id
+
+    def registerPlayers(self, names):
+        return self.backend.registerPlayers(names, self.tournament)
+
+    def reportMatch(self, winner, loser, tied="n"):
+        self.backend.reportMatch(winner, loser, self.tournament, tied)
+
+    def playerStandings(self):
+        return self.backend.playerStandings(self.tournament)
+
+    def swissPairings(self):
+        return self.backend.swissPairings(self.tournament)
+
+    def byeMatch(self):
+        return self.backend.byeMatch(self.tournament)
+
+
+class SqliteTournament(DatabaseTournament):
+    """One tournament in the embedded SQLite database."""
+
+    backend = tournament_sqlite
+
+
+# the tournaments each simulation backend plays
+
+BACKENDS = {"postgres": DatabaseTournament, "sqlite": SqliteTournament,
+            "memory": TournamentState}
+
+
+class Timings(object):
+    """Collects the latency of every call made to each operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = {}
+
+    def time(self, name, function, *args):
+        """Calls function, timing it as the operation name."""
+        start = time.time()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.time() - start
+            with self._lock:
+                self.seconds.setdefault(name, []).append(elapsed)
+
+    def summary(self, name):
+        """Returns the count, mean and percentiles of an operation in ms."""
+        seconds = sorted(self.seconds[name])
+
+        def percentile(p):
+            return 1000 * seconds[min(len(seconds) - 1,
+                                      int(p / 100.0 * len(seconds)))]
+        return {"count": len(seconds),
+                "mean_ms": 1000 * sum(seconds) / len(seconds),
+                "p50_ms": percentile(50), "p90_ms": percentile(90),
+                "p99_ms": percentile(99), "max_ms": 1000 * seconds[-1]}
+
+
+def simulateTournament(game, players, rounds, tie_rate, rng, timings):
+    """Plays a tournament through its register, pair and report loop.
+
+    Returns:
+      The number of rounds played, fewer than asked for if the players ran
+      out of opponents they hadn't met.
+    """
+    timings.time("registerPlayers", game.registerPlayers,
+                 ["Player %d" % i for i in range(players)])
+    for r in range(rounds):
+        try:
+            pairings = timings.time("swissPairings", game.swissPairings)
+        except ValueError:
+            return r
+        for id1, name1, id2, name2 in pairings:
+            if id2 == swiss.BYE:
+                timings.time("byeMatch", game.byeMatch)
+                timings.time("reportMatch", game.reportMatch, id1, id2)
+            elif rng.random() < tie_rate:
+                timings.time("reportMatch", game.reportMatch, id1, id2, "y")
+            elif rng.random() < 0.5:
+                timings.time("reportMatch", game.reportMatch, id1, id2)
+            else:
+                timings.time("reportMatch", game.reportMatch, id2, id1)
+        timings.time("playerStandings", game.playerStandings)
+    return rounds
+
+
+def benchSimulate(backend, tournaments, players, rounds, tie_rate=0.1,
+                  odd_share=0.5, threads=1, seed=0):
+    """Plays many synthetic tournaments at once on a backend.
+
+    Args:
+      backend: a key of BACKENDS.
+      tournaments: the number of tournaments, with ids 1 and up.
+      players: the players in each tournament.  An extra player joins
+        odd_share of the tournaments, so both odd and even counts are seen.
+      rounds: the rounds each tournament plays.
+      tie_rate: the share of matches that are tied.
+      threads: the tournaments played at the same time.
+      seed: seeds the results of every match.
+
+    Returns:
+      A dict of the settings, the wall time, and per operation the latency
+      summary from Timings and the queries sent, ready to save as JSON.
+    """
+    if backend != "memory":
+        database = BACKENDS[backend].backend
+        database.deleteMatches()
+        database.deletePlayers()
+        database.deleteTournaments()
+    tournament.stats.reset()
+    timings = Timings()
+    todo = list(range(tournaments, 0, -1))
+    played = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not todo:
+                    return
+                tournament_id = todo.pop()
+            rng = random.Random(seed * 1000003 + tournament_id)
+            size = players + (1 if rng.random() < odd_share else 0)
+            game = BACKENDS[backend](tournament_id)
+            played.append(simulateTournament(game, size, rounds, tie_rate,
+                                             rng, timings))
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+    calls = tournament.stats.asDict()["calls"]
+    operations = {}
+    for name in timings.seconds:
+        operations[name] = timings.summary(name)
+        operations[name]["queries"] = calls.get(name, {}).get("queries", 0)
+    return {"backend": backend, "tournaments": tournaments,
+            "players": players, "rounds": rounds, "tie_rate": tie_rate,
+            "odd_share": odd_share, "threads": threads, "seed": seed,
+            "rounds_played": sum(played), "seconds": elapsed,
+            "queries": tournament.stats.queries, "operations": operations}
+
+
+def report(result):
+    print("%(players)d players, pooled=%(pooled)s: %(seconds).2fs, "
+          "%(connections)d connections, %(statements)d statements, "
+          "%(round_trips)d round trips" % result)
+
+
+def reportStandings(result):
+    print("%(players)d players, %(rounds)d rounds: getstandings() executes "
+          "in %(explain_ms).1fms, playerStandings() takes %(seconds).3fs" %
+          result)
+    print("  standingsPage() %(page_seconds).4fs, playerRank() "
+          "%(rank_seconds).4fs, iterStandings() %(stream_seconds).3fs" %
+          result)
+
+
+def reportArrays(result):
+    print("%(players)d players, %(matches)d matches: playerStandings() "
+          "takes %(stored_seconds).3fs, arrayStandings() "
+          "%(array_seconds).3fs, same rows: %(same)s" % result)
+    if result["peak_bytes"] is not None:
+        print("arrayStandings() peaked at %.1fMB of a %.1fMB budget" %
+              (result["peak_bytes"] / 1e6, result["budget_bytes"] / 1e6))
+
+
+def reportPairing(result):
+    print("%(players)d players, %(rounds)d rounds: swiss.pairings() takes "
+          "%(engine_seconds).3fs a round, adjacent pairing "
+          "%(adjacent_seconds).3fs a round but proposes %(rematches)d "
+          "rematches" % result)
+
+
+def reportSimulate(result):
+    print("%(backend)s: %(tournaments)d tournaments of %(players)d players, "
+          "%(rounds_played)d rounds played in %(seconds).2fs with "
+          "%(queries)d queries" % result)
+    for name, operation in sorted(result["operations"].items()):
+        print("  %-16s %7d calls  p50 %8.2fms  p90 %8.2fms  p99 %8.2fms  "
+              "max %8.2fms  %6.1f queries/call" %
+              (name, operation["count"], operation["p50_ms"],
+               operation["p90_ms"], operation["p99_ms"], operation["max_ms"],
+               float(operation["queries"]) / operation["count"]))
+
+
+def compareSimulate(result, baseline):
+    """Prints how each operation's latency and queries changed since an
+    earlier simulate result."""
+    def change(after, before):
+        return 100.0 * (after / before - 1) if before else 0.0
+
+    for name, operation in sorted(result["operations"].items()):
+        before = baseline["operations"].get(name)
+        if before is None:
+            continue
+        print("  %-16s p50 %+7.1f%%  p99 %+7.1f%%  queries/call %+.1f" %
+              (name,
+               change(operation["p50_ms"], before["p50_ms"]),
+               change(operation["p99_ms"], before["p99_ms"]),
+               float(operation["queries"]) / operation["count"] -
+               float(before["queries"]) / before["count"]))
+
+
+def reportPairAll(result):
+    print("%(tournaments)d tournaments of %(players)d players after "
+          "%(rounds)d rounds:" % result)
+    baseline = result["runs"][0]["seconds"]
+    for run in result["runs"]:
+        if run["processes"] is None:
+            name = "startRound() each"
+        else:
+            name = "pairAll(), %d processes" % run["processes"]
+        print("  %-26s %8.3fs %8.1f tournaments/s %6.2fx %6d queries" %
+              (name, run["seconds"], result["tournaments"] / run["seconds"],
+               baseline / run["seconds"], run["queries"]))
+
+
+def reportRound(result):
+    print("%(players)d players: match by match %(matches_seconds).2fs with "
+          "%(matches_queries)d queries, as a Round %(round_seconds).2fs with "
+          "%(round_queries)d queries" % result)
+
+
+def reportArchive(result):
+    print("%(archived)5d archived: playerStandings %(playerStandings_ms).2fms"
+          ", swissPairings %(swissPairings_ms).2fms, byeMatch "
+          "%(byeMatch_ms).2fms, rebuildStandings %(rebuildStandings_ms).2fms"
+          "; blocks touched by getstandings %(getstandings_blocks)d, "
+          "computestandings %(computestandings_blocks)d, pairs "
+          "%(pairs_blocks)d, bye %(bye_blocks)d" % result)
+    if result["moved"]:
+        print("      archiveTournament %(archiveTournament_ms).2fms a "
+              "tournament" % result)
+
+
+def reportBulk(result):
+    print("registered %(players)d players in %(register_seconds).2fs "
+          "(%(players_per_second).0f rows/s)" % result)
+    print("reported %(matches)d matches in %(report_seconds).2fs "
+          "(%(matches_per_second).0f rows/s)" % result)
+
+
+def run(args):
+    """Runs the benchmark args asks for and prints its results."""
+    if args.benchmark == "register":
+        for pooled in (False, True):
+            report(benchRegister(args.players, pooled))
+    elif args.benchmark == "bulk":
+        reportBulk(benchBulk(args.players))
+    elif args.benchmark == "standings":
+        for players in args.players:
+            reportStandings(benchStandings(players, args.rounds))
+    elif args.benchmark == "arrays":
+        reportArrays(benchArrays(args.players, args.rounds))
+    elif args.benchmark == "pairing":
+        reportPairing(benchPairing(args.players, args.rounds))
+    elif args.benchmark == "round":
+        reportRound(benchRound(args.players))
+    elif args.benchmark == "pairall":
+        reportPairAll(benchPairAll(args.tournaments, args.players,
+                                   args.rounds, args.processes))
+    elif args.benchmark == "archive":
+        for result in benchArchive(sorted(args.archived), args.players,
+                                   args.rounds, args.move):
+            reportArchive(result)
+    elif args.benchmark == "simulate":
+        result = benchSimulate(args.backend, args.tournaments, args.players,
+                               args.rounds, args.tie_rate, args.odd_share,
+                               args.threads, args.seed)
+        reportSimulate(result)
+        if args.compare:
+            with open(args.compare) as f:
+                print("compared with %s:" % args.compare)
+                compareSimulate(result, json.load(f))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for tournament.py")
+    parser.add_argument(
+        "--clone", action="store_true",
+        help="run against a new clone of the template database, dropped "
+        "after, so that benchmarks can run side by side")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    register = subparsers.add_parser(
+        "register", help="register players with and without pooling")
+    register.add_argument("--players", type=int, default=10000)
+    bulk = subparsers.add_parser(
+        "bulk", help="register players and report matches in bulk")
+    bulk.add_argument("--players", type=int, default=100000)
+    standings = subparsers.add_parser(
+        "standings", help="EXPLAIN ANALYZE the standings query")
+    standings.add_argument("--players", type=int, nargs="+",
+                           default=[1000, 10000, 100000])
+    standings.add_argument("--rounds", type=int, default=3)
+    arrays = subparsers.add_parser(
+        "arrays", help="compute standings in memory with NumPy")
+    arrays.add_argument("--players", type=int, default=50000)
+    arrays.add_argument("--rounds", type=int, default=9)
+    pairing = subparsers.add_parser(
+        "pairing", help="time the pairing engine in memory")
+    pairing.add_argument("--players", type=int, default=10000)
+    pairing.add_argument("--rounds", type=int, default=10)
+    round = subparsers.add_parser(
+        "round", help="play a round match by match and as a Round")
+    round.add_argument("--players", type=int, default=4000)
+    pairall = subparsers.add_parser(
+        "pairall", help="start a round of many tournaments at once")
+    pairall.add_argument("--tournaments", type=int, default=200)
+    pairall.add_argument("--players", type=int, default=256)
+    pairall.add_argument("--rounds", type=int, default=4)
+    pairall.add_argument("--processes", type=int, nargs="+",
+                         default=[1, 2, 4, 8, 16])
+    archive = subparsers.add_parser(
+        "archive", help="time one event against a growing archive")
+    archive.add_argument("--archived", type=int, nargs="+",
+                         default=[0, 100, 1000])
+    archive.add_argument("--players", type=int, default=64)
+    archive.add_argument("--rounds", type=int, default=6)
+    archive.add_argument("--move", action="store_true",
+                         help="move finished tournaments to the archive "
+                         "tables with archiveTournament()")
+    simulate = subparsers.add_parser(
+        "simulate", help="play synthetic tournaments end to end")
+    simulate.add_argument("--backend", choices=sorted(BACKENDS),
+                          default="postgres")
+    simulate.add_argument("--tournaments", type=int, default=10)
+    simulate.add_argument("--players", type=int, default=64)
+    simulate.add_argument("--rounds", type=int, default=6)
+    simulate.add_argument("--tie-rate", type=float, default=0.1)
+    simulate.add_argument("--odd-share", type=float, default=0.5,
+                          help="share of tournaments with an odd player")
+    simulate.add_argument("--threads", type=int, default=1,
+                          help="tournaments played at the same time")
+    simulate.add_argument("--seed", type=int, default=0)
+    simulate.add_argument("--json", metavar="FILE",
+                          help="also save the results to FILE as JSON")
+    simulate.add_argument("--compare", metavar="FILE",
+                          help="compare with results saved by --json")
+    args = parser.parse_args()
+
+    if args.clone:
+        with tournament_fixtures.clonedDatabase():
+            run(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+# tournament_core.py -- the parts of the tournament API shared by every
+# backend
+#
+# tournament.py (PostgreSQL), tournament_sqlite.py (SQLite) and
+# tournament_async.py (asyncio) all import what is here: the query
+# statistics and the instrumented decorator, how a result becomes a Matches
+# row, how standings are ordered by tiebreaks, and the statements every
+# database runs alike.  Nothing here talks to a database driver, so each
+# backend needs only its own.
+
+import functools
+import json
+import logging
+import threading
+import time
+
+import tiebreaks
+
+# query statistics are logged here at DEBUG level, one JSON object per line
+
+log = logging.getLogger("tournament")
+
+# statements the core functions run alike on every backend.  They are
+# written with %s placeholders; ENSURE_TOURNAMENT_QUERY and ENTER_BYE_QUERY
+# add a tournament, or the bye round to one, unless it's already there,
+# which unlike checking first is safe when concurrent callers do the same
+
+ENSURE_TOURNAMENT_QUERY = ("INSERT INTO Tournaments (id, name) "
+                           "VALUES (%s, %s) ON CONFLICT (id) DO NOTHING")
+ENTER_BYE_QUERY = ("INSERT INTO Registrants (tournament_id, player_id) "
+                   "VALUES (%s, 0) ON CONFLICT DO NOTHING RETURNING player_id")
+CREATE_TOURNAMENT_QUERY = ("INSERT INTO Tournaments (id, name) "
+                           "VALUES (%s, %s) "
+                           "ON CONFLICT (id) DO NOTHING RETURNING id")
+CREATE_PLAYER_QUERY = "INSERT INTO Players (name) VALUES (%s) RETURNING id"
+ENTER_TOURNAMENT_QUERY = ("INSERT INTO Registrants "
+                          "(tournament_id, player_id) VALUES (%s, %s)")
+REPORT_MATCH_QUERY = ("INSERT INTO Matches "
+                      "(tournament_id, player_1, player_2, winner) "
+                      "VALUES (%s, %s, %s, %s)")
+COUNT_PLAYERS_QUERY = ("SELECT COUNT(*) FROM Registrants "
+                       "WHERE tournament_id = %s")
+IS_REGISTERED_QUERY = ("SELECT COUNT(*) FROM Registrants "
+                       "WHERE tournament_id = %s AND player_id = %s")
+TOURNAMENT_EXISTS_QUERY = "SELECT COUNT(*) FROM Tournaments WHERE id = %s"
+PLAYED_PAIRS_QUERY = ("SELECT player_id, opponent_id FROM Opponents "
+                      "WHERE tournament_id = %s AND player_id < opponent_id")
+SET_TIEBREAKS_QUERY = ("UPDATE Tournaments SET tiebreaks = %s "
+                       "WHERE id = %s RETURNING id")
+
+# the matches a tournament's tiebreaks are computed from
+
+TIEBREAK_MATCHES_QUERY = ("SELECT player_1, player_2, winner FROM Matches "
+                          "WHERE tournament_id = %s")
+
+
+class QueryStats(object):
+    """Counts, times and sizes the queries sent through sql().
+
+    Queries are also tallied against the public function that sent them
+    (the outermost one, when functions call each other), so the cost of
+    each API call can be seen.  Every query and call is also logged as JSON
+    to the "tournament" logger at DEBUG level.
+
+    Attributes:
+      queries: the number of queries run.
+      seconds: the total time spent running them.
+      rows: the number of rows they returned or changed.
+      histogram: query counts by latency, one count for each of
+        LATENCY_BUCKETS (in seconds) and a last one for anything slower.
+      calls: per function name, a dict of its "calls", "queries",
+        "seconds" and "rows".
+    """
+
+    LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2,
+                       0.5, 1.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._context = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Clears every count."""
+        with self._lock:
+            self.queries = 0
+            self.seconds = 0.0
+            self.rows = 0
+            self.histogram = [0] * (len(self.LATENCY_BUCKETS) + 1)
+            self.calls = {}
+
+    def _call(self, name):
+        return self.calls.setdefault(
+            name, {"calls": 0, "queries": 0, "seconds": 0.0, "rows": 0})
+
+    def recordQuery(self, query, seconds, rows):
+        """Counts a query that took seconds and returned or changed rows."""
+        bucket = 0
+        while bucket < len(self.LATENCY_BUCKETS) and \
+                seconds > self.LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        name = getattr(self._context, "call", None)
+        if name is not None:
+            self._context.queries += 1
+        with self._lock:
+            self.queries += 1
+            self.seconds += seconds
+            self.rows += rows
+            self.histogram[bucket] += 1
+            if name is not None:
+                call = self._call(name)
+                call["queries"] += 1
+                call["rows"] += rows
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(json.dumps({"event": "query", "call": name,
+                                  "query": query, "seconds": seconds,
+                                  "rows": rows}))
+
+    def recordCall(self, name, seconds, queries):
+        """Counts a call to a public function that sent queries."""
+        with self._lock:
+            call = self._call(name)
+            call["calls"] += 1
+            call["seconds"] += seconds
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(json.dumps({"event": "call", "call": name,
+                                  "seconds": seconds, "queries": queries}))
+
+    def asDict(self):
+        """Returns the counts as a dict, for example to save as JSON."""
+        with self._lock:
+            return {"queries": self.queries, "seconds": self.seconds,
+                    "rows": self.rows,
+                    "histogram": dict(zip(
+                        [str(b) for b in self.LATENCY_BUCKETS] + ["slower"],
+                        self.histogram)),
+                    "calls": dict((name, dict(call))
+                                  for name, call in self.calls.items())}
+
+
+stats = QueryStats()
+
+
+def instrumented(function):
+    """Tallies the queries a public function sends in stats.calls."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        context = stats._context
+        if getattr(context, "call", None) is not None:
+            return function(*args, **kwargs)
+        context.call = function.__name__
+        context.queries = 0
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            context.call = None
+            stats.recordCall(function.__name__, time.time() - start,
+                             context.queries)
+    return wrapper
+
+
+def matchRow(winner, loser, tournament=1, tied="n"):
+    """Returns the Matches row for a result, as reportMatch() records it.
+
+    Tied matches are stored without a winner.
+    """
+    if tied == "n":
+        return (tournament, winner, loser, winner)
+    elif tied == "y":
+        return (tournament, winner, loser, None)
+    else:
+        raise ValueError(
+            "Matches must either be tied or not tied. Please use y or n.")
+
+
+def orderStandings(fetch, matches):
+    """Orders standings rows by their tournament's tiebreaks.
+
+    Args:
+      fetch: (id, name, wins, matches, tiebreaks) rows, ordered by wins
+        and OMW, as each backend's STANDINGS_QUERY reads them.
+      matches: a function that returns TIEBREAK_MATCHES_QUERY rows, only
+        called if the tournament has tiebreaks.
+
+    Returns:
+      (id, name, wins, matches) tuples, best placed first.
+    """
+    if fetch and fetch[0][4]:
+        names = fetch[0][4].split(",")
+        # standings are ordered by wins first, unless by match points
+        if names[0] not in ("wins", "points"):
+            names.insert(0, "wins")
+        fetch = tiebreaks.sortStandings(fetch, matches(), names)
+    return [row[:4] for row in fetch]
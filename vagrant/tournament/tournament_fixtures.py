@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+# tournament_fixtures.py -- throwaway tournament databases for tests and
+# benchmarks
+#
+# tournament.sql builds the tournament database once.  createTemplate()
+# copies it, still empty, to a template database, and cloneDatabase() copies
+# the template to a new database of its own in a few milliseconds, without
+# running tournament.sql again.  Tests and benchmarks that each use a clone
+# can't see one another's rows, so they can run at the same time.  For
+# example, after tournament.sh:
+#
+#     python tournament_fixtures.py template
+#     python tournament_test.py --workers 8
+
+import argparse
+import itertools
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import tournament
+
+# the database that has the schema, the template copied from it, and the
+# database connected to for CREATE and DROP DATABASE, as in tournament.sql
+
+SOURCE = "tournament"
+TEMPLATE = "tournament_template"
+ADMIN_DSN = "dbname=vagrant"
+
+# clones are named CLONE_PREFIX, the process id and a counter
+
+CLONE_PREFIX = "tournament_clone"
+
+# settings tournament.sql gives the tournament database, which CREATE
+# DATABASE doesn't copy to a clone
+
+DATABASE_SETTINGS = ("tournament.defer_standings = 'off'",)
+
+_names = itertools.count(1)
+_names_lock = threading.Lock()
+
+
+def _identifier(name):
+    """Returns name quoted for SQL, if it is a plain database name."""
+    if not re.match(r"^[a-z_][a-z0-9_]*$", name):
+        raise ValueError("%r is not a plain database name." % name)
+    return '"%s"' % name
+
+
+def adminExecute(*queries):
+    """Runs statements one by one on the admin database, in autocommit mode
+    since CREATE and DROP DATABASE can't run in a transaction."""
+    pg = tournament.connect(ADMIN_DSN)
+    try:
+        pg.autocommit = True
+        c = pg.cursor()
+        for query in queries:
+            if isinstance(query, tuple):
+                c.execute(*query)
+            else:
+                c.execute(query)
+        rows = c.fetchall() if c.description else None
+        c.close()
+        return rows
+    finally:
+        pg.close()
+
+
+def _disconnect(name):
+    """Ends every other session connected to database name."""
+    return ("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+            "WHERE datname = %s AND pid != pg_backend_pid()", (name,))
+
+
+def createTemplate(source=SOURCE, template=TEMPLATE):
+    """Copies the source database to template, replacing any old template.
+
+    Run it straight after tournament.sql, while source is still empty.  The
+    template is marked as one and closed to connections, so that it is never
+    busy when it is cloned.
+    """
+    quoted = _identifier(template)
+    exists = adminExecute(("SELECT 1 FROM pg_database WHERE datname = %s",
+                           (template,)))
+    if exists:
+        adminExecute("ALTER DATABASE %s IS_TEMPLATE false" % quoted)
+        dropDatabase(template)
+    adminExecute(_disconnect(source),
+                 "CREATE DATABASE %s TEMPLATE %s" %
+                 (quoted, _identifier(source)),
+                 "ALTER DATABASE %s IS_TEMPLATE true ALLOW_CONNECTIONS false"
+                 % quoted)
+
+
+def cloneDatabase(name=None, template=TEMPLATE):
+    """Creates a new database from the template.
+
+    Args:
+      name: the new database, by default a name no other clone has.
+
+    Returns:
+      The name of the new database.
+    """
+    if name is None:
+        with _names_lock:
+            name = "%s_%d_%d" % (CLONE_PREFIX, os.getpid(), next(_names))
+    quoted = _identifier(name)
+    adminExecute("CREATE DATABASE %s TEMPLATE %s" %
+                 (quoted, _identifier(template)),
+                 *["ALTER DATABASE %s SET %s" % (quoted, setting)
+                   for setting in DATABASE_SETTINGS])
+    return name
+
+
+def dropDatabase(name):
+    """Drops a database, ending any sessions still connected to it."""
+    adminExecute(_disconnect(name),
+                 "DROP DATABASE IF EXISTS %s" % _identifier(name))
+
+
+def dropClones():
+    """Drops every clone, for example those left by an interrupted run.
+
+    Returns:
+      The number of clones dropped.
+    """
+    rows = adminExecute(("SELECT datname FROM pg_database "
+                         "WHERE datname LIKE %s", (CLONE_PREFIX + "\\_%",)))
+    for row in rows:
+        dropDatabase(row[0])
+    return len(rows)
+
+
+def useDatabase(name):
+    """Points tournament.py, and the processes it starts, at a database.
+
+    Returns:
+      The DSN that was in use before.
+    """
+    previous = tournament.DSN
+    tournament.closePool()
+    tournament.DSN = "dbname=%s" % name
+    return previous
+
+
+@contextmanager
+def clonedDatabase(template=TEMPLATE):
+    """Runs the with block against a clone of the template, dropped after.
+
+    For example:
+
+        with clonedDatabase():
+            registerPlayers(roster)
+    """
+    name = cloneDatabase(template=template)
+    previous = useDatabase(name)
+    try:
+        yield name
+    finally:
+        tournament.closePool()
+        tournament.DSN = previous
+        dropDatabase(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Template and clone tournament databases")
+    subparsers = parser.add_subparsers(dest="command")
+    template = subparsers.add_parser(
+        "template", help="copy the empty tournament database to a template")
+    template.add_argument("--source", default=SOURCE)
+    template.add_argument("--template", default=TEMPLATE)
+    subparsers.add_parser("clean", help="drop every clone")
+    args = parser.parse_args()
+    if args.command == "template":
+        createTemplate(args.source, args.template)
+        print("Template %s created from %s." % (args.template, args.source))
+    elif args.command == "clean":
+        print("%d clones dropped." % dropClones())
+
+
+if __name__ == '__main__':
+    main()
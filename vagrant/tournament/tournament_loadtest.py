@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# tournament_loadtest.py -- compares tournament.py with tournament_async.py
+#
+# Plays many small tournaments at once, the way a server handling many
+# clients would: every player is registered, and every match reported, with
+# its own call.  The blocking API is driven from a pool of threads and the
+# asyncio API from a single event loop, each with the same number of
+# connections.  Both run against a clone of the template database (see
+# tournament_fixtures.py), dropped when they end, so the tournament database
+# is never touched.  For example:
+#
+#     python3 tournament_loadtest.py --tournaments 200 --connections 10
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import tournament
+import tournament_async
+import tournament_fixtures
+
+# tournament ids used by each run, so the runs never share a tournament
+
+SYNC_BASE = 100000
+ASYNC_BASE = 200000
+
+
+def playSync(tournament_id, players, rounds):
+    """Plays a whole tournament with tournament.py.  Returns the calls made."""
+    for i in range(players):
+        tournament.registerPlayer("Player %d" % i, tournament_id)
+    calls = players
+    for n in range(rounds):
+        pairs = tournament.swissPairings(tournament_id)
+        for id1, name1, id2, name2 in pairs:
+            tournament.reportMatch(id1, id2, tournament_id)
+        calls += 1 + len(pairs)
+    tournament.playerStandings(tournament_id)
+    return calls + 1
+
+
+async def playAsync(tournament_id, players, rounds):
+    """Plays a whole tournament with tournament_async.py, see playSync()."""
+    for i in range(players):
+        await tournament_async.registerPlayer("Player %d" % i, tournament_id)
+    calls = players
+    for n in range(rounds):
+        pairs = await tournament_async.swissPairings(tournament_id)
+        for id1, name1, id2, name2 in pairs:
+            await tournament_async.reportMatch(id1, id2, tournament_id)
+        calls += 1 + len(pairs)
+    await tournament_async.playerStandings(tournament_id)
+    return calls + 1
+
+
+def runSync(args):
+    """Plays every tournament from a pool of threads."""
+    tournament.configurePool(maxconn=args.connections)
+    ids = range(SYNC_BASE, SYNC_BASE + args.tournaments)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        calls = sum(executor.map(
+            lambda i: playSync(i, args.players, args.rounds), ids))
+    seconds = time.time() - start
+    tournament.closePool()
+    return calls, seconds
+
+
+async def runAsync(args):
+    """Plays every tournament as concurrent tasks on one event loop."""
+    await tournament_async.configurePool(maxsize=args.connections)
+    ids = range(ASYNC_BASE, ASYNC_BASE + args.tournaments)
+    start = time.time()
+    calls = sum(await asyncio.gather(
+        *[playAsync(i, args.players, args.rounds) for i in ids]))
+    seconds = time.time() - start
+    await tournament_async.closePool()
+    return calls, seconds
+
+
+def report(name, calls, seconds):
+    print("%-6s %8d calls %8.2fs %10.1f calls/s" %
+          (name, calls, seconds, calls / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares tournament.py with tournament_async.py.")
+    parser.add_argument("--tournaments", type=int, default=100)
+    parser.add_argument("--players", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--connections", type=int, default=10,
+                        help="connections in each pool")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="threads for tournament.py, default connections")
+    args = parser.parse_args()
+    if args.threads is None:
+        args.threads = args.connections
+    with tournament_fixtures.clonedDatabase():
+        report("sync", *runSync(args))
+        loop = asyncio.get_event_loop()
+        report("async", *loop.run_until_complete(runAsync(args)))
+
+
+if __name__ == '__main__':
+    main()
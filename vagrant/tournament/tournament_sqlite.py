@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+#
+# tournament_sqlite.py -- the tournament.py API on an embedded SQLite database
+#
+# The players, matches and standings of tournament.py, with the same
+# functions, arguments and results, kept in a SQLite file in this process
+# rather than on a PostgreSQL server.  This suits club events and test runs
+# that have no server at hand, and saves the round trip every statement
+# makes to one.  The schema is in tournament_sqlite.sql; rounds, the
+# standings cache, NOTIFY and the other features that need PostgreSQL are
+# only in tournament.py.  tournament.configureBackend("sqlite") runs
+# tournament.py's functions on this module.  What doesn't depend on the
+# database, from the query statistics to the statements both databases run
+# alike, comes from tournament_core.py, so this module doesn't need
+# psycopg2.
+
+import os
+import sqlite3
+import threading
+import time
+
+import swiss
+import tiebreaks
+from tournament_core import (
+    COUNT_PLAYERS_QUERY, CREATE_PLAYER_QUERY, CREATE_TOURNAMENT_QUERY,
+    ENSURE_TOURNAMENT_QUERY, ENTER_BYE_QUERY, ENTER_TOURNAMENT_QUERY,
+    IS_REGISTERED_QUERY, PLAYED_PAIRS_QUERY, REPORT_MATCH_QUERY,
+    SET_TIEBREAKS_QUERY, TIEBREAK_MATCHES_QUERY, TOURNAMENT_EXISTS_QUERY,
+    instrumented, matchRow, orderStandings, stats)
+
+# the database file used by default, see configureDatabase(); and the
+# schema created in a new one
+
+DATABASE = "tournament.db"
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "tournament_sqlite.sql")
+
+# utility functions to deal with the database
+
+_database = {"path": DATABASE, "connection": None}
+_lock = threading.RLock()
+
+
+def configureDatabase(path=DATABASE):
+    """Chooses the database file, ":memory:" for one that only lasts as
+    long as this process.  It is opened on first use, and its tables are
+    created if it has none."""
+    with _lock:
+        closeDatabase()
+        _database["path"] = path
+
+
+def closeDatabase():
+    """Closes the database.  It is opened again on the next query."""
+    with _lock:
+        if _database["connection"] is not None:
+            _database["connection"].close()
+            _database["connection"] = None
+
+
+def connect():
+    """Returns the connection to the database, opening it if needed.
+
+    The connection is shared by every thread, one transaction at a time,
+    and runs in autocommit mode outside a Transaction.
+    """
+    with _lock:
+        if _database["connection"] is None:
+            db = sqlite3.connect(_database["path"], isolation_level=None,
+                                 check_same_thread=False)
+            db.execute("PRAGMA foreign_keys = ON")
+            tables = db.execute("SELECT COUNT(*) FROM sqlite_master "
+                                "WHERE type = 'table' AND name = 'Players'")
+            if tables.fetchone()[0] == 0:
+                with open(SCHEMA) as f:
+                    db.executescript(f.read())
+            _database["connection"] = db
+        return _database["connection"]
+
+
+def _run(db, type, query, params=()):
+    """Executes a query and fetches its result.
+
+    Queries are written with %s placeholders, as for tournament.py, and
+    rows are returned as tuples.
+    """
+    start = time.time()
+    c = db.execute(query.replace("%s", "?"), params)
+    if type == "fetchone":
+        result = c.fetchone()
+    elif type == "fetchall":
+        result = c.fetchall()
+    else:
+        result = None
+    stats.recordQuery(query, time.time() - start, max(c.rowcount, 0))
+    c.close()
+    return result
+
+
+def sql(type, query, params=(), session=None, prepare=None):
+    """Runs SQL commands in the tournament database, see tournament.sql().
+
+    prepare is accepted for compatibility, since sqlite3 caches every
+    statement anyway.
+    """
+    if type not in ["commit", "fetchone", "fetchall"]:
+        raise ValueError(
+            "Type unknown, use \"commit\", \"fetchone\", or \"fetchall.\"")
+    if session is not None:
+        return session.execute(type, query, params)
+    with _lock:
+        return _run(connect(), type, query, params)
+
+
+class Transaction(object):
+    """A unit of work sharing one commit, see tournament.Transaction.
+
+    The transaction takes SQLite's write lock when it begins, so
+    transactions in other processes wait for it rather than fail halfway.
+    """
+
+    def __init__(self):
+        self._db = None
+        self._depth = 0
+        self._on_commit = []
+
+    def __enter__(self):
+        if self._depth == 0:
+            _lock.acquire()
+            try:
+                self._db = connect()
+                _run(self._db, "commit", "BEGIN IMMEDIATE")
+            except Exception:
+                self._db = None
+                _lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth == 0:
+            db, self._db = self._db, None
+            callbacks, self._on_commit = self._on_commit, []
+            try:
+                _run(db, "commit", "COMMIT" if exc_type is None else
+                     "ROLLBACK")
+            finally:
+                _lock.release()
+            if exc_type is None:
+                for callback in callbacks:
+                    callback()
+        return False
+
+    def onCommit(self, callback):
+        """Calls callback once the transaction has committed."""
+        if self._db is None:
+            raise ValueError(
+                "Transaction is not open, use it in a with block.")
+        self._on_commit.append(callback)
+
+    def execute(self, type, query, params=(), prepare=None):
+        """Runs a query inside the transaction, see sql()."""
+        if self._db is None:
+            raise ValueError(
+                "Transaction is not open, use it in a with block.")
+        return _run(self._db, type, query, params)
+
+
+def transaction(session=None):
+    """Returns session if one was given, otherwise a new Transaction."""
+    if session is None:
+        return Transaction()
+    return session
+
+
+def insertMany(table, columns, rows, session):
+    """Inserts rows into table, all with one prepared statement."""
+    if not rows:
+        return
+    query = "INSERT INTO %s (%s) VALUES (%s)" % (
+        table, ", ".join(columns), ", ".join(["?"] * len(columns)))
+    start = time.time()
+    c = session._db.executemany(query, rows)
+    stats.recordQuery(query, time.time() - start, max(c.rowcount, 0))
+    c.close()
+
+
+def deferStandings(session):
+    """Stops match triggers updating the Standings table until
+    rebuildStandings() is called in the same transaction."""
+    sql("commit", "UPDATE Settings SET defer_standings = 1", (), session)
+
+
+def ensureTournament(tournament=1, name="Tournament 1", session=None):
+    """Creates a tournament unless it already exists."""
+    sql("commit", ENSURE_TOURNAMENT_QUERY, (tournament, name), session)
+
+# "create" functions
+
+
+@instrumented
+def createTournament(id=1, name="Tournament 1", session=None):
+    """Create a new tournament."""
+    with transaction(session) as t:
+        if sql("fetchone", CREATE_TOURNAMENT_QUERY, (id, name), t) is None:
+            raise ValueError(
+                "Tournament %d already exists." % id)
+
+
+@instrumented
+def createPlayer(name, session=None):
+    """Create a new player.  Returns the id the database assigned to them."""
+    with transaction(session) as t:
+        return sql("fetchone", CREATE_PLAYER_QUERY, (name,), t)[0]
+
+
+@instrumented
+def registerPlayers(names, tournament=1, tournament_name="Tournament 1",
+                    session=None):
+    """Adds many players to a tournament in a single transaction.
+
+    Returns:
+      The new players' ids, in the same order as names.
+    """
+    names = list(names)
+    with transaction(session) as t:
+        ensureTournament(tournament, tournament_name, t)
+        # the transaction holds the write lock, so no one else takes these
+        first = sql("fetchone", "SELECT COALESCE(MAX(id), 0) + 1 FROM Players",
+                    (), t)[0]
+        ids = list(range(first, first + len(names)))
+        insertMany("Players", ("id", "name"), list(zip(ids, names)), t)
+        insertMany("Registrants", ("tournament_id", "player_id"),
+                   [(tournament, player_id) for player_id in ids], t)
+    return ids
+
+
+@instrumented
+def reportMatch(winner, loser, tournament=1, tied="n", session=None):
+    """Records the outcome of a single match between two players."""
+    params = matchRow(winner, loser, tournament, tied)
+    with transaction(session) as t:
+        ensureTournament(tournament, session=t)
+        sql("commit", REPORT_MATCH_QUERY, params, t)
+
+
+@instrumented
+def reportMatches(results, tournament=1, session=None):
+    """Records the outcomes of many matches in a single transaction, with
+    one standings rebuild for the whole batch."""
+    rows = [matchRow(result[0], result[1], tournament, *result[2:])
+            for result in results]
+    with transaction(session) as t:
+        ensureTournament(tournament, session=t)
+        deferStandings(t)
+        insertMany("Matches",
+                   ("tournament_id", "player_1", "player_2", "winner"),
+                   rows, t)
+        rebuildStandings(tournament, t)
+
+# "read" functions
+
+
+@instrumented
+def countPlayers(tournament=1, session=None):
+    """Returns the number of players registered for the given tournament."""
+    return int(sql("fetchone", COUNT_PLAYERS_QUERY, (tournament,),
+                   session)[0])
+
+
+@instrumented
+def isRegistered(player_id=0, tournament_id=1, session=None):
+    """Determines if a specific player is registered for a tournament."""
+    params = (tournament_id, player_id)
+    fetch = sql("fetchone", IS_REGISTERED_QUERY, params, session)
+    return fetch[0] == 1
+
+
+@instrumented
+def tournamentExists(tournament=1, session=None):
+    """Determines if a specific tournament already exists or not."""
+    params = (tournament,)
+    return sql("fetchone", TOURNAMENT_EXISTS_QUERY, params, session)[0] == 1
+
+
+# the standings of a tournament computed from its matches, as
+# computestandings() in tournament.sql computes them
+
+COMPUTE_QUERY = (
+    "WITH results AS ("
+    "SELECT player_1 AS player_id, player_2 AS opponent_id, winner "
+    "FROM Matches WHERE tournament_id = %s "
+    "UNION ALL SELECT player_2, player_1, winner "
+    "FROM Matches WHERE tournament_id = %s), "
+    "records AS (SELECT player_id, COUNT(*) AS matches, "
+    "SUM(CASE WHEN winner = player_id THEN 1 ELSE 0 END) AS wins "
+    "FROM results GROUP BY player_id), "
+    "omw AS (SELECT results.player_id, SUM(records.wins) AS omw "
+    "FROM results JOIN records ON (records.player_id = results.opponent_id) "
+    "GROUP BY results.player_id) "
+    "SELECT Registrants.player_id, COALESCE(records.wins, 0) AS wins, "
+    "COALESCE(omw.omw, 0) AS omw, COALESCE(records.matches, 0) AS matches "
+    "FROM Registrants "
+    "LEFT OUTER JOIN records ON (Registrants.player_id = records.player_id) "
+    "LEFT OUTER JOIN omw ON (Registrants.player_id = omw.player_id) "
+    "WHERE Registrants.tournament_id = %s")
+
+
+@instrumented
+def checkStandings(tournament=1, session=None):
+    """Compares the stored standings of a tournament with its matches, see
+    tournament.checkStandings()."""
+    query = ("WITH computed AS (" + COMPUTE_QUERY + "), "
+             "stored AS (SELECT * FROM Standings WHERE tournament_id = %s) "
+             "SELECT ids.player_id, stored.wins, computed.wins, stored.omw, "
+             "computed.omw, stored.matches, computed.matches "
+             "FROM (SELECT player_id FROM stored "
+             "UNION SELECT player_id FROM computed) ids "
+             "LEFT OUTER JOIN stored ON (ids.player_id = stored.player_id) "
+             "LEFT OUTER JOIN computed "
+             "ON (ids.player_id = computed.player_id) "
+             "WHERE (stored.wins, stored.omw, stored.matches) IS NOT "
+             "(computed.wins, computed.omw, computed.matches) "
+             "ORDER BY 1")
+    params = (tournament,) * 4
+    return sql("fetchall", query, params, session)
+
+
+# the standings of a tournament with its tiebreaks on every row, as
+# tournament.STANDINGS_QUERY reads them
+
+STANDINGS_QUERY = (
+    "SELECT Standings.player_id, Players.name, Standings.wins, "
+    "Standings.matches, (SELECT tiebreaks FROM Tournaments WHERE id = %s) "
+    "FROM Standings JOIN Players ON (Standings.player_id = Players.id) "
+    "WHERE Standings.tournament_id = %s AND Standings.player_id != 0 "
+    "ORDER BY Standings.wins DESC, Standings.omw DESC, Standings.player_id")
+
+
+@instrumented
+def playerStandings(tournament=1, session=None):
+    """Returns (id, name, wins, matches) tuples, best placed first, see
+    tournament.playerStandings()."""
+    fetch = sql("fetchall", STANDINGS_QUERY, (tournament, tournament),
+                session)
+    return orderStandings(fetch, lambda: sql(
+        "fetchall", TIEBREAK_MATCHES_QUERY, (tournament,), session))
+
+
+@instrumented
+def playedPairs(tournament=1, session=None):
+    """Returns the set of pairs of players who have met in a tournament."""
+    return swiss.playedPairs(
+        sql("fetchall", PLAYED_PAIRS_QUERY, (tournament,), session))
+
+
+@instrumented
+def swissPairings(tournament=1, session=None):
+    """Returns (id1, name1, id2, name2) pairs for the next round, see
+    tournament.swissPairings()."""
+    with transaction(session) as t:
+        standings = playerStandings(tournament, t)
+        bye = len(standings) % 2 == 1
+        if bye:
+            sql("fetchone", ENTER_BYE_QUERY, (tournament,), t)
+        played = playedPairs(tournament, t)
+    return swiss.pairings(standings, played, bye)
+
+# "update" functions
+
+
+@instrumented
+def setTiebreaks(names, tournament=1, session=None):
+    """Chooses how players tied on wins are ordered, see
+    tournament.setTiebreaks()."""
+    names = list(names)
+    if names:
+        tiebreaks.checkTiebreaks(names)
+    params = (",".join(names) or None, tournament)
+    with transaction(session) as t:
+        if sql("fetchone", SET_TIEBREAKS_QUERY, params, t) is None:
+            raise ValueError("Tournament %d does not exist." % tournament)
+
+
+@instrumented
+def enterTournament(player_id, tournament_id=1, session=None):
+    """Insert an existing player into a tournament."""
+    params = (tournament_id, player_id)
+    sql("commit", ENTER_TOURNAMENT_QUERY, params, session)
+
+
+@instrumented
+def registerPlayer(name, tournament=1, tournament_name="Tournament 1",
+                   session=None):
+    """Adds a player to a tournament.  Returns the new player's id."""
+    with transaction(session) as t:
+        ensureTournament(tournament, tournament_name, t)
+        player_id = createPlayer(name, t)
+        enterTournament(player_id, tournament, t)
+    return player_id
+
+
+# the bye round match-up: the highest placed player who hasn't had a bye,
+# or the highest placed player once everyone has had one
+
+BYE_QUERY = (
+    "SELECT Standings.player_id, Players.name "
+    "FROM Standings JOIN Players ON (Standings.player_id = Players.id) "
+    "WHERE Standings.tournament_id = %s AND Standings.player_id != 0 "
+    "AND EXISTS (SELECT 1 FROM Registrants "
+    "WHERE tournament_id = %s AND player_id = 0) "
+    "ORDER BY EXISTS (SELECT 1 FROM Opponents "
+    "WHERE tournament_id = %s AND player_id = Standings.player_id "
+    "AND opponent_id = 0), "
+    "Standings.wins DESC, Standings.omw DESC, Standings.player_id LIMIT 1")
+
+
+@instrumented
+def byeMatch(tournament=1, session=None):
+    """Returns the bye round match-up, see tournament.byeMatch()."""
+    fetch = sql("fetchone", BYE_QUERY, (tournament,) * 3, session)
+    if fetch is None:
+        return []
+    return tuple(fetch) + (0, 'bye round')
+
+# "delete" functions
+
+
+@instrumented
+def rebuildStandings(tournament=1, session=None):
+    """Recomputes the stored standings of a tournament from its matches."""
+    with transaction(session) as t:
+        sql("commit", "DELETE FROM Standings WHERE tournament_id = %s",
+            (tournament,), t)
+        sql("commit", "INSERT INTO Standings "
+            "(player_id, wins, omw, matches, tournament_id) "
+            "SELECT *, %s FROM (" + COMPUTE_QUERY + ")",
+            (tournament,) * 4, t)
+        sql("commit", "UPDATE Settings SET defer_standings = 0", (), t)
+
+
+@instrumented
+def deleteMatches(session=None):
+    """Remove all the match records from the database."""
+    with transaction(session) as t:
+        deferStandings(t)
+        sql("commit", "DELETE FROM Matches", (), t)
+        sql("commit", "UPDATE Standings SET wins = 0, omw = 0, matches = 0",
+            (), t)
+        sql("commit", "UPDATE Settings SET defer_standings = 0", (), t)
+
+
+@instrumented
+def deletePlayers(session=None):
+    """Remove all the player records from the database, but the bye."""
+    with transaction(session) as t:
+        sql("commit", "DELETE FROM Registrants", (), t)
+        sql("commit", "DELETE FROM Players WHERE id != 0", (), t)
+
+
+@instrumented
+def deleteTournaments(session=None):
+    """Remove all the tournament records from the database."""
+    sql("commit", "DELETE FROM Tournaments", (), session)
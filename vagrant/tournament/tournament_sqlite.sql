@@ -0,0 +1,186 @@
+/*
+Table definitions for the SQLite version of the tournament project.
+tournament_sqlite.py creates these tables in a new database file the first time it opens it,
+so there is no need to run this file by hand. It can also be run from the sqlite3 shell:
+"sqlite3 tournament.db < tournament_sqlite.sql"
+
+The tables, constraints and standings are the same as those of tournament.sql, written for
+SQLite: the functions tournament.sql keeps its standings with are trigger bodies here, and
+the standings and OMW queries of the PostgreSQL functions are run by tournament_sqlite.py.
+Rounds and their pairings are only kept by the PostgreSQL version.
+*/
+
+-- Create a table to store player values player_id and name
+
+CREATE TABLE Players
+(id integer primary key,
+name text
+);
+
+-- Create a table to store tournament data
+-- tiebreaks lists the tiebreaks.py tiebreaks that order the tournament's standings, if not OMW
+
+CREATE TABLE Tournaments
+(id integer primary key,
+name text,
+tiebreaks text
+);
+
+CREATE TABLE Registrants
+(
+tournament_id integer references Tournaments(id) ON DELETE CASCADE,
+player_id integer references Players(id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_id)
+);
+
+/* Create a table to store match information, constrained as in tournament.sql: only players
+registered for the tournament can play, a player can't play himself, the winner is one of the
+players or NULL for a tie, and two players meet only once per tournament. */
+
+CREATE TABLE Matches
+(tournament_id integer,
+player_1 integer,
+player_2 integer
+CONSTRAINT different_player CHECK (player_1 != player_2),
+winner integer CONSTRAINT match_player CHECK (winner IS NULL OR winner IN (player_1, player_2)),
+FOREIGN KEY (tournament_id, player_1) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+FOREIGN KEY (tournament_id, player_2) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_1, player_2)
+);
+
+CREATE UNIQUE INDEX isinglematchup ON Matches(tournament_id, max(player_1, player_2), min(player_1, player_2));
+CREATE INDEX matches_player_2 ON Matches(tournament_id, player_2);
+CREATE INDEX matches_winner ON Matches(tournament_id, winner);
+
+-- who has played whom: one row for each player of each match, with their opponent
+
+CREATE TABLE Opponents
+(tournament_id integer,
+player_id integer,
+opponent_id integer,
+FOREIGN KEY (tournament_id, player_id) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_id, opponent_id)
+);
+
+CREATE TRIGGER matches_opponents_insert AFTER INSERT ON Matches
+BEGIN
+	INSERT INTO Opponents (tournament_id, player_id, opponent_id)
+	VALUES (NEW.tournament_id, NEW.player_1, NEW.player_2), (NEW.tournament_id, NEW.player_2, NEW.player_1);
+END;
+
+CREATE TRIGGER matches_opponents_delete AFTER DELETE ON Matches
+BEGIN
+	DELETE FROM Opponents WHERE tournament_id = OLD.tournament_id
+	AND ((player_id = OLD.player_1 AND opponent_id = OLD.player_2)
+	OR (player_id = OLD.player_2 AND opponent_id = OLD.player_1));
+END;
+
+CREATE TRIGGER matches_opponents_update AFTER UPDATE ON Matches
+BEGIN
+	DELETE FROM Opponents WHERE tournament_id = OLD.tournament_id
+	AND ((player_id = OLD.player_1 AND opponent_id = OLD.player_2)
+	OR (player_id = OLD.player_2 AND opponent_id = OLD.player_1));
+	INSERT INTO Opponents (tournament_id, player_id, opponent_id)
+	VALUES (NEW.tournament_id, NEW.player_1, NEW.player_2), (NEW.tournament_id, NEW.player_2, NEW.player_1);
+END;
+
+/* Create a table to store the current standings of every registrant: wins, OMW and matches,
+kept up to date by the triggers below as in tournament.sql. */
+
+CREATE TABLE Standings
+(tournament_id integer,
+player_id integer,
+wins integer NOT NULL DEFAULT 0,
+omw integer NOT NULL DEFAULT 0,
+matches integer NOT NULL DEFAULT 0,
+FOREIGN KEY (tournament_id, player_id) REFERENCES Registrants(tournament_id, player_id) ON DELETE CASCADE,
+PRIMARY KEY (tournament_id, player_id)
+);
+
+CREATE INDEX standings_rank ON Standings(tournament_id, wins DESC, omw DESC, player_id);
+
+/* when defer_standings is set to 1, match triggers leave the Standings table alone, like
+tournament.defer_standings in tournament.sql. Bulk operations set it inside their transaction,
+call rebuildStandings() once and set it back before they commit. */
+
+CREATE TABLE Settings
+(defer_standings integer NOT NULL
+);
+
+INSERT INTO Settings (defer_standings) VALUES (0);
+
+--every registrant starts with an empty record
+
+CREATE TRIGGER registrants_standings AFTER INSERT ON Registrants
+BEGIN
+	INSERT INTO Standings (tournament_id, player_id) VALUES (NEW.tournament_id, NEW.player_id);
+END;
+
+/* apply each match to the standings as it is recorded or removed: the winner's wins change and
+so does the OMW of every opponent they have played, apart from the opponent of the match (as
+creditwin() does); then each player has one more or one fewer match and gains or loses the
+other's wins from their OMW (as pairplayers() does). Opponents of the match itself are left out
+of the OMW update, so these don't depend on the order SQLite fires the Opponents triggers in. */
+
+CREATE TRIGGER matches_standings_insert AFTER INSERT ON Matches
+WHEN (SELECT defer_standings FROM Settings) = 0
+BEGIN
+	UPDATE Standings SET wins = wins + 1
+	WHERE tournament_id = NEW.tournament_id AND player_id = NEW.winner;
+	UPDATE Standings SET omw = omw + 1
+	WHERE tournament_id = NEW.tournament_id AND player_id IN (
+		SELECT opponent_id FROM Opponents WHERE tournament_id = NEW.tournament_id
+		AND player_id = NEW.winner AND opponent_id != NEW.player_1 + NEW.player_2 - NEW.winner);
+	UPDATE Standings SET matches = matches + 1,
+	omw = omw + (SELECT opponent.wins FROM Standings opponent
+		WHERE opponent.tournament_id = NEW.tournament_id
+		AND opponent.player_id = NEW.player_1 + NEW.player_2 - Standings.player_id)
+	WHERE tournament_id = NEW.tournament_id AND player_id IN (NEW.player_1, NEW.player_2);
+END;
+
+CREATE TRIGGER matches_standings_delete AFTER DELETE ON Matches
+WHEN (SELECT defer_standings FROM Settings) = 0
+BEGIN
+	UPDATE Standings SET matches = matches - 1,
+	omw = omw - (SELECT opponent.wins FROM Standings opponent
+		WHERE opponent.tournament_id = OLD.tournament_id
+		AND opponent.player_id = OLD.player_1 + OLD.player_2 - Standings.player_id)
+	WHERE tournament_id = OLD.tournament_id AND player_id IN (OLD.player_1, OLD.player_2);
+	UPDATE Standings SET wins = wins - 1
+	WHERE tournament_id = OLD.tournament_id AND player_id = OLD.winner;
+	UPDATE Standings SET omw = omw - 1
+	WHERE tournament_id = OLD.tournament_id AND player_id IN (
+		SELECT opponent_id FROM Opponents WHERE tournament_id = OLD.tournament_id
+		AND player_id = OLD.winner AND opponent_id != OLD.player_1 + OLD.player_2 - OLD.winner);
+END;
+
+CREATE TRIGGER matches_standings_update AFTER UPDATE ON Matches
+WHEN (SELECT defer_standings FROM Settings) = 0
+BEGIN
+	UPDATE Standings SET matches = matches - 1,
+	omw = omw - (SELECT opponent.wins FROM Standings opponent
+		WHERE opponent.tournament_id = OLD.tournament_id
+		AND opponent.player_id = OLD.player_1 + OLD.player_2 - Standings.player_id)
+	WHERE tournament_id = OLD.tournament_id AND player_id IN (OLD.player_1, OLD.player_2);
+	UPDATE Standings SET wins = wins - 1
+	WHERE tournament_id = OLD.tournament_id AND player_id = OLD.winner;
+	UPDATE Standings SET omw = omw - 1
+	WHERE tournament_id = OLD.tournament_id AND player_id IN (
+		SELECT opponent_id FROM Opponents WHERE tournament_id = OLD.tournament_id
+		AND player_id = OLD.winner AND opponent_id != OLD.player_1 + OLD.player_2 - OLD.winner);
+	UPDATE Standings SET wins = wins + 1
+	WHERE tournament_id = NEW.tournament_id AND player_id = NEW.winner;
+	UPDATE Standings SET omw = omw + 1
+	WHERE tournament_id = NEW.tournament_id AND player_id IN (
+		SELECT opponent_id FROM Opponents WHERE tournament_id = NEW.tournament_id
+		AND player_id = NEW.winner AND opponent_id != NEW.player_1 + NEW.player_2 - NEW.winner);
+	UPDATE Standings SET matches = matches + 1,
+	omw = omw + (SELECT opponent.wins FROM Standings opponent
+		WHERE opponent.tournament_id = NEW.tournament_id
+		AND opponent.player_id = NEW.player_1 + NEW.player_2 - Standings.player_id)
+	WHERE tournament_id = NEW.tournament_id AND player_id IN (NEW.player_1, NEW.player_2);
+END;
+
+--insert an artificial player to act as the bye round.
+
+INSERT INTO Players (id, name) VALUES (0, 'bye round');
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+#
+# tournament_state.py -- an in-memory Swiss-system tournament
+#
+# TournamentState implements the tournament.py API for a single tournament
+# without a round trip to the database per call.  A state can be loaded from
+# the database and, optionally, write its changes back behind the scenes.
+
+from array import array
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import swiss
+import tournament
+
+# player ids reserved from the database at a time when persisting
+
+ID_BLOCK = 100
+
+
+class TournamentState(object):
+    """A single tournament held in memory.
+
+    Players and matches are kept in compact arrays indexed by the order in
+    which players entered the tournament, and wins, matches and OMW are
+    updated as each match is reported, so reads never recompute anything.
+
+    Args:
+      tournament: the tournament id.
+      name: the tournament name.
+      writer: a WriteBehind that persists changes, or None to stay in
+        memory only.
+    """
+
+    def __init__(self, tournament=1, name="Tournament 1", writer=None):
+        self.tournament = tournament
+        self.name = name
+        self.writer = writer
+        # player id -> index into the player arrays
+        self._index = {}
+        self._ids = array('l')
+        self._names = []
+        self._wins = array('l')
+        self._matches = array('l')
+        self._omw = array('l')
+        self._byes = array('b')
+        # opponent indexes of each player
+        self._opponents = []
+        # one entry per match, winner is -1 for a tie
+        self._player_1 = array('l')
+        self._player_2 = array('l')
+        self._winner = array('l')
+        self._free_ids = []
+        self._next_id = 1
+
+    @classmethod
+    def load(cls, tournament_id=1, writer=None, session=None):
+        """Loads a tournament from the database, one query per table."""
+        with tournament.transaction(session) as t:
+            query = "SELECT name FROM Tournaments WHERE id = %s"
+            row = tournament.sql("fetchone", query, (tournament_id,), t)
+            if row is None:
+                raise ValueError(
+                    "Tournament %d does not exist." % tournament_id)
+            query = ("SELECT Players.id, Players.name FROM Registrants "
+                     "JOIN Players ON (Registrants.player_id = Players.id) "
+                     "WHERE Registrants.tournament_id = %s "
+                     "ORDER BY Players.id")
+            players = tournament.sql("fetchall", query, (tournament_id,), t)
+            query = ("SELECT player_1, player_2, winner FROM Matches "
+                     "WHERE tournament_id = %s")
+            matches = tournament.sql("fetchall", query, (tournament_id,), t)
+        state = cls(tournament_id, row[0])
+        for player_id, name in players:
+            state.enterTournament(player_id, name)
+        for player_1, player_2, winner in matches:
+            if winner is None:
+                state.reportMatch(player_1, player_2, tied="y")
+            else:
+                state.reportMatch(winner, player_1 + player_2 - winner)
+        # only changes made after loading are written back
+        state.writer = writer
+        return state
+
+    # "create" functions
+
+    def _newId(self):
+        if self.writer is None:
+            player_id = self._next_id
+            self._next_id += 1
+            return player_id
+        if not self._free_ids:
+            self._free_ids = self.writer.reservePlayerIds(ID_BLOCK)
+            self._free_ids.reverse()
+        return self._free_ids.pop()
+
+    def reportMatch(self, winner, loser, tied="n"):
+        """Records the outcome of a single match between two players."""
+        row = tournament.matchRow(winner, loser, self.tournament, tied)
+        if winner == loser:
+            raise ValueError("A player can't play against themselves.")
+        if not self.isRegistered(winner) or not self.isRegistered(loser):
+            raise ValueError(
+                "Both players must be registered for the tournament.")
+        a, b = self._index[winner], self._index[loser]
+        if b in self._opponents[a]:
+            raise ValueError(
+                "Players %d and %d have already played." % (winner, loser))
+        # each player gains the other as an opponent, and their wins
+        self._omw[a] += self._wins[b]
+        self._omw[b] += self._wins[a]
+        self._matches[a] += 1
+        self._matches[b] += 1
+        self._opponents[a].append(b)
+        self._opponents[b].append(a)
+        self._player_1.append(a)
+        self._player_2.append(b)
+        if tied == "n":
+            self._winner.append(a)
+            self._wins[a] += 1
+            for opponent in self._opponents[a]:
+                self._omw[opponent] += 1
+        else:
+            self._winner.append(-1)
+        if loser == 0:
+            self._byes[a] = 1
+        if self.writer is not None:
+            self.writer.put("Matches", row)
+
+    # "read" functions
+
+    def countPlayers(self):
+        """Returns the number of players registered for the tournament."""
+        return len(self._ids)
+
+    def isRegistered(self, player_id=0):
+        """Determines if a specific player is registered for the tournament."""
+        return player_id in self._index
+
+    def playerStandings(self):
+        """Returns a list of the players and their win records, sorted by wins.
+
+        Returns:
+          A list of (id, name, wins, matches) tuples, as
+          tournament.playerStandings() does.
+        """
+        order = sorted(
+            (i for i in range(len(self._ids)) if self._ids[i] != 0),
+            key=lambda i: (-self._wins[i], -self._omw[i], self._ids[i]))
+        return [(self._ids[i], self._names[i], self._wins[i],
+                 self._matches[i]) for i in order]
+
+    def swissPairings(self):
+        """Returns a list of pairs of players for the next round of a match.
+
+        Returns:
+          A list of (id1, name1, id2, name2) tuples, as
+          tournament.swissPairings() does.
+        """
+        standings = self.playerStandings()
+        # if there are an odd number of players, register a bye round
+        bye = len(standings) % 2 == 1
+        if bye and not self.isRegistered(0):
+            self.enterTournament(0)
+        return swiss.pairings(standings, self.playedPairs(), bye)
+
+    def playedPairs(self):
+        """Returns the set of pairs of players who have met."""
+        ids = self._ids
+        return set(swiss.pairKey(ids[a], ids[b])
+                   for a, b in zip(self._player_1, self._player_2))
+
+    def byeMatch(self):
+        """Returns the bye round match-up for the highest placed player who
+        hasn't had a bye yet.  The bye round must already be registered.
+        """
+        if not self.isRegistered(0):
+            return []
+        result = []
+        for row in self.playerStandings():
+            result = row
+            if not self._byes[self._index[row[0]]]:
+                return row[:2] + (0, 'bye round')
+        return result
+
+    # "update" functions
+
+    def enterTournament(self, player_id, name="bye round"):
+        """Enters a player, who must already exist, into the tournament."""
+        if self.isRegistered(player_id):
+            raise ValueError(
+                "Player %d is already registered." % player_id)
+        self._index[player_id] = len(self._ids)
+        self._ids.append(player_id)
+        self._names.append(name)
+        self._wins.append(0)
+        self._matches.append(0)
+        self._omw.append(0)
+        self._byes.append(0)
+        self._opponents.append(array('l'))
+        self._next_id = max(self._next_id, player_id + 1)
+        if self.writer is not None:
+            self.writer.put("Registrants", (self.tournament, player_id))
+
+    def registerPlayer(self, name):
+        """Adds a new player to the tournament.  Returns the player's id."""
+        player_id = self._newId()
+        if self.writer is not None:
+            self.writer.put("Players", (player_id, name))
+        self.enterTournament(player_id, name)
+        return player_id
+
+    def registerPlayers(self, names):
+        """Adds many players to the tournament.  Returns their ids in order."""
+        return [self.registerPlayer(name) for name in names]
+
+    # persistence
+
+    def flush(self):
+        """Waits until every change so far has been written to the database."""
+        if self.writer is not None:
+            self.writer.flush()
+
+
+class WriteBehind(object):
+    """Writes tournament changes to the database from a background thread.
+
+    Rows are queued by put() and written in batches, each batch in one
+    transaction of multi-row INSERTs.  An error in the background thread is
+    raised again by the next call to flush() or close().
+
+    Args:
+      tournament_id: the tournament the rows belong to.
+      name: the tournament name, used if it has to be created.
+      batch_size: the most rows written in one transaction.
+    """
+
+    # tables in the order their rows must be inserted
+    COLUMNS = [
+        ("Players", ("id", "name")),
+        ("Registrants", ("tournament_id", "player_id")),
+        ("Matches", ("tournament_id", "player_1", "player_2", "winner")),
+    ]
+
+    def __init__(self, tournament_id=1, name="Tournament 1",
+                 batch_size=tournament.BATCH_SIZE):
+        self.tournament = tournament_id
+        self.name = name
+        self.batch_size = batch_size
+        self.error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def reservePlayerIds(self, count):
+        """Reserves player ids from the database right away."""
+        return tournament.reservePlayerIds(count)
+
+    def put(self, table, row):
+        """Queues a row to be inserted into a table."""
+        self._queue.put((table, row))
+
+    def flush(self):
+        """Blocks until every queued row has been written."""
+        self._queue.join()
+        self._raise()
+
+    def close(self):
+        """Writes the remaining rows and stops the background thread."""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        stop = False
+        while not stop:
+            items = [self._queue.get()]
+            while len(items) < self.batch_size and items[-1] is not None:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if items[-1] is None:
+                stop = True
+                items.pop()
+                self._queue.task_done()
+            try:
+                if items:
+                    self._write(items)
+            except Exception as error:
+                self.error = error
+            finally:
+                for item in items:
+                    self._queue.task_done()
+
+    def _write(self, items):
+        rows = dict((table, []) for table, columns in self.COLUMNS)
+        for table, row in items:
+            rows[table].append(row)
+        with tournament.transaction() as t:
+            tournament.ensureTournament(self.tournament, self.name, t)
+            if rows["Matches"]:
+                tournament.deferStandings(t)
+            for table, columns in self.COLUMNS:
+                tournament.insertMany(table, columns, rows[table], t)
+            if rows["Matches"]:
+                tournament.rebuildStandings(self.tournament, t)
+            else:
+                tournament.standingsChanged(self.tournament, t)
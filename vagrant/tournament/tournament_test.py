@@ -2,7 +2,25 @@
 #
 # Test cases for tournament.py
 
+import argparse
+import multiprocessing
+import sys
+import traceback
+from StringIO import StringIO
+
+# the storage backend under test, "postgres" or "sqlite", is chosen by
+# TOURNAMENT_BACKEND when tournament.py loads (see configureBackend())
 from tournament import *
+import tournament_fixtures
+from tournament_state import TournamentState, WriteBehind
+
+
+def needsPostgres(number, name):
+    """Prints that a test is skipped unless the backend is PostgreSQL."""
+    if BACKEND == "postgres":
+        return False
+    print "%d. %s skipped, it needs PostgreSQL." % (number, name)
+    return True
 
 
 def testDeleteMatches():
@@ -166,17 +184,24 @@ def testTied():
     deletePlayers()
     registerPlayer("Rams")
     registerPlayer("49ers")
+    registerPlayer("Bears")
+    registerPlayer("Colts")
     standings = playerStandings()
-    [id1, id2] = [row[0] for row in standings]
+    [id1, id2, id3, id4] = [row[0] for row in standings]
     reportMatch(id1, id2, 1, "y")
+    reportMatch(id3, id4)
     standings = playerStandings()
+    records = dict((row[0], row[2:]) for row in standings)
+    if records[id1] != (0, 1) or records[id2] != (0, 1):
+        raise ValueError(
+            "Tied matches not supported.")
     pairings = swissPairings()
-    [(pid1, pname1, pid2, pname2)] = pairings
-    correct_pairs = set([frozenset([id1, id2])])
-    actual_pairs = set([frozenset([pid1, pid2])])
+    correct_pairs = set([frozenset([id1, id3]), frozenset([id2, id4])])
+    actual_pairs = set([frozenset([pid1, pid2])
+                        for (pid1, pname1, pid2, pname2) in pairings])
     if correct_pairs != actual_pairs:
         raise ValueError(
-            "Tied matches not supported.")
+            "Tied players should not be paired again.")
     print "11. Tied matches can be reported."
 
 # this function tests if multiple tournaments are supported.
@@ -288,18 +313,642 @@ def testOMW():
     print "13. Standings are sorted by Opponent Match Wins."
 
 
-if __name__ == '__main__':
-    testDeleteMatches()
-    testDelete()
-    testCount()
-    testRegister()
-    testRegisterCountDelete()
-    testStandingsBeforeMatches()
-    testReportMatches()
-    testPairings()
-    print "All basic tests pass. \n"
-    testOdd()
-    testTied()
-    testMultipleTourneys()
-    testOMW()
+# this function tests that a transaction commits or rolls back as one unit.
+
+
+def testTransaction():
+    deleteMatches()
+    deletePlayers()
+    try:
+        with transaction() as t:
+            registerPlayer("Bonnie", session=t)
+            registerPlayer("Clyde", session=t)
+            raise RuntimeError("abandon the registration")
+    except RuntimeError:
+        pass
+    if countPlayers() != 0:
+        raise ValueError(
+            "A failed transaction should not register any players.")
+    with transaction() as t:
+        id1 = registerPlayer("Bonnie", session=t)
+        id2 = registerPlayer("Clyde", session=t)
+    if set(row[0] for row in playerStandings()) != set([id1, id2]):
+        raise ValueError(
+            "registerPlayer should return the ids of the players it adds.")
+    print "14. Transactions commit or roll back as a unit."
+
+# this function tests registering players and reporting matches in bulk.
+
+
+def testBulk():
+    deleteMatches()
+    deletePlayers()
+    names = ["North", "South", "East", "West"]
+    ids = registerPlayers(names)
+    standings = playerStandings()
+    if dict((row[0], row[1]) for row in standings) != dict(zip(ids, names)):
+        raise ValueError(
+            "registerPlayers should return ids in the order of the names.")
+    try:
+        reportMatches([(ids[0], ids[1]), (ids[2], ids[3], "maybe")])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("reportMatches should reject invalid ties.")
+    reportMatches([(ids[0], ids[1]), (ids[2], ids[3], "y")])
+    wins = dict((row[0], row[2]) for row in playerStandings())
+    if wins != {ids[0]: 1, ids[1]: 0, ids[2]: 0, ids[3]: 0}:
+        raise ValueError("Bulk results should update the standings.")
+    print "15. Players and matches can be recorded in bulk."
+
+# this function tests that the stored standings stay consistent with the
+# matches, and can be rebuilt if they are not.
+
+
+def testStoredStandings():
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3, id4] = registerPlayers(["Ann", "Ben", "Cat", "Dan"])
+    reportMatch(id1, id2)
+    reportMatch(id3, id4, 1, "y")
+    reportMatches([(id1, id3), (id2, id4)])
+    if checkStandings() != []:
+        raise ValueError("Stored standings should match the matches.")
+    sql("commit", "UPDATE Standings SET wins = 5 WHERE player_id = %s",
+        (id4,))
+    if [row[0] for row in checkStandings()] != [id4]:
+        raise ValueError("checkStandings should find inconsistent rows.")
+    rebuildStandings()
+    if checkStandings() != []:
+        raise ValueError("rebuildStandings should repair the standings.")
+    print "16. Stored standings are kept consistent and can be rebuilt."
+
+# this function tests the in-memory tournament against the database.
+
+
+def testTournamentState():
+    if needsPostgres(17, "In-memory tournaments"):
+        return
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3] = registerPlayers(["Huey", "Dewey", "Louie"])
+    reportMatch(id1, id2)
+    state = TournamentState.load(1)
+    if state.playerStandings() != playerStandings():
+        raise ValueError(
+            "A loaded tournament should have the same standings.")
+    writer = WriteBehind(1)
+    state.writer = writer
+    id4 = state.registerPlayer("Scrooge")
+    state.reportMatch(id3, id4)
+    state.reportMatch(id4, id1, "y")
+    writer.close()
+    if state.playerStandings() != playerStandings():
+        raise ValueError(
+            "Changes made in memory should be written to the database.")
+    print "17. In-memory tournaments load from and write to the database."
+
+# this function tests that pairings never repeat a match, even when that
+# means pairing players outside their score bracket.
+
+
+def testNoRematches():
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3, id4, id5, id6] = registerPlayers(
+        ["Ace", "Deuce", "Trey", "Four", "Five", "Six"])
+    reportMatches([(id1, id2), (id3, id4), (id5, id6)])
+    reportMatches([(id1, id3), (id5, id2), (id4, id6)])
+    played = set(frozenset(pair) for pair in playedPairs())
+    for round in range(3):
+        pairings = swissPairings()
+        pairs = [frozenset([row[0], row[2]]) for row in pairings]
+        if len(pairs) != 3 or played.intersection(pairs):
+            raise ValueError("swissPairings should never pair a rematch.")
+        played.update(pairs)
+        reportMatches([(row[0], row[2]) for row in pairings])
+    try:
+        swissPairings()
+    except swiss.SearchExhausted:
+        raise ValueError(
+            "swissPairings should know no pairing is left, not give up.")
+    except ValueError:
+        pass
+    else:
+        raise ValueError(
+            "swissPairings should fail once everyone has played everyone.")
+    # 1-4 and 2-3 can still play, but only after backing out of 1-3
+    rows = [(player, "Player %d" % player, 0) for player in (1, 2, 3, 4)]
+    limit = swiss.BACKTRACK_LIMIT
+    swiss.BACKTRACK_LIMIT = 0
+    try:
+        swiss.pairings(rows, swiss.playedPairs([(1, 2), (2, 4)]))
+    except swiss.SearchExhausted:
+        pass
+    else:
+        raise ValueError("The pairing search should give up at its limit.")
+    finally:
+        swiss.BACKTRACK_LIMIT = limit
+    print "18. Pairings never repeat a match."
+
+# this function counts the queries a call sends through sql().
+
+
+def countQueries(function, *args):
+    stats.reset()
+    function(*args)
+    return stats.calls[function.__name__]["queries"]
+
+# this function tests that picking a bye takes a single query, and that
+# pairing a round doesn't cost more queries as the tournament grows.
+
+
+def testByeQueries():
+    counts = []
+    for players in (5, 25):
+        deleteMatches()
+        deletePlayers()
+        ids = registerPlayers(["Player %d" % i for i in range(players)])
+        enterTournament(0)
+        reportMatches([(ids[i], 0) for i in range(players - 1)])
+        if byeMatch()[0] != ids[-1]:
+            raise ValueError(
+                "The bye should go to the player who hasn't had one.")
+        if countQueries(byeMatch) != 1:
+            raise ValueError("byeMatch should take a single query.")
+        counts.append(countQueries(swissPairings))
+    if counts[0] != counts[1]:
+        raise ValueError(
+            "swissPairings should take the same number of queries "
+            "for any number of players.")
+    print "19. A bye is picked with a single query."
+
+# this function tests that cached standings are served without a query and
+# are never stale after a change.
+
+
+def testStandingsCache():
+    if needsPostgres(20, "The standings cache"):
+        return
+    configureCache(2)
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3, id4] = registerPlayers(["Bert", "Ernie", "Elmo", "Zoe"])
+    playerStandings()
+    if countQueries(playerStandings) != 0 or cache.hits != 1:
+        raise ValueError("Repeated standings should come from the cache.")
+    reportMatch(id3, id1)
+    if playerStandings()[0][0] != id3:
+        raise ValueError("Reporting a match should invalidate the cache.")
+    with transaction() as t:
+        reportMatch(id4, id2, session=t)
+        playerStandings()
+    if playerStandings()[1][0] != id4:
+        raise ValueError("A commit should invalidate the cache.")
+    playerStandings(2)
+    playerStandings(3)
+    if cache.evictions == 0 or cache.asDict()["cached"] != 2:
+        raise ValueError("The cache should evict the least recently used.")
+    configureCache(0)
+    print "20. Standings are cached until they change."
+
+# this function tests playing a round from its pairings to its results.
+
+
+def testRound():
+    if needsPostgres(21, "Rounds"):
+        return
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3, id4, id5] = registerPlayers(
+        ["Anna", "Boris", "Clara", "Dmitri", "Eva"])
+    first = startRound()
+    if first.number != 1 or len(first.pairings) != 3:
+        raise ValueError("A round should pair every player once.")
+    if len(first.pendingMatches()) != 2:
+        raise ValueError("The bye round should be reported when paired.")
+    try:
+        startRound()
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A round can't start before the last one is done.")
+    (a, b), (c, d) = [(row[0], row[2]) for row in first.pendingMatches()]
+    first.reportMatch(b, a)
+    try:
+        first.commit()
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A round can't be committed with results missing.")
+    currentRound().reportMatch(c, d, "y")
+    if [row[2] for row in playerStandings()] != [0] * 5:
+        raise ValueError("Results shouldn't count until the round commits.")
+    first.commit()
+    wins = dict((row[0], row[2]) for row in playerStandings())
+    if wins[b] != 1 or wins[a] != 0 or wins[c] != 0 or \
+            wins[first.pairings[0][0]] != 1:
+        raise ValueError("Committing a round should record its results.")
+    if currentRound() is not None or startRound().number != 2:
+        raise ValueError("The next round should start once one commits.")
+    print "21. Rounds are paired, reported and committed as a whole."
+
+# this function tests that the history of rounds and opponents is kept.
+
+
+def testRoundHistory():
+    if needsPostgres(22, "Round history"):
+        return
+    deleteMatches()
+    deletePlayers()
+    ids = registerPlayers(["North", "East", "South", "West"])
+    reportMatch(ids[0], ids[1])
+    current = startRound()
+    for row in current.pendingMatches():
+        current.reportMatch(row[0], row[2])
+    current.commit()
+    rounds = sql("fetchall", "SELECT player_1, player_2, round FROM Matches")
+    if sorted(row[2] for row in rounds) != [None, 1, 1]:
+        raise ValueError("Matches should record the round they were in.")
+    if playedPairs() != set(swiss.pairKey(*row[:2]) for row in rounds):
+        raise ValueError("Opponents should hold every pair that has met.")
+    print "22. Rounds and opponents are kept as history."
+
+# this function tests ordering standings by other tiebreaks than OMW.
+
+
+def testTiebreaks():
+    if tiebreaks.numpy is None:
+        print "23. Tiebreaks skipped, NumPy is not installed."
+        return
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3, id4] = registerPlayers(["Tal", "Petrosian", "Smyslov",
+                                            "Botvinnik"])
+    reportMatches([(id1, id2), (id3, id4), (id1, id3, "y"), (id2, id4)])
+    if [row[0] for row in playerStandings()] != [id1, id2, id3, id4]:
+        raise ValueError("Standings should be ordered by wins and OMW.")
+    setTiebreaks(["points", "sonneborn_berger"])
+    if [row[0] for row in playerStandings()] != [id1, id3, id2, id4]:
+        raise ValueError("Standings should be ordered by the tiebreaks.")
+    scores = tiebreaks.computeTiebreaks(
+        [id1, id2, id3, id4], sql("fetchall", TIEBREAK_MATCHES_QUERY, (1,)))
+    if list(scores["buchholz"]) != [7, 4, 4, 7] or \
+            list(scores["sonneborn_berger"]) != [5, 0, 2, 0]:
+        raise ValueError("Tiebreaks should be computed from the matches.")
+    setTiebreaks([])
+    print "23. Standings can be ordered by other tiebreaks."
+
+# this function tests computing standings from the matches in memory.
+
+
+def testArrayStandings():
+    if needsPostgres(24, "Array standings"):
+        return
+    if tiebreaks.numpy is None:
+        print "24. Array standings skipped, NumPy is not installed."
+        return
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Player %d" % i for i in range(9)])
+    for n in range(3):
+        current = startRound()
+        for id1, name1, id2, name2 in current.pendingMatches():
+            current.reportMatch(id1, id2, "y" if id1 % 3 == 0 else "n")
+        current.commit()
+    if arrayStandings() != [tuple(row) for row in playerStandings()]:
+        raise ValueError(
+            "Array standings should match the stored standings.")
+    print "24. Standings can be computed from packed match arrays."
+
+# this function tests reading standings a row or a page at a time.
+
+
+def testStandingsPages():
+    if needsPostgres(25, "Standings pages"):
+        return
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Player %d" % i for i in range(11)])
+    for n in range(2):
+        current = startRound()
+        for id1, name1, id2, name2 in current.pendingMatches():
+            current.reportMatch(id1, id2, "y" if id1 % 4 == 0 else "n")
+        current.commit()
+    standings = [tuple(row) for row in playerStandings()]
+    if [tuple(row) for row in iterStandings(size=3)] != standings:
+        raise ValueError("Streamed standings should match playerStandings.")
+    pages = [standingsPage(limit=4)]
+    while pages[-1]:
+        pages.append(standingsPage(after=pages[-1][-1][0], limit=4))
+    if [tuple(row) for page in pages for row in page] != standings:
+        raise ValueError("Pages should add up to the whole standings.")
+    if [playerRank(row[0]) for row in standings] != \
+            range(1, len(standings) + 1):
+        raise ValueError("Ranks should be places in the standings.")
+    if playerRank(0) is not None:
+        raise ValueError("The bye round shouldn't have a rank.")
+    print "25. Standings can be streamed, paged and ranked."
+
+# the stress test below runs STRESS_WORKERS processes at once, each of which
+# registers STRESS_PLAYERS players into two tournaments that don't exist yet
+
+STRESS_WORKERS = 32
+STRESS_PLAYERS = 20
+STRESS_TOURNAMENTS = (3001, 3002)
+STRESS_ROUNDS = 3
+
+
+def stressRegister(worker):
+    registered = []
+    for i in range(STRESS_PLAYERS):
+        name = "Worker %d player %d" % (worker, i)
+        tournament = STRESS_TOURNAMENTS[i % 2]
+        registered.append((registerPlayer(name, tournament), name,
+                           tournament))
+    return registered
+
+
+def stressReport(task):
+    bulk, tournament, results = task
+    if bulk:
+        reportMatches(results, tournament)
+    else:
+        for winner, loser in results:
+            reportMatch(winner, loser, tournament)
+
+
+def stressStartRound(tournament):
+    try:
+        startRound(tournament)
+        return True
+    except ValueError:
+        return False
+
+# this function tests registering players and reporting matches from many
+# processes at once.
+
+
+def testConcurrentWriters():
+    if needsPostgres(26, "Concurrent writers"):
+        return
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # the workers must open connections of their own
+    closePool()
+    workers = multiprocessing.Pool(STRESS_WORKERS)
+    try:
+        registered = sum(workers.map(stressRegister,
+                                     range(STRESS_WORKERS)), [])
+        names = dict(sql("fetchall",
+                         "SELECT id, name FROM Players WHERE id != 0"))
+        if len(names) != len(registered) or \
+                names != dict((row[0], row[1]) for row in registered):
+            raise ValueError(
+                "Every player should be registered once, under their id.")
+        tasks = []
+        expected = set()
+        for tournament in STRESS_TOURNAMENTS:
+            ids = sorted(row[0] for row in registered
+                         if row[2] == tournament)
+            if countPlayers(tournament) != len(ids):
+                raise ValueError(
+                    "Every player should be registered for their tournament.")
+            results = []
+            for r in range(STRESS_ROUNDS):
+                for i in range(len(ids)):
+                    j = i ^ (1 << r)
+                    if i < j < len(ids):
+                        results.append((ids[i], ids[j]))
+            expected.update((tournament,) + result for result in results)
+            share = STRESS_WORKERS // len(STRESS_TOURNAMENTS)
+            tasks.extend((n % 2 == 0, tournament, results[n::share])
+                         for n in range(share))
+        workers.map(stressReport, tasks)
+        matches = sql("fetchall", "SELECT tournament_id, player_1, player_2 "
+                      "FROM Matches WHERE winner = player_1")
+        if len(matches) != len(expected) or set(matches) != expected:
+            raise ValueError("Every match should be recorded once.")
+        for tournament in STRESS_TOURNAMENTS:
+            if checkStandings(tournament) != []:
+                raise ValueError(
+                    "Concurrent results should all count in the standings.")
+        started = workers.map(stressStartRound,
+                              [STRESS_TOURNAMENTS[0]] * STRESS_WORKERS)
+        if started.count(True) != 1:
+            raise ValueError("Only one worker should start the next round.")
+    finally:
+        workers.close()
+        workers.join()
+    print "26. Concurrent writers neither lose nor misattribute rows."
+
+# this function tests starting a round of many tournaments at once.
+
+
+def testPairAll():
+    if needsPostgres(27, "Pairing many tournaments"):
+        return
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    sizes = {4001: 6, 4002: 7, 4003: 8}
+    for tournament, size in sizes.items():
+        registerPlayers(["Player %d" % i for i in range(size)], tournament)
+    rounds = pairAll(sizes.keys(), processes=2)
+    for tournament, size in sizes.items():
+        current = currentRound(tournament)
+        if current.number != 1 or \
+                current.pairings != rounds[tournament].pairings:
+            raise ValueError("pairAll() should store every round it starts.")
+        players = set(row[0] for row in playerStandings(tournament))
+        paired = set(row[i] for row in current.pairings for i in (0, 2))
+        if paired != players | set([0] if size % 2 else []):
+            raise ValueError("Every player should be paired once.")
+    try:
+        pairAll(sizes.keys())
+        raise RuntimeError("pairAll() shouldn't start a round twice.")
+    except ValueError:
+        pass
+    print "27. Many tournaments can be paired at once."
+
+# this function tests following standings changes as results come in.
+
+
+def testStandingsFeed():
+    if needsPostgres(28, "The standings feed"):
+        return
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3, id4, id5, id6] = registerPlayers(
+        ["Player %d" % i for i in range(6)])
+    reportMatches([(id1, id2), (id3, id4)])
+    feed = StandingsFeed([1])
+    try:
+        reportMatch(id1, id3)
+        deltas = feed.poll(5)
+        # id2 gains OMW from id1's win, but id4's OMW doesn't change
+        if [(delta[0], sorted(row[0] for row in delta[1]), delta[2])
+                for delta in deltas] != [(1, sorted([id1, id2, id3]), [])]:
+            raise ValueError(
+                "A result should announce the players it changed.")
+        reportMatches([(id5, id6), (id2, id4)])
+        deltas = feed.poll(5)
+        if len(deltas) != 1 or \
+                set(row[0] for row in deltas[0][1]) != \
+                set([id1, id2, id4, id5, id6]):
+            raise ValueError(
+                "Bulk results should be announced once, with every change.")
+        if feed.poll(0.1) != []:
+            raise ValueError("Nothing should be announced without results.")
+    finally:
+        feed.close()
+    print "28. Standings changes are announced as results come in."
+
+
+# this function tests archiving and deleting a single tournament.
+
+
+def testArchive():
+    if needsPostgres(29, "Archiving tournaments"):
+        return
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Player %d" % i for i in range(4)], 5001)
+    # 5002 has two pairs left to play after its first match
+    [id5, id6, id7] = registerPlayers(
+        ["Player %d" % i for i in range(4, 7)], 5002)
+    enterTournament(id1, 5002)
+    reportMatches([(id1, id2), (id3, id4), (id1, id3), (id2, id4, "y")],
+                  5001)
+    reportMatch(id5, id1, 5002)
+    standings = playerStandings(5001)
+    archiveTournament(5001)
+    if tournamentExists(5001) or countPlayers(5001) != 0:
+        raise ValueError("An archived tournament should leave the live "
+                         "tables.")
+    if archivedStandings(5001) != standings:
+        raise ValueError("An archived tournament should keep its standings.")
+    if [row[2] for row in playerStandings(5002)] != [1, 0, 0, 0] or \
+            checkStandings(5002) != []:
+        raise ValueError("Archiving should leave other tournaments alone.")
+    try:
+        archiveTournament(5001)
+        raise RuntimeError("A tournament can't be archived twice.")
+    except ValueError:
+        pass
+    startRound(5002)
+    try:
+        archiveTournament(5002)
+        raise RuntimeError("A tournament can't be archived mid-round.")
+    except ValueError:
+        pass
+    if not deleteTournament(5001) or archivedStandings(5001) != []:
+        raise ValueError("An archived tournament should be deletable.")
+    if not deleteTournament(5002) or countPlayers(5002) != 0:
+        raise ValueError("A live tournament should be deletable.")
+    if sql("fetchone", "SELECT COUNT(*) FROM Players WHERE id IN (%s, %s)",
+           (id1, id5))[0] != 2:
+        raise ValueError("Deleting a tournament should keep its players.")
+    print "29. Tournaments can be archived or deleted one at a time."
+
+# every test, in the order they run; the first BASIC_TESTS are the basic ones
+
+TESTS = [testDeleteMatches, testDelete, testCount, testRegister,
+         testRegisterCountDelete, testStandingsBeforeMatches,
+         testReportMatches, testPairings, testOdd, testTied,
+         testMultipleTourneys, testOMW, testTransaction, testBulk,
+         testStoredStandings, testTournamentState, testNoRematches,
+         testByeQueries, testStandingsCache, testRound, testRoundHistory,
+         testTiebreaks, testArrayStandings, testStandingsPages,
+         testConcurrentWriters, testPairAll, testStandingsFeed,
+         testArchive]
+BASIC_TESTS = 8
+
+
+def runTests():
+    """Runs every test in turn against the configured database."""
+    for n, test in enumerate(TESTS):
+        test()
+        if n + 1 == BASIC_TESTS:
+            print "All basic tests pass. \n"
+    print "Success!  All tests pass! \n"
+
+
+def runCloned(test, results):
+    """Runs a test against a database of its own, and puts its name, what it
+    printed and its traceback, if it failed, on the results queue."""
+    sys.stdout = output = StringIO()
+    error = None
+    try:
+        if BACKEND == "sqlite":
+            configureBackend("sqlite", ":memory:")
+            test()
+        else:
+            with tournament_fixtures.clonedDatabase():
+                test()
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        sys.stdout = sys.__stdout__
+    results.put((test.__name__, output.getvalue(), error))
+
+
+def runParallel(workers):
+    """Runs every test in a process of its own, workers of them at a time.
+
+    Each test runs in its own clone of the template database (see
+    tournament_fixtures.py), or its own in-memory database for SQLite, so
+    tests can't see each other's rows.  Their output is printed in order
+    once all have finished.
+
+    Returns:
+      True if every test passed.
+    """
+    results = multiprocessing.Queue()
+    processes = []
+    finished = {}
+    for test in TESTS:
+        if len(processes) - len(finished) >= workers:
+            name, output, error = results.get()
+            finished[name] = (output, error)
+        # the tests' own worker pools must be able to start processes
+        process = multiprocessing.Process(target=runCloned,
+                                          args=(test, results))
+        process.start()
+        processes.append(process)
+    while len(finished) < len(TESTS):
+        name, output, error = results.get()
+        finished[name] = (output, error)
+    for process in processes:
+        process.join()
+    errors = []
+    for n, test in enumerate(TESTS):
+        output, error = finished[test.__name__]
+        sys.stdout.write(output)
+        if error:
+            errors.append(error)
+        if n + 1 == BASIC_TESTS and not errors:
+            print "All basic tests pass. \n"
+    for error in errors:
+        sys.stdout.write(error)
+    if errors:
+        print "%d of %d tests failed." % (len(errors), len(TESTS))
+        return False
     print "Success!  All tests pass! \n"
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tests for tournament.py")
+    parser.add_argument(
+        "--workers", type=int,
+        help="run each test in a clone of the template database, this many "
+        "at a time, instead of in turn against the tournament database")
+    args = parser.parse_args()
+    if args.workers is None:
+        runTests()
+    elif not runParallel(max(args.workers, 1)):
+        sys.exit(1)